@@ -1,7 +1,15 @@
 # attendance/admin.py
 
-from django.contrib import admin
-from .models import AttendanceCode, AttendanceRecord, Enrollment, AbsenceJustification
+from django import forms
+from django.contrib import admin, messages
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from .models import AttendanceCode, AttendanceRecord, Enrollment, AbsenceJustification, DailyAttendanceStat
+from .rollups import refresh_daily_stats_for_sessions
+from .schedule_import import TABLES, ScheduleImportError, import_schedule, parse_csv, parse_json
+from .submission_feed import touch_records
+from courses.models import ClassSession
 
 @admin.register(AttendanceCode)
 class AttendanceCodeAdmin(admin.ModelAdmin):
@@ -34,7 +42,7 @@ class AttendanceRecordAdmin(admin.ModelAdmin):
     list_display = ('student', 'class_session', 'timestamp', 'is_present', 'ai_result_status')
     list_filter = ('is_present', 'class_session__course', 'class_session__date', 'student__role')
     search_fields = ('student__username', 'class_session__course__name', 'simulated_ip')
-    readonly_fields = ('timestamp', 'simulated_ip', 'simulated_geolocation', 'ai_result')
+    readonly_fields = ('timestamp', 'simulated_ip', 'simulated_geolocation', 'ai_result', 'version')
     date_hierarchy = 'timestamp' # For date-based drilldown
 
     # Custom method to display AI result status
@@ -49,7 +57,17 @@ class AttendanceRecordAdmin(admin.ModelAdmin):
 
     @admin.action(description='Mark selected attendance records as Present')
     def mark_as_present(self, request, queryset):
+        records_by_session = {}
+        for record_id, class_session_id in queryset.values_list('id', 'class_session_id'):
+            records_by_session.setdefault(class_session_id, []).append(record_id)
+
         updated_count = queryset.update(is_present=True)
+        # update() skips post_save, so refresh the daily rollups and feed versions explicitly
+        refresh_daily_stats_for_sessions(
+            ClassSession.objects.filter(attendance_records__in=queryset).distinct()
+        )
+        for class_session_id, record_ids in records_by_session.items():
+            touch_records(class_session_id, record_ids)
         self.message_user(
             request,
             f'{updated_count} attendance records were successfully marked as Present.',
@@ -66,10 +84,85 @@ class EnrollmentAdmin(admin.ModelAdmin):
     list_filter = ('course', 'student')
     search_fields = ('student__username', 'course__name')
     readonly_fields = ('enrollment_date',)
-    
+    change_list_template = 'admin/attendance/enrollment/change_list.html'
+
+    def get_urls(self):
+        return [
+            path('import/', self.admin_site.admin_view(self.import_schedule_view), name='attendance_enrollment_import'),
+        ] + super().get_urls()
+
+    def import_schedule_view(self, request):
+        """Upload form for attendance.schedule_import (same input as the import_schedule command)."""
+        if not request.user.has_perm('attendance.add_enrollment'):
+            return redirect('admin:attendance_enrollment_changelist')
+
+        form = ScheduleImportForm(request.POST or None, request.FILES or None)
+        errors = []
+        result = None
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            table = form.cleaned_data['table']
+            try:
+                if table == 'json':
+                    data = parse_json(upload)
+                else:
+                    data = parse_csv(table, upload)
+                result = import_schedule(
+                    data,
+                    default_password=form.cleaned_data['default_password'] or None,
+                    dry_run=form.cleaned_data['dry_run'],
+                )
+            except ScheduleImportError as error:
+                errors = error.errors[:100]
+                self.message_user(request, f'{len(error.errors)} invalid rows, nothing was imported.', level=messages.ERROR)
+            except (UnicodeDecodeError, ValueError) as error:
+                self.message_user(request, f'Could not read the file: {error}', level=messages.ERROR)
+            else:
+                self.message_user(
+                    request,
+                    f"{'Dry run: ' if form.cleaned_data['dry_run'] else ''}{result.total_rows} rows in "
+                    f"{result.elapsed:.2f}s ({result.rows_per_second:,.0f} rows/s).",
+                    level=messages.WARNING if form.cleaned_data['dry_run'] else messages.SUCCESS,
+                )
+
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import schedule',
+            'form': form,
+            'errors': errors,
+            'result': result,
+        }
+        return TemplateResponse(request, 'admin/attendance/enrollment/import_schedule.html', context)
+
+
+class ScheduleImportForm(forms.Form):
+    file = forms.FileField()
+    table = forms.ChoiceField(
+        choices=[('json', 'JSON document (all tables)')] + [(table, f'CSV: {table}') for table in TABLES],
+        initial='json',
+    )
+    default_password = forms.CharField(
+        required=False, widget=forms.PasswordInput,
+        help_text='Password of new users without one. Leave empty to give them an unusable password.',
+    )
+    dry_run = forms.BooleanField(required=False, help_text='Validate and count, then roll back.')
+
+
 @admin.register(AbsenceJustification)
 class AbsenceJustificationAdmin(admin.ModelAdmin):
     list_display = ('student', 'class_session', 'status', 'submitted_at')
     list_filter = ('status', 'submitted_at', 'class_session__course')
     search_fields = ('student__username', 'class_session__course__name')
     readonly_fields = ('submitted_at',)
+
+@admin.register(DailyAttendanceStat)
+class DailyAttendanceStatAdmin(admin.ModelAdmin):
+    """
+    Read-only view of the per-course daily rollups.
+    Rows are maintained by signals; use rebuild_attendance_stats to recompute them.
+    """
+    list_display = ('course', 'date', 'submitted', 'present', 'ai_flagged', 'justified', 'late')
+    list_filter = ('course',)
+    date_hierarchy = 'date'
+    readonly_fields = ('course', 'date', 'submitted', 'present', 'ai_validated', 'ai_flagged', 'justified', 'late', 'updated_at')
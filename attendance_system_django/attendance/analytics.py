@@ -0,0 +1,111 @@
+# attendance/analytics.py
+"""
+Grouped attendance aggregations used by the teacher analytics page.
+
+Page-level totals and the week/weekday/course breakdowns are read from the
+DailyAttendanceStat rollup table via summarize_daily_stats(). The remaining
+per-student, per-course and time slot breakdowns take a queryset and return
+it from a single GROUP BY query, using conditional aggregation
+(``Count(..., filter=Q(...))``) instead of a pair of COUNT queries per row.
+"""
+from datetime import timedelta
+
+from django.db.models import Count, Q, Sum
+
+from attendance.models import DailyAttendanceStat, Enrollment
+
+
+PRESENT = Q(is_present=True)
+
+
+def attendance_rate(present, total):
+    """Percentage of present submissions, rounded like the templates expect."""
+    return round((present / total * 100), 1) if total > 0 else 0
+
+
+def student_breakdown(records):
+    """
+    Per-student submission counts, with the name fields needed for display.
+    Returns a list of dicts: {'id', 'name', 'present', 'total'}.
+    """
+    rows = records.filter(student__role='student').values(
+        'student', 'student__username', 'student__first_name', 'student__last_name'
+    ).annotate(
+        total=Count('id'),
+        present=Count('id', filter=PRESENT),
+    ).order_by()
+
+    students = []
+    for row in rows:
+        full_name = f"{row['student__first_name']} {row['student__last_name']}".strip()
+        students.append({
+            'id': row['student'],
+            'name': full_name or row['student__username'],
+            'present': row['present'],
+            'total': row['total'],
+        })
+    return students
+
+
+def sessions_per_course(class_sessions):
+    """Maps course id to the number of sessions in the queryset."""
+    rows = class_sessions.values('course').annotate(total=Count('id')).order_by()
+    return {row['course']: row['total'] for row in rows}
+
+
+def students_per_course(courses):
+    """Maps course id to the number of distinct students enrolled in it."""
+    rows = Enrollment.objects.filter(
+        course__in=courses,
+        student__role='student',
+    ).values('course').annotate(total=Count('student', distinct=True)).order_by()
+    return {row['course']: row['total'] for row in rows}
+
+
+def time_slot_distribution(class_sessions):
+    """Morning / afternoon / evening session counts in one query."""
+    return class_sessions.aggregate(
+        morning=Count('id', filter=Q(start_time__lt='12:00')),
+        afternoon=Count('id', filter=Q(start_time__gte='12:00', start_time__lt='18:00')),
+        evening=Count('id', filter=Q(start_time__gte='18:00')),
+    )
+
+
+def summarize_daily_stats(stats):
+    """
+    Folds DailyAttendanceStat rows into totals, plus (present, total) pairs
+    keyed by week start, Django week_day number and course id.
+    """
+    totals = dict.fromkeys(('total', 'present', 'ai_validated', 'ai_flagged', 'justified', 'late'), 0)
+    by_week, by_weekday, by_course = {}, {}, {}
+
+    for stat in stats:
+        totals['total'] += stat.submitted
+        totals['present'] += stat.present
+        totals['ai_validated'] += stat.ai_validated
+        totals['ai_flagged'] += stat.ai_flagged
+        totals['justified'] += stat.justified
+        totals['late'] += stat.late
+
+        week_start = stat.date - timedelta(days=stat.date.weekday())
+        week_day = stat.date.isoweekday() % 7 + 1 # Same numbering as __week_day
+        for bucket, key in ((by_week, week_start), (by_weekday, week_day), (by_course, stat.course_id)):
+            present, total = bucket.get(key, (0, 0))
+            bucket[key] = (present + stat.present, total + stat.submitted)
+
+    return {
+        'totals': totals,
+        'by_week': by_week,
+        'by_weekday': by_weekday,
+        'by_course': by_course,
+    }
+
+
+def pending_validations(courses):
+    """Submissions still waiting for teacher validation, read from the rollup table."""
+    totals = DailyAttendanceStat.objects.filter(course__in=courses).aggregate(
+        submitted=Sum('submitted'),
+        present=Sum('present'),
+    )
+    return (totals['submitted'] or 0) - (totals['present'] or 0)
+
@@ -0,0 +1,407 @@
+# attendance/channel_benchmark.py
+"""
+Throughput and fan-out benchmark of the WebSocket consumers on a channel layer.
+
+run() opens `teachers_per_session` ClassSessionConsumer sockets for each of
+`sessions` class sessions and one StudentNotificationConsumer socket per
+student (each opted in to `courses_per_student` course groups) through
+channels.testing.WebsocketCommunicator. It then drives send_group_notification()
+traffic at the session, personal and course groups, the way the views do,
+and reads every socket until all deliveries arrived or nothing moved for
+`settle` seconds. With `coalesce` the teacher sockets ask for batch frames
+(see ClassSessionConsumer), so the frame count and latency of both modes can
+be compared.
+
+Every message carries its send time, so each socket frame gives a delivery
+latency measured from the send_group_notification() call, dispatcher queue
+included. Deliveries that never arrive are reported as drops, and the
+instrumented layers say why:
+
+- full: the receiving channel already held `capacity` messages,
+- expired: the message waited longer than `expiry` seconds,
+- evicted: group memberships removed by `group_expiry`, or (in-memory layer
+  only) because a message of that channel expired.
+
+The layers:
+
+- 'memory': InMemoryChannelLayer (what runs without REDIS_URL),
+- 'redis-standin': an in-process stand-in for RedisChannelLayer. Messages are
+  msgpack-encoded, a `rtt_ms` round trip is added per layer call, and full
+  channels drop group messages like the Redis Lua script does. Expired
+  messages do not evict the channel from its groups,
+- 'redis': channels_redis.core.RedisChannelLayer on `redis_url`. The real
+  thing, but without the drop counters; drops are then only the difference
+  between expected and received.
+
+The peak channel depth seen by the instrumented layers is the smallest
+`capacity` that would not have dropped anything in the run.
+"""
+import asyncio
+import json
+import math
+import random
+import time
+from collections import Counter
+from copy import deepcopy
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.layers import DEFAULT_CHANNEL_LAYER, InMemoryChannelLayer, channel_layers
+from channels.exceptions import ChannelFull
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.urls import re_path
+
+from attendance.consumers import ClassSessionConsumer, StudentNotificationConsumer
+from attendance.notifications import (
+    class_session_group, course_group, dispatcher, send_group_notification, user_group,
+)
+
+
+LAYERS = ('memory', 'redis-standin', 'redis')
+
+# Configuration of each layer in settings.py
+PRODUCTION_CONFIG = {
+    'memory': {'capacity': 300, 'expiry': 60, 'group_expiry': 86400},
+    'redis-standin': {'capacity': 1500, 'expiry': 10, 'group_expiry': 86400},
+    'redis': {'capacity': 1500, 'expiry': 10, 'group_expiry': 86400},
+}
+
+# Group kind -> consumer handler of the messages sent to it
+MESSAGE_TYPES = {
+    'session': 'student_submitted',
+    'user': 'attendance_validated',
+    'course': 'attendance_code_opened',
+}
+DEFAULT_MIX = {'session': 6, 'user': 3, 'course': 1}
+CONNECT_BATCH = 500
+
+
+# --- Layers ---
+
+class MeasuredInMemoryChannelLayer(InMemoryChannelLayer):
+    """
+    InMemoryChannelLayer that counts full channels, expired messages,
+    evictions and the peak channel depth. Like its parent, every send, receive
+    and group_send sweeps all channels and groups for expired entries, and a
+    channel with an expired message is dropped from all its groups.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.counters = Counter(full=0, expired=0, evicted=0)
+        self.peak_depth = 0
+
+    def _queue(self, channel):
+        return self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+
+    def _put(self, channel, payload):
+        queue = self._queue(channel)
+        try:
+            queue.put_nowait((time.time() + self.expiry, payload))
+        except asyncio.QueueFull:
+            self.counters['full'] += 1
+            raise ChannelFull(channel)
+        self.peak_depth = max(self.peak_depth, queue.qsize())
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        self._put(channel, self.encode(message))
+
+    def encode(self, message):
+        return deepcopy(message)
+
+    def _clean_expired(self):
+        now = time.time()
+        for channel, queue in list(self.channels.items()):
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+                self.counters['expired'] += 1
+                self.counters['evicted'] += self._remove_from_groups(channel)
+                if queue.empty():
+                    self.channels.pop(channel, None)
+
+        timeout = int(now) - self.group_expiry
+        for members in self.groups.values():
+            for channel, joined in list(members.items()):
+                if joined and joined < timeout:
+                    members.pop(channel, None)
+                    self.counters['evicted'] += 1
+
+    def _remove_from_groups(self, channel):
+        return sum(members.pop(channel, None) is not None for members in self.groups.values())
+
+
+class RedisStandInChannelLayer(MeasuredInMemoryChannelLayer):
+    """
+    In-process approximation of RedisChannelLayer: msgpack payloads, one
+    simulated round trip per send, receive and group_send, and expiry checked
+    per key the way Redis does it (a message when it is popped, a group's
+    memberships when it is sent to) instead of sweeping every channel and
+    group on each call. Expired messages do not evict their channel from its
+    groups, and group_send skips full channels in one call like the Lua script.
+    """
+
+    def __init__(self, rtt_ms=0.5, **kwargs):
+        import msgpack # installed with channels-redis
+
+        super().__init__(**kwargs)
+        self.rtt = rtt_ms / 1000
+        self._packb, self._unpackb = msgpack.packb, msgpack.unpackb
+
+    async def _round_trip(self):
+        if self.rtt:
+            await asyncio.sleep(self.rtt)
+
+    def encode(self, message):
+        return self._packb(message)
+
+    async def send(self, channel, message):
+        await self._round_trip()
+        await super().send(channel, message)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        queue = self._queue(channel)
+        while True:
+            try:
+                expires, payload = await queue.get()
+            finally:
+                if queue.empty():
+                    self.channels.pop(channel, None)
+            await self._round_trip()
+            if expires >= time.time():
+                return self._unpackb(payload)
+            self.counters['expired'] += 1
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        await self._round_trip()
+        members = self.groups.get(group, {})
+        cutoff = time.time() - self.group_expiry
+        payload = self.encode(message)
+        for channel, joined in list(members.items()):
+            if joined < cutoff:
+                members.pop(channel, None)
+                self.counters['evicted'] += 1
+                continue
+            try:
+                self._put(channel, payload)
+            except ChannelFull:
+                pass
+
+
+def build_layer(layer, capacity=None, expiry=None, group_expiry=None, redis_url=None, rtt_ms=0.5):
+    """A channel layer of the given kind; unset options take the production values of that kind."""
+    config = dict(PRODUCTION_CONFIG[layer])
+    for name, value in (('capacity', capacity), ('expiry', expiry), ('group_expiry', group_expiry)):
+        if value is not None:
+            config[name] = value
+    if layer == 'memory':
+        return MeasuredInMemoryChannelLayer(**config)
+    if layer == 'redis-standin':
+        return RedisStandInChannelLayer(rtt_ms=rtt_ms, **config)
+    try:
+        from channels_redis.core import RedisChannelLayer
+    except ImportError:
+        raise ValueError("The 'redis' layer needs channels-redis installed (see requirements.txt)")
+    if not redis_url:
+        raise ValueError("The 'redis' layer needs a Redis URL")
+    return RedisChannelLayer(hosts=[redis_url], **config)
+
+
+# --- Sockets ---
+
+class BenchUser:
+    is_authenticated = True
+
+    def __init__(self, user_id):
+        self.id = self.pk = user_id
+
+
+class BenchStudentNotificationConsumer(StudentNotificationConsumer):
+    """StudentNotificationConsumer that takes its course ids from the query string instead of Enrollment rows."""
+
+    async def requested_courses(self, user):
+        params = parse_qs(self.scope['query_string'].decode())
+        return [int(value) for value in ','.join(params.get('courses', [])).split(',') if value.isdigit()]
+
+
+class BenchUserMiddleware:
+    """Puts a BenchUser for ?user=<id> in the scope."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        params = parse_qs(scope['query_string'].decode())
+        if 'user' in params:
+            scope = {**scope, 'user': BenchUser(int(params['user'][0]))}
+        return await self.app(scope, receive, send)
+
+
+application = BenchUserMiddleware(URLRouter([
+    re_path(r'ws/attendance/class_session_(?P<class_session_id>\w+)/$', ClassSessionConsumer.as_asgi()),
+    re_path(r'ws/student/notifications/$', BenchStudentNotificationConsumer.as_asgi()),
+]))
+
+
+class Socket:
+    """One connected communicator and what it received."""
+
+    def __init__(self, communicator, groups):
+        self.communicator = communicator
+        self.groups = groups
+        self.received = 0
+
+
+# --- Run ---
+
+class BenchmarkResult:
+    """What one run() measured."""
+
+    def __init__(self, layer, config):
+        self.layer = layer
+        self.config = config
+        self.sockets = 0
+        self.connect_time = 0.0
+        self.sent = 0
+        self.send_time = 0.0
+        self.expected = 0
+        self.delivered = 0
+        self.frames = 0 # socket frames carrying the deliveries (fewer than them with coalescing)
+        self.delivery_time = 0.0
+        self.latencies = []
+        self.queue_dropped = 0 # dispatcher queue full
+        self.layer_counters = None
+        self.peak_depth = None
+
+    @property
+    def dropped(self):
+        return self.expected - self.delivered
+
+    @property
+    def sent_per_second(self):
+        return self.sent / self.send_time if self.send_time else 0.0
+
+    @property
+    def delivered_per_second(self):
+        return self.delivered / self.delivery_time if self.delivery_time else 0.0
+
+    def latency(self, q):
+        """Delivery latency percentile in milliseconds."""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(0, math.ceil(q * len(ordered)) - 1)] * 1000
+
+
+async def run(layer='memory', capacity=None, expiry=None, group_expiry=None, redis_url=None, rtt_ms=0.5,
+              sessions=50, teachers_per_session=2, students=2000, courses=40, courses_per_student=1,
+              messages=5000, rate=0, mix=None, settle=5.0, seed=42, coalesce=False):
+    """
+    Opens the sockets, sends `messages` notifications (`rate` per second, or
+    as fast as possible when 0) spread over the group kinds by the `mix`
+    weights, and returns a BenchmarkResult. With `coalesce` the teacher
+    sockets connect with ?coalesce=1 and get batch frames.
+    """
+    rng = random.Random(seed)
+    channel_layer = build_layer(layer, capacity, expiry, group_expiry, redis_url, rtt_ms)
+    result = BenchmarkResult(layer, {
+        'capacity': channel_layer.capacity, 'expiry': channel_layer.expiry,
+        'group_expiry': getattr(channel_layer, 'group_expiry', None),
+    })
+    previous = channel_layers.set(DEFAULT_CHANNEL_LAYER, channel_layer)
+    sockets = []
+    try:
+        started = time.perf_counter()
+        paths = []
+        for session_id in range(1, sessions + 1):
+            for _ in range(teachers_per_session):
+                query = '?coalesce=1' if coalesce else ''
+                paths.append((f'/ws/attendance/class_session_{session_id}/{query}', [class_session_group(session_id)]))
+        course_ids = list(range(1, courses + 1))
+        for user_id in range(1, students + 1):
+            opted_in = rng.sample(course_ids, min(courses_per_student, courses))
+            query = f"?user={user_id}&courses={','.join(map(str, opted_in))}"
+            paths.append((f'/ws/student/notifications/{query}', [user_group(user_id)] + [course_group(c) for c in opted_in]))
+        for start in range(0, len(paths), CONNECT_BATCH):
+            sockets += await asyncio.gather(*(_connect(path, groups) for path, groups in paths[start:start + CONNECT_BATCH]))
+        result.sockets = len(sockets)
+        result.connect_time = time.perf_counter() - started
+
+        members = Counter(group for socket in sockets for group in socket.groups)
+        targets = {
+            'session': [class_session_group(session_id) for session_id in range(1, sessions + 1)],
+            'user': [user_group(user_id) for user_id in range(1, students + 1)],
+            'course': [group for group in (course_group(c) for c in course_ids) if members[group]],
+        }
+        weights = {kind: weight for kind, weight in (mix or DEFAULT_MIX).items() if targets.get(kind)}
+        kinds = rng.choices(list(weights), weights=list(weights.values()), k=messages)
+
+        plan = [(rng.choice(targets[kind]), MESSAGE_TYPES[kind]) for kind in kinds]
+        result.expected = sum(members[group] for group, _ in plan)
+        dropped_before = dispatcher.stats()['dropped']
+        readers = [asyncio.create_task(_read(socket, result)) for socket in sockets]
+
+        started = time.perf_counter()
+        # Sent from a worker thread, like the sync views do, so the dispatcher runs on this loop
+        await sync_to_async(_produce, thread_sensitive=False)(plan, rate)
+        result.sent = len(plan)
+        result.send_time = time.perf_counter() - started
+
+        last_count, last_change = -1, time.perf_counter()
+        while result.delivered < result.expected:
+            if result.delivered != last_count:
+                last_count, last_change = result.delivered, time.perf_counter()
+            elif time.perf_counter() - last_change > settle:
+                break
+            await asyncio.sleep(0.05)
+        result.delivery_time = (last_change if result.delivered < result.expected else time.perf_counter()) - started
+
+        result.queue_dropped = dispatcher.stats()['dropped'] - dropped_before
+        if isinstance(channel_layer, MeasuredInMemoryChannelLayer):
+            result.layer_counters = dict(channel_layer.counters)
+            result.peak_depth = channel_layer.peak_depth
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+    finally:
+        for start in range(0, len(sockets), CONNECT_BATCH):
+            await asyncio.gather(
+                *(socket.communicator.disconnect() for socket in sockets[start:start + CONNECT_BATCH]),
+                return_exceptions=True,
+            )
+        channel_layers.set(DEFAULT_CHANNEL_LAYER, previous)
+    return result
+
+
+def _produce(plan, rate):
+    interval = 1 / rate if rate else 0
+    started = time.perf_counter()
+    for seq, (group, message_type) in enumerate(plan):
+        send_group_notification(group, message_type, 'benchmark', {'seq': seq, 'sent_at': time.perf_counter()})
+        if interval:
+            time.sleep(max(0.0, started + (seq + 1) * interval - time.perf_counter()))
+
+
+async def _connect(path, groups):
+    communicator = WebsocketCommunicator(application, path)
+    connected, _ = await communicator.connect(timeout=30)
+    if not connected:
+        raise RuntimeError(f'Could not connect to {path}')
+    return Socket(communicator, groups)
+
+
+async def _read(socket, result):
+    while True:
+        frame = json.loads(await socket.communicator.receive_from(timeout=None))
+        received = time.perf_counter()
+        events = frame['events'] if frame['type'] == 'batch' else [frame]
+        result.latencies += [received - event['context']['sent_at'] for event in events]
+        socket.received += len(events)
+        result.delivered += len(events)
+        result.frames += 1
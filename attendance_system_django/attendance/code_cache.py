@@ -0,0 +1,151 @@
+# attendance/code_cache.py
+"""
+Lookup cache for attendance codes.
+
+Maps a code to its session id, course id, expiry and the ids of the students
+enrolled in the course. Entries are stored in Django's cache until the code
+expires, with a small in-process LRU in front so a burst of submissions does
+not even pay for a cache round trip. Local entries are also capped at
+LOCAL_TTL seconds, which bounds how long another process can serve an entry
+that was invalidated elsewhere.
+
+Entries are dropped when a code is saved or deleted (see attendance/signals.py),
+when a session's code is regenerated and when a course's enrollments change.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from attendance.models import AttendanceCode, Enrollment
+
+
+CODE_KEY = 'attendance:code:{code}'
+LOCAL_MAXSIZE = 256
+LOCAL_TTL = 5
+
+
+class ExpiringLRU:
+    """Thread-safe LRU whose entries also carry their own expiry timestamp."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            deadline, value = item
+            if deadline <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.time() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_local = ExpiringLRU(LOCAL_MAXSIZE)
+
+
+def lookup(code):
+    """
+    Returns the entry for an attendance code, or None if the code does not exist:
+    {'class_session_id', 'course_id', 'course_name', 'date', 'expires_at', 'student_ids'}
+    """
+    key = CODE_KEY.format(code=code)
+    entry = _local.get(key)
+    if entry is not None:
+        return entry
+
+    entry = cache.get(key)
+    if entry is None:
+        entry = load_entry(code)
+        if entry is None:
+            return None
+        ttl = time_left(entry)
+        if ttl > 0:
+            cache.set(key, entry, ttl)
+
+    ttl = time_left(entry)
+    if ttl > 0:
+        _local.set(key, entry, min(ttl, LOCAL_TTL))
+    return entry
+
+
+def load_entry(code):
+    """Builds the entry for a code from the database (two queries)."""
+    try:
+        code_obj = AttendanceCode.objects.select_related('class_session__course').get(code=code)
+    except AttendanceCode.DoesNotExist:
+        return None
+
+    class_session = code_obj.class_session
+    return {
+        'class_session_id': class_session.id,
+        'course_id': class_session.course_id,
+        'course_name': class_session.course.name,
+        'date': class_session.date,
+        'expires_at': code_obj.expires_at,
+        'student_ids': frozenset(
+            Enrollment.objects.filter(course_id=class_session.course_id).values_list('student_id', flat=True)
+        ),
+    }
+
+
+def time_left(entry):
+    """Seconds until the code in `entry` expires (0 or less once expired)."""
+    if entry['expires_at'] is None:
+        return 0
+    return (entry['expires_at'] - timezone.now()).total_seconds()
+
+
+def is_valid(entry):
+    return time_left(entry) > 0
+
+
+def is_enrolled(entry, student):
+    if student.id in entry['student_ids']:
+        return True
+    # The student may have been enrolled after the entry was cached
+    return Enrollment.objects.filter(course_id=entry['course_id'], student=student).exists()
+
+
+# --- Invalidation ---
+
+def invalidate(*codes):
+    keys = [CODE_KEY.format(code=code) for code in codes if code]
+    for key in keys:
+        _local.delete(key)
+    cache.delete_many(keys)
+
+
+def invalidate_session(class_session_id):
+    """Drops the entries of a session's code, e.g. before it is regenerated."""
+    invalidate(*AttendanceCode.objects.filter(class_session_id=class_session_id).values_list('code', flat=True))
+
+
+def invalidate_course(course_id):
+    """Drops the entries of a course's unexpired codes (their enrolled-student sets)."""
+    invalidate(*AttendanceCode.objects.filter(
+        class_session__course_id=course_id,
+        expires_at__gt=timezone.now(),
+    ).values_list('code', flat=True))
@@ -1,30 +1,122 @@
 # attendance/consumers.py
+import asyncio
 import json
+from urllib.parse import parse_qs
+
+from channels.consumer import get_handler_name
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
-from .views import send_group_notification
+from django.conf import settings
+
+from . import frame_codecs
+from .models import Enrollment
+from .notifications import class_session_group, course_group, user_group
+from .schedule_events import ensure_schedule_events_started
+
+
+COALESCE_WINDOW_MS = 100 # default of ATTENDANCE_SESSION_COALESCE_MS
+MAX_BATCH = 500 # frames per batch frame; a full batch is sent without waiting for the window
+
+
+async def dispatch_batch(consumer, event):
+    """
+    Runs the handler of every event of a notification_batch message (several
+    messages for one group merged by the NotificationDispatcher), in order.
+    """
+    for sub_event in event['events']:
+        handler = getattr(consumer, get_handler_name(sub_event), None)
+        if handler is None:
+            raise ValueError(f"No handler for message type {sub_event['type']}")
+        await handler(sub_event)
+
+
+async def send_frame(consumer, frame):
+    """Sends an encoded frame as a binary or text frame, as the consumer's codec wants."""
+    if consumer.codec.binary:
+        await consumer.send(bytes_data=frame)
+    else:
+        await consumer.send(text_data=frame)
+
+
+async def accept_with_codec(consumer, frame_type):
+    """Accepts the socket with the subprotocol negotiated by frame_codecs, then sends its hello frame."""
+    consumer.codec = frame_codecs.negotiate(consumer.scope.get('subprotocols', []), frame_type)
+    await consumer.accept(consumer.codec.subprotocol)
+    hello = consumer.codec.hello()
+    if hello is not None:
+        await send_frame(consumer, hello)
 
 
 class ClassSessionConsumer(AsyncWebsocketConsumer):
+    """
+    Teacher dashboards following a class session.
+
+    The frame format is negotiated through Sec-WebSocket-Protocol: verbose
+    JSON unless the client asks for one of frame_codecs.subprotocols()
+    (compact JSON arrays or MessagePack).
+
+    Sockets opened with ?coalesce=1 get the events that arrive within
+    ATTENDANCE_SESSION_COALESCE_MS of each other (default 100 ms) as one
+    {"type": "batch", "events": [frame, ...]} frame (a [0, [row, ...]] row in the
+    compact formats) instead of one frame each; a lone event is still sent as
+    a plain frame. That keeps a class-start
+    spike of submissions from turning into hundreds of frames per tab.
+    """
+
     async def connect(self):
         self.class_session_id = self.scope['url_route']['kwargs']['class_session_id']
-        self.class_session_group_name = f'class_session_{self.class_session_id}_notifications'
+        self.class_session_group_name = class_session_group(self.class_session_id)
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        coalesce = params.get('coalesce', ['0'])[0] not in ('', '0')
+        self.coalesce_window = getattr(settings, 'ATTENDANCE_SESSION_COALESCE_MS', COALESCE_WINDOW_MS) / 1000 if coalesce else 0
+        self.pending_frames = []
+        self.flush_task = None
 
         # Join class session group
         await self.channel_layer.group_add(
             self.class_session_group_name,
             self.channel_name
         )
-        await self.accept()
+        await accept_with_codec(self, frame_codecs.RELAYED)
 
     async def disconnect(self, close_code):
+        if getattr(self, 'flush_task', None) is not None:
+            self.flush_task.cancel()
         # Leave class session group
         await self.channel_layer.group_discard(
             self.class_session_group_name,
             self.channel_name
         )
 
+    async def send_event(self, event, context_type):
+        """Sends an event frame now, or queues it for the next batch when coalescing."""
+        frame = self.codec.encode(event, context_type)
+        if not self.coalesce_window:
+            await send_frame(self, frame)
+            return
+        self.pending_frames.append(frame)
+        if len(self.pending_frames) >= MAX_BATCH:
+            await self.flush_frames()
+        elif self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush_after_window())
+
+    async def flush_after_window(self):
+        await asyncio.sleep(self.coalesce_window)
+        self.flush_task = None
+        await self.flush_frames()
+
+    async def flush_frames(self):
+        frames, self.pending_frames = self.pending_frames, []
+        if len(frames) == 1:
+            await send_frame(self, frames[0])
+        elif frames:
+            await send_frame(self, self.codec.batch(frames))
+
     # Receive message from WebSocket (from client)
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is None:
+            # Binary frames (msgpack sockets) carry nothing clients are meant to send: ignore them
+            return
         text_data_json = json.loads(text_data)
         message = text_data_json.get('message', '')
 
@@ -39,93 +131,106 @@ class ClassSessionConsumer(AsyncWebsocketConsumer):
 
     # Receive message from class session group (from backend via send_group_notification)
     async def class_session_message(self, event):
-        message = event['message']
-        context = event.get('context', {})
-
         # Send message to WebSocket client
-        await self.send(text_data=json.dumps({
-            'type': 'class_session_message',
-            'message': message,
-            'context': context
-        }))
+        await self.send_event(event, 'class_session_message')
+
+    async def notification_batch(self, event):
+        """Handle several notifications for this session merged into one message"""
+        await dispatch_batch(self, event)
 
     # Handle specific message types from your views
     async def student_submitted(self, event):
         """Handle when a student submits attendance"""
-        await self.send(text_data=json.dumps({
-            'type': 'class_session_message',
-            'message': event['message'],
-            'context': {
-                'type': 'student_submitted',
-                **event['context']
-            }
-        }))
+        await self.send_event(event, 'student_submitted')
 
     async def ai_result_updated_for_teacher(self, event):
         """Handle AI validation results"""
-        await self.send(text_data=json.dumps({
-            'type': 'class_session_message', 
-            'message': event['message'],
-            'context': {
-                'type': 'ai_result_updated_for_teacher',
-                **event['context']
-            }
-        }))
+        await self.send_event(event, 'ai_result_updated_for_teacher')
 
     async def code_generated_for_teacher(self, event):
         """Handle when a new attendance code is generated"""
-        await self.send(text_data=json.dumps({
-            'type': 'class_session_message',
-            'message': event['message'],
-            'context': {
-                'type': 'code_generated_for_teacher',
-                **event['context']
-            }
-        }))
+        await self.send_event(event, 'code_generated_for_teacher')
 
     async def attendance_validated(self, event):
         """Handle when attendance is validated by teacher"""
-        await self.send(text_data=json.dumps({
-            'type': 'class_session_message',
-            'message': event['message'],
-            'context': {
-                'type': 'attendance_validated',
-                **event['context']
-            }
-        }))
+        await self.send_event(event, 'attendance_validated')
+
+    async def device_sharing_detected(self, event):
+        """Handle when several students' submissions look like one device (see device_sharing)"""
+        await self.send_event(event, 'device_sharing_detected')
 
 
 class StudentNotificationConsumer(AsyncWebsocketConsumer):
-    """Consumer for student-specific notifications"""
-    
+    """
+    Consumer for student-specific notifications.
+
+    Each socket joins the personal group of the connected user, so a message
+    about one student is a single send to that student's sockets. Course-wide
+    notifications are opt-in: connect with ?courses=all or ?courses=<id>,<id>
+    to also join the groups of those enrolled courses.
+
+    Frames are negotiated as on ClassSessionConsumer; the verbose JSON ones
+    have "type": "notification".
+    """
+
     async def connect(self):
-        # Create a general student notification group
-        self.group_name = 'student_notifications'
-        
-        # Join the student notifications group
-        await self.channel_layer.group_add(
-            self.group_name,
-            self.channel_name
-        )
-        await self.accept()
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_names = [user_group(user.id)]
+        self.group_names += [course_group(course_id) for course_id in await self.requested_courses(user)]
+
+        for group_name in self.group_names:
+            await self.channel_layer.group_add(group_name, self.channel_name)
+        await accept_with_codec(self, frame_codecs.NOTIFICATION)
+
+        # Class started/ended events for the course groups
+        ensure_schedule_events_started()
 
     async def disconnect(self, close_code):
-        # Leave the student notifications group
-        await self.channel_layer.group_discard(
-            self.group_name,
-            self.channel_name
-        )
+        for group_name in getattr(self, 'group_names', []):
+            await self.channel_layer.group_discard(group_name, self.channel_name)
 
     # Receive message from WebSocket (from client)
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         # Students typically don't send messages, just receive notifications
         pass
 
+    @database_sync_to_async
+    def requested_courses(self, user):
+        params = parse_qs(self.scope.get('query_string', b'').decode())
+        requested = ','.join(params.get('courses', [])).split(',')
+        requested = [value.strip() for value in requested if value.strip()]
+        if not requested:
+            return []
+
+        enrollments = Enrollment.objects.filter(student=user)
+        if 'all' not in requested:
+            enrollments = enrollments.filter(course_id__in=[value for value in requested if value.isdigit()])
+        return list(enrollments.values_list('course_id', flat=True))
+
+    async def forward_notification(self, event, notification_type):
+        await send_frame(self, self.codec.encode(event, notification_type))
+
+    async def notification_batch(self, event):
+        """Handle several notifications for one of the student's groups merged into one message"""
+        await dispatch_batch(self, event)
+
     # Handle attendance validation notifications
     async def attendance_validated(self, event):
         """Handle when a student's attendance is validated"""
-        await self.send(text_data=json.dumps({
-            'type': 'notification',
-            'message': event['message'],
-            'context': event.get('context', {})
-        }))
\ No newline at end of file
+        await self.forward_notification(event, 'attendance_validated')
+
+    async def attendance_code_opened(self, event):
+        """Handle when a teacher opens a code for one of the student's courses"""
+        await self.forward_notification(event, 'attendance_code_opened')
+
+    async def class_started(self, event):
+        """Handle when one of the student's classes starts (see schedule_events)"""
+        await self.forward_notification(event, 'class_started')
+
+    async def class_ended(self, event):
+        """Handle when one of the student's classes ends (see schedule_events)"""
+        await self.forward_notification(event, 'class_ended')
@@ -0,0 +1,171 @@
+# attendance/device_sharing.py
+"""
+Live detection of one device submitting attendance for several students.
+
+Each class session gets an in-memory index of its submissions, bucketed by
+device: the exact IP address plus the coordinates rounded to
+SPOT_DECIMALS decimal places (about 0.1 m). A page reused to submit for
+several students sends the same IP and the same fix every time, while
+students sitting next to each other in a room get fixes metres apart, so
+only the former share a bucket. observe() files a new submission under its
+bucket, a constant amount of work per submission. When a bucket reaches
+CLUSTER_SIZE distinct students, its records are flagged in ai_result (under
+rules['device_sharing']) once the submission commits, and the teacher's
+ClassSessionConsumer group is told about the newly flagged ones.
+
+The index lives in the process that serves the submissions. A process that
+has not seen a session yet loads its existing submissions once, then keeps
+the index up to date; indexes of idle sessions expire after INDEX_TTL.
+"""
+import math
+import threading
+
+from django.db import transaction
+
+from attendance import submission_feed
+from attendance.code_cache import ExpiringLRU
+from attendance.models import AttendanceRecord
+from attendance.notifications import class_session_group, send_group_notification
+from attendance.rollups import increment_daily_stats
+
+
+CLUSTER_SIZE = 3
+SPOT_DECIMALS = 6
+INDEX_TTL = 60 * 60 * 12
+MAX_SESSIONS = 512
+
+_indexes = ExpiringLRU(MAX_SESSIONS)
+_indexes_lock = threading.Lock()
+
+
+def device_key(ip, geolocation):
+    """The bucket of a submission: (ip, rounded coordinates or None), or None without an IP."""
+    if not ip:
+        return None
+    return ip, spot(geolocation)
+
+
+def spot(geolocation):
+    """The geolocation rounded to SPOT_DECIMALS, or None if it has no usable coordinates."""
+    if not geolocation:
+        return None
+    try:
+        lat = float(geolocation.get('latitude'))
+        lon = float(geolocation.get('longitude'))
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(lat) or math.isnan(lon):
+        return None
+    return round(lat, SPOT_DECIMALS), round(lon, SPOT_DECIMALS)
+
+
+class SessionIndex:
+    """Device buckets of one session: device_key() -> {record id: student id}."""
+
+    def __init__(self):
+        self.by_device = {}
+        self.flagged = set()
+        self.lock = threading.Lock()
+
+    def add(self, record_id, student_id, ip, geolocation):
+        """
+        Files a submission. Returns the record ids of its bucket when it holds
+        CLUSTER_SIZE or more students (empty otherwise), and that number of students.
+        """
+        key = device_key(ip, geolocation)
+        if key is None:
+            return [], 0
+        with self.lock:
+            bucket = self.by_device.setdefault(key, {})
+            bucket[record_id] = student_id
+            students = len(set(bucket.values()))
+            return (list(bucket) if students >= CLUSTER_SIZE else []), students
+
+
+def session_index(class_session_id):
+    """The session's index, loaded from its existing submissions the first time."""
+    index = _indexes.get(class_session_id)
+    if index is not None:
+        return index
+    with _indexes_lock:
+        index = _indexes.get(class_session_id)
+        if index is None:
+            index = SessionIndex()
+            rows = AttendanceRecord.objects.filter(class_session_id=class_session_id).values_list(
+                'id', 'student_id', 'simulated_ip', 'simulated_geolocation', 'ai_result'
+            )
+            for record_id, student_id, ip, geolocation, ai_result in rows:
+                index.add(record_id, student_id, ip, geolocation)
+                if ai_result and 'device_sharing' in ai_result.get('rules', {}):
+                    index.flagged.add(record_id)
+            _indexes.set(class_session_id, index, INDEX_TTL)
+    return index
+
+
+def observe(entry, record_id, student_id, ip, geolocation):
+    """
+    Adds a new submission (`entry` is its code_cache entry) to the session's
+    index; flags and announces the records of the cluster it completes or
+    joins that were not flagged yet. Returns the ids of those records.
+    """
+    class_session_id = entry['class_session_id']
+    index = session_index(class_session_id)
+    members, students = index.add(record_id, student_id, ip, geolocation)
+    if not members:
+        return []
+
+    with index.lock:
+        new_ids = [member_id for member_id in members if member_id not in index.flagged]
+        index.flagged.update(new_ids)
+    if not new_ids:
+        return []
+
+    if spot(geolocation) is None:
+        explanation = f"Same IP address used by {students} students in this class."
+    else:
+        explanation = f"Same IP address and location used by {students} students in this class."
+    explanations = dict.fromkeys(new_ids, explanation)
+    # Off the request's transaction, like the rollup refreshes
+    transaction.on_commit(lambda: flag_records(entry, explanations))
+
+    send_group_notification(
+        group_name=class_session_group(class_session_id),
+        message_type='device_sharing_detected',
+        message=f"Possible shared device: {students} students in {entry['course_name']}.",
+        context={
+            'new_record_ids': [str(member_id) for member_id in new_ids],
+            'students': students,
+            'explanation': explanation,
+            'class_session_id': str(class_session_id),
+        }
+    )
+    return new_ids
+
+
+def flag_records(entry, explanations):
+    """Merges the device-sharing finding into the records' ai_result (one read, one bulk write)."""
+    records = list(AttendanceRecord.objects.filter(id__in=explanations).only('id', 'ai_result'))
+    newly_validated = newly_flagged = 0
+    for record in records:
+        ai_result = record.ai_result or {}
+        newly_validated += record.ai_result is None
+        newly_flagged += not ai_result.get('isFraudulent')
+        rules = dict(ai_result.get('rules', {}))
+        if not rules and ai_result.get('isFraudulent'):
+            rules['ai'] = ai_result.get('fraudExplanation') # Result saved before the rule engine
+        rules['device_sharing'] = explanations[record.id]
+        record.ai_result = {
+            'isFraudulent': True,
+            'fraudExplanation': ' '.join(rules.values()),
+            'rules': rules,
+        }
+
+    key = (entry['course_id'], entry['date'])
+    with transaction.atomic():
+        AttendanceRecord.objects.bulk_update(records, ['ai_result'])
+        # bulk_update() skips post_save: keep the rollups and the submissions feed in step
+        if newly_validated:
+            increment_daily_stats({key: newly_validated}, field='ai_validated')
+        if newly_flagged:
+            increment_daily_stats({key: newly_flagged}, field='ai_flagged')
+        submission_feed.touch_records(entry['class_session_id'], [record.id for record in records])
@@ -0,0 +1,136 @@
+# attendance/exports.py
+"""
+Attendance matrix exports (one row per student, one column per class session).
+
+attendance_matrix() yields the rows without holding the records in memory:
+the students, their enrollments, records and approved justifications are
+read as four values_list() iterators sorted by student id, and walked in
+step so each row is built from that student's rows only. Memory grows with
+the number of sessions (the columns), not with the number of records.
+
+Cells are 'present', 'pending' (submitted, not validated yet), 'justified'
+(approved justification), 'absent' (enrolled, past session, nothing
+submitted) or empty (not enrolled, or the session is still to come).
+"""
+import csv
+from itertools import groupby, islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import Q
+from django.utils import timezone
+from openpyxl import Workbook
+
+from core.models import User
+from courses.models import ClassSession
+from attendance.models import AbsenceJustification, AttendanceRecord, Enrollment
+
+
+CHUNK_SIZE = 2000
+ASYNC_CHUNK_LINES = 500
+
+
+def attendance_matrix(course_ids, date_from=None, date_to=None):
+    """Yields the header row, then one row per student of the courses."""
+    sessions = ClassSession.objects.filter(course_id__in=course_ids)
+    if date_from:
+        sessions = sessions.filter(date__gte=date_from)
+    if date_to:
+        sessions = sessions.filter(date__lte=date_to)
+
+    columns = list(sessions.order_by('date', 'start_time', 'course__code').values_list(
+        'id', 'course_id', 'course__code', 'date', 'start_time'
+    ))
+    position = {session_id: i for i, (session_id, *_) in enumerate(columns)}
+    yield ['Student', 'Username'] + [
+        f"{course_code} {date:%Y-%m-%d} {start_time:%H:%M}" for _, _, course_code, date, start_time in columns
+    ]
+
+    session_ids = sessions.values('id')
+    enrollments = Enrollment.objects.filter(course_id__in=course_ids)
+    records = AttendanceRecord.objects.filter(class_session__in=session_ids)
+    justifications = AbsenceJustification.objects.filter(class_session__in=session_ids, status='approved')
+    students = User.objects.filter(
+        Q(id__in=enrollments.values('student_id')) | Q(id__in=records.values('student_id'))
+    )
+
+    streams = [
+        _by_student(enrollments.order_by('student_id').values_list('student_id', 'course_id')),
+        _by_student(records.order_by('student_id').values_list('student_id', 'class_session_id', 'is_present')),
+        _by_student(justifications.order_by('student_id').values_list('student_id', 'class_session_id')),
+    ]
+    pending = [next(stream, None) for stream in streams]
+
+    today = timezone.localdate()
+    past = [date < today for _, _, _, date, _ in columns]
+    column_courses = [course_id for _, course_id, _, _, _ in columns]
+
+    for student_id, username, first_name, last_name in students.order_by('id').values_list(
+        'id', 'username', 'first_name', 'last_name'
+    ).iterator(chunk_size=CHUNK_SIZE):
+        # Advance each stream to this student (their rows, or [] if they have none)
+        rows = []
+        for i, stream in enumerate(streams):
+            while pending[i] is not None and pending[i][0] < student_id:
+                pending[i] = next(stream, None)
+            if pending[i] is not None and pending[i][0] == student_id:
+                rows.append(pending[i][1])
+                pending[i] = next(stream, None)
+            else:
+                rows.append([])
+        enrolled_courses, student_records, student_justifications = rows
+
+        enrolled_courses = {course_id for _, course_id in enrolled_courses}
+        cells = [
+            'absent' if is_past and course_id in enrolled_courses else ''
+            for is_past, course_id in zip(past, column_courses)
+        ]
+        for _, session_id, is_present in student_records:
+            cells[position[session_id]] = 'present' if is_present else 'pending'
+        for _, session_id in student_justifications:
+            if cells[position[session_id]] != 'present':
+                cells[position[session_id]] = 'justified'
+
+        yield [f"{first_name} {last_name}".strip() or username, username] + cells
+
+
+def _by_student(rows):
+    """Groups a values_list iterator sorted by student id into (student id, [rows])."""
+    for student_id, group in groupby(rows.iterator(chunk_size=CHUNK_SIZE), key=lambda row: row[0]):
+        yield student_id, list(group)
+
+
+# --- Writers ---
+
+class Echo:
+    """File-like object whose write() returns the value, for csv.writer over a stream."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(Echo())
+    for row in rows:
+        yield writer.writerow(row)
+
+
+async def acsv_chunks(rows):
+    """
+    csv_lines() for ASGI servers, which read a sync iterator with
+    sync_to_async(list) and so build the whole file before the first byte.
+    Pulls ASYNC_CHUNK_LINES lines per hop to the request's sync thread (where
+    the server-side cursors live) and yields them as one chunk.
+    """
+    lines = csv_lines(rows)
+    next_chunk = sync_to_async(lambda: ''.join(islice(lines, ASYNC_CHUNK_LINES)), thread_sensitive=True)
+    while chunk := await next_chunk():
+        yield chunk
+
+
+def write_xlsx(rows, file):
+    """Writes the rows to an .xlsx file (path or binary file object) with openpyxl's write-only mode."""
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Attendance')
+    for row in rows:
+        sheet.append(row)
+    workbook.save(file)
@@ -0,0 +1,222 @@
+# attendance/frame_codecs.py
+"""
+Wire formats of the WebSocket frames of the class session and student
+notification sockets.
+
+Clients pick one with the Sec-WebSocket-Protocol header; the first protocol
+of theirs the server knows wins, and clients that ask for none (or only for
+unknown ones) get the verbose JSON frames:
+
+- no subprotocol, or 'attendance.json': {"type": "class_session_message",
+  "message": ..., "context": {"type": ..., ...}} text frames
+  ("type": "notification" on the student sockets),
+- 'attendance.compact.v1': text frames holding JSON arrays,
+- 'attendance.msgpack.v1': the same arrays MessagePack-encoded in binary
+  frames (offered when msgpack is installed; it comes with channels-redis).
+
+A compact row is [code, message, value, value, ..., extras]: `code` is the
+position + 1 of the event type in EVENT_TYPES, the values are the context
+members listed for that type in SCHEMAS, and `extras` is an object with any
+other context members (left out when empty, and then trailing nulls are
+trimmed too). The event type is implied by the code, and on class session
+sockets the class session id by the socket; messages relayed from clients
+(class_session_message) keep their whole context, as in JSON. Geolocations ({"latitude", "longitude"}) become
+[latitude, longitude] pairs. A batch frame is [0, [row, ...]].
+
+Right after the handshake compact sockets get a [-1, protocol, schemas,
+pairs] hello frame describing all of this, so clients need no hard-coded
+tables.
+
+Events sent through notifications carry an id, and each codec keeps the
+frames it encoded for the last ENCODED_CACHE_SIZE of them: every socket of
+a group in this process then reuses one encoding of the event.
+"""
+import json
+
+try:
+    import msgpack
+except ImportError: # only needed for the msgpack subprotocol
+    msgpack = None
+
+
+JSON = 'attendance.json'
+COMPACT = 'attendance.compact.v1'
+MSGPACK = 'attendance.msgpack.v1'
+
+BATCH_CODE = 0
+HELLO_CODE = -1
+
+RELAYED = 'class_session_message'
+NOTIFICATION = 'notification'
+EVENT_TYPES = (
+    RELAYED,
+    'student_submitted',
+    'ai_result_updated_for_teacher',
+    'code_generated_for_teacher',
+    'attendance_validated',
+    'device_sharing_detected',
+    # Student notification sockets
+    'attendance_code_opened',
+    'class_started',
+    'class_ended',
+)
+CODES = {event_type: position + 1 for position, event_type in enumerate(EVENT_TYPES)}
+
+# Context members sent positionally, per event type (see the views that send them)
+SCHEMAS = {
+    'student_submitted': ('id', 'name', 'timestamp', 'simulatedIp', 'simulatedGeolocation', 'aiResult', 'is_present'),
+    'ai_result_updated_for_teacher': ('id', 'aiResult', 'is_present'),
+    'code_generated_for_teacher': ('code', 'expires_at', 'code_status'),
+    'attendance_validated': ('status', 'record_id', 'record_ids', 'class_name'),
+    'device_sharing_detected': ('new_record_ids', 'students', 'explanation'),
+    'attendance_code_opened': ('class_name', 'class_session_id', 'expires_at'),
+    'class_started': ('id', 'course_name', 'start_datetime', 'end_datetime'),
+    'class_ended': ('id', 'course_name', 'start_datetime', 'end_datetime'),
+}
+# Object-valued members sent as arrays of these keys
+PAIRS = {'simulatedGeolocation': ('latitude', 'longitude')}
+# Members the socket already knows, per frame type (that is, per kind of socket)
+IMPLIED = {RELAYED: ('type', 'class_session_id'), NOTIFICATION: ('type',)}
+
+ENCODED_CACHE_SIZE = 256
+
+
+def event_frame(frame_type, event, context_type=None):
+    """
+    JSON text of the frame for a group event: {"type": frame_type, "message",
+    "context": {"type": context_type, **event context}}, or the context as is
+    without a context_type.
+    """
+    context = event.get('context', {})
+    return json.dumps({
+        'type': frame_type,
+        'message': event['message'],
+        'context': {'type': context_type, **context} if context_type else context,
+    })
+
+
+def compact_row(event, context_type, implied=IMPLIED[RELAYED]):
+    """The compact array of an event (see the module docstring)."""
+    context = event.get('context', {})
+    keys = SCHEMAS.get(context_type, ())
+    if context_type == RELAYED:
+        implied = () # Relayed messages keep their context as sent
+    values = [_pair(key, context.get(key)) for key in keys]
+    extras = {key: value for key, value in context.items() if key not in keys and key not in implied}
+    row = [CODES[context_type], event.get('message'), *values]
+    if extras:
+        row.append(extras)
+    else:
+        while len(row) > 2 and row[-1] is None:
+            row.pop()
+    return row
+
+
+def _pair(key, value):
+    if key in PAIRS and isinstance(value, dict):
+        return [value.get(member) for member in PAIRS[key]]
+    return value
+
+
+class JsonCodec:
+    """The verbose JSON frames (the fallback)."""
+
+    subprotocol = None
+    binary = False
+
+    def __init__(self, frame_type=RELAYED, subprotocol=None):
+        if subprotocol is not None:
+            self.subprotocol = subprotocol
+        self.frame_type = frame_type
+        self._encoded = {}
+
+    def encode(self, event, context_type):
+        """The frame of an event, encoded once per process when the event has an id."""
+        event_id = event.get('id')
+        if event_id is None:
+            return self.encode_event(event, context_type)
+        # Every socket of the group in this process gets the same event
+        key = (event_id, context_type)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            if len(self._encoded) >= ENCODED_CACHE_SIZE:
+                self._encoded.clear()
+            encoded = self._encoded[key] = self.encode_event(event, context_type)
+        return encoded
+
+    def encode_event(self, event, context_type):
+        # Messages relayed from clients (class_session_message) keep their context as sent
+        return event_frame(self.frame_type, event, None if context_type == RELAYED else context_type)
+
+    def batch(self, frames):
+        return '{"type": "batch", "events": [' + ', '.join(frames) + ']}'
+
+    def hello(self):
+        return None
+
+
+class CompactJsonCodec(JsonCodec):
+    subprotocol = COMPACT
+
+    def encode_event(self, event, context_type):
+        return self.dumps(compact_row(event, context_type, IMPLIED[self.frame_type]))
+
+    def dumps(self, value):
+        return json.dumps(value, separators=(',', ':'))
+
+    def batch(self, frames):
+        return f'[{BATCH_CODE},[' + ','.join(frames) + ']]'
+
+    def hello(self):
+        return self.dumps([
+            HELLO_CODE,
+            self.subprotocol,
+            [[event_type, list(SCHEMAS.get(event_type, ()))] for event_type in EVENT_TYPES],
+            {key: list(members) for key, members in PAIRS.items()},
+        ])
+
+
+class MsgpackCodec(CompactJsonCodec):
+    subprotocol = MSGPACK
+    binary = True
+
+    def dumps(self, value):
+        return msgpack.packb(value)
+
+    def batch(self, frames):
+        # Packed rows are valid array items as they are: only the headers are new
+        return _array_header(2) + msgpack.packb(BATCH_CODE) + _array_header(len(frames)) + b''.join(frames)
+
+
+def _array_header(length):
+    if length < 16:
+        return bytes([0x90 | length])
+    if length < 1 << 16:
+        return b'\xdc' + length.to_bytes(2, 'big')
+    return b'\xdd' + length.to_bytes(4, 'big')
+
+
+# One instance per frame type and subprotocol, each with its cache of encoded frames
+_classes = {None: JsonCodec, JSON: JsonCodec, COMPACT: CompactJsonCodec}
+if msgpack is not None:
+    _classes[MSGPACK] = MsgpackCodec
+_codecs = {
+    (frame_type, subprotocol): codec_class(frame_type, subprotocol)
+    for frame_type in IMPLIED for subprotocol, codec_class in _classes.items()
+}
+
+
+def subprotocols():
+    """The Sec-WebSocket-Protocol values this server accepts."""
+    return [subprotocol for subprotocol in _classes if subprotocol is not None]
+
+
+def negotiate(requested, frame_type=RELAYED):
+    """
+    The codec for the client's Sec-WebSocket-Protocol list (in its order of
+    preference), on a socket whose JSON frames have this type.
+    """
+    for subprotocol in requested:
+        if subprotocol in _classes:
+            return _codecs[frame_type, subprotocol]
+    return _codecs[frame_type, None]
@@ -0,0 +1,311 @@
+# attendance/fraud_rules.py
+"""
+Deterministic fraud checks for attendance submissions.
+
+Each rule is a class whose evaluate() scores a whole RecordBatch at once and
+returns one explanation per record (None when the record passes). The
+FraudEngine runs the rules in settings.ATTENDANCE_FRAUD_RULES (dotted paths,
+DEFAULT_RULES if unset) and folds their findings into the ai_result stored
+on each record:
+
+    {'isFraudulent': bool, 'fraudExplanation': str, 'rules': {rule name: explanation}}
+
+Rules such as DuplicateIPRule depend on the other submissions of the session,
+so evaluation works per class session: session_results() scores every record
+of a session, saves the results and caches them per record under the
+session's submissions-feed version. record_result() serves a single record
+from that cache, and only re-runs the session when any record of it has been
+added, changed or deleted since (a new submission with the same IP changes
+the verdict of the earlier ones too).
+"""
+import ipaddress
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from attendance import geofence, submission_feed
+from attendance.models import AttendanceRecord
+from attendance.rollups import refresh_daily_stats_for_sessions
+from courses.models import ClassSession
+
+
+RESULT_KEY = 'attendance:fraud:{record_id}:{session_version}'
+RESULT_TTL = 60 * 60 * 24
+
+DEFAULT_RULES = [
+    'attendance.fraud_rules.GeofenceRule',
+    'attendance.fraud_rules.SubnetRule',
+    'attendance.fraud_rules.DuplicateIPRule',
+    'attendance.fraud_rules.VelocityRule',
+]
+
+NO_ISSUES = "No issues detected."
+
+RECORD_FIELDS = ('id', 'student_id', 'class_session_id', 'timestamp', 'simulated_ip', 'simulated_geolocation', 'ai_result')
+
+# Findings written outside the engine (attendance.device_sharing), kept when a record is re-evaluated
+LIVE_RULES = ('device_sharing',)
+
+
+class RecordBatch:
+    """The columns the rules need from a batch of records, as NumPy arrays."""
+
+    def __init__(self, rows, history=None):
+        """
+        `rows` are dicts with the RECORD_FIELDS keys. `history` optionally holds the
+        same kind of rows for earlier submissions (VelocityRule loads them otherwise).
+        """
+        self.rows = rows
+        self.history = history
+        self.ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        self.student_ids = np.array([row['student_id'] for row in rows], dtype=np.int64)
+        self.session_ids = np.array([row['class_session_id'] for row in rows], dtype=np.int64)
+        self.timestamps = np.array([row['timestamp'].timestamp() for row in rows], dtype=float)
+        self.ips = [row['simulated_ip'] or '' for row in rows]
+        self.geolocations = [row['simulated_geolocation'] for row in rows]
+
+    @classmethod
+    def from_queryset(cls, records):
+        return cls(list(records.values(*RECORD_FIELDS)))
+
+    def __len__(self):
+        return len(self.rows)
+
+
+class Rule:
+    """Base class of the fraud rules."""
+
+    name = None
+
+    def evaluate(self, batch):
+        """Returns a list with one explanation (or None) per record of the batch."""
+        raise NotImplementedError
+
+
+class GeofenceRule(Rule):
+    """The submission's geolocation must fall inside a campus (see attendance.geofence)."""
+
+    name = 'geofence'
+
+    def __init__(self, campuses=None):
+        self.campuses = campuses
+
+    def evaluate(self, batch):
+        results = geofence.score_geolocations(batch.geolocations, self.campuses)
+        return [result['fraudExplanation'] if result['isFraudulent'] else None for result in results]
+
+
+class SubnetRule(Rule):
+    """The submission must come from the classroom network (settings.ATTENDANCE_CLASSROOM_NETWORKS)."""
+
+    name = 'subnet'
+    default_networks = ['192.168.1.0/24']
+
+    def __init__(self, networks=None):
+        if networks is None:
+            networks = getattr(settings, 'ATTENDANCE_CLASSROOM_NETWORKS', self.default_networks)
+        self.networks = [ipaddress.ip_network(network, strict=False) for network in networks]
+
+    def evaluate(self, batch):
+        if not len(batch):
+            return []
+        # Each distinct address is checked once, then mapped back to its records
+        unique_ips, inverse = np.unique(np.array(batch.ips, dtype=object), return_inverse=True)
+        explanations = np.array([self.check(ip) for ip in unique_ips], dtype=object)
+        return list(explanations[inverse])
+
+    def check(self, ip):
+        if not ip:
+            return "IP address missing."
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return "Invalid IP address."
+        if any(address in network for network in self.networks):
+            return None
+        return "IP address is outside the classroom network."
+
+
+class DuplicateIPRule(Rule):
+    """Flags IP addresses shared by `max_students` or more students in the same session."""
+
+    name = 'duplicate_ip'
+
+    def __init__(self, max_students=3):
+        self.max_students = max_students
+
+    def evaluate(self, batch):
+        if not len(batch):
+            return []
+        unique_ips, ip_codes = np.unique(np.array(batch.ips, dtype=object), return_inverse=True)
+        pair_keys = batch.session_ids * len(unique_ips) + ip_codes
+
+        # Distinct (session/ip pair, student) rows, then students per pair, mapped back to the records
+        pairs_students = np.unique(np.stack([pair_keys, batch.student_ids], axis=1), axis=0)
+        pairs, students = np.unique(pairs_students[:, 0], return_counts=True)
+        counts = students[np.searchsorted(pairs, pair_keys)]
+        flagged = (counts >= self.max_students) & (np.array(batch.ips, dtype=object) != '')
+
+        return [
+            f"IP address shared by {count} students in this class." if flag else None
+            for count, flag in zip(counts.tolist(), flagged.tolist())
+        ]
+
+
+class VelocityRule(Rule):
+    """
+    Impossible travel: flags a submission whose distance from the student's
+    previous submission (within `window_hours`) implies more than `max_speed_kmh`.
+    """
+
+    name = 'velocity'
+
+    def __init__(self, max_speed_kmh=300, window_hours=12):
+        self.max_speed = max_speed_kmh / 3.6 # m/s
+        self.window = timedelta(hours=window_hours)
+
+    def evaluate(self, batch):
+        if not len(batch):
+            return []
+        history = batch.history if batch.history is not None else self.load_history(batch)
+        rows = {row['id']: row for row in history}
+        rows.update((row['id'], row) for row in batch.rows)
+        rows = list(rows.values())
+
+        ids = np.array([row['id'] for row in rows], dtype=np.int64)
+        students = np.array([row['student_id'] for row in rows], dtype=np.int64)
+        timestamps = np.array([row['timestamp'].timestamp() for row in rows], dtype=float)
+        lat, lon, _ = geofence.coordinates([row['simulated_geolocation'] for row in rows])
+
+        # Consecutive submissions of the same student
+        order = np.lexsort((timestamps, students))
+        ids, students, timestamps, lat, lon = ids[order], students[order], timestamps[order], lat[order], lon[order]
+        distance = geofence.haversine(lat[:-1], lon[:-1], lat[1:], lon[1:])
+        elapsed = timestamps[1:] - timestamps[:-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            speed = np.where(elapsed > 0, distance / elapsed, np.where(distance > 0, np.inf, 0.0))
+        too_fast = (students[1:] == students[:-1]) & (elapsed <= self.window.total_seconds()) & (speed > self.max_speed)
+
+        flagged = {
+            record_id: kmh for record_id, kmh in zip(ids[1:][too_fast], speed[too_fast] * 3.6)
+        }
+        return [
+            f"Moved at {flagged[record_id]:.0f} km/h since the previous submission."
+            if record_id in flagged else None
+            for record_id in batch.ids
+        ]
+
+    def load_history(self, batch):
+        """Earlier submissions of the batch's students within the time window (one query)."""
+        timestamps = [row['timestamp'] for row in batch.rows]
+        return list(AttendanceRecord.objects.filter(
+            student_id__in=set(batch.student_ids.tolist()),
+            timestamp__gte=min(timestamps) - self.window,
+            timestamp__lte=max(timestamps),
+        ).values(*RECORD_FIELDS))
+
+
+class FraudEngine:
+    """
+    Runs rules over a batch and folds their findings into ai_results. A
+    `partial` engine (a subset of the rules) keeps the records' previous
+    findings of every rule it does not run; a full one only keeps LIVE_RULES.
+    """
+
+    def __init__(self, rules=None, partial=False):
+        if rules is None:
+            rules = [import_string(path)() for path in getattr(settings, 'ATTENDANCE_FRAUD_RULES', DEFAULT_RULES)]
+        self.rules = rules
+        self.partial = partial
+
+    def evaluate(self, batch):
+        """Returns one ai_result dict per record of the batch."""
+        findings = [(rule.name, rule.evaluate(batch)) for rule in self.rules]
+        run = {rule.name for rule in self.rules}
+        results = []
+        for i in range(len(batch)):
+            flagged = {name: explanations[i] for name, explanations in findings if explanations[i]}
+            previous = (batch.rows[i].get('ai_result') or {}).get('rules', {})
+            flagged.update(
+                (name, explanation) for name, explanation in previous.items()
+                if name in LIVE_RULES or (self.partial and name not in run)
+            )
+            results.append({
+                'isFraudulent': bool(flagged),
+                'fraudExplanation': ' '.join(flagged.values()) if flagged else NO_ISSUES,
+                'rules': flagged,
+            })
+        return results
+
+
+def score_records(records, rules=None):
+    """
+    Scores the pending (not yet present) records of a queryset and saves their
+    ai_result in one bulk_update. Returns {record id: ai_result}.
+
+    Meant for bulk passes of per-record rules such as GeofenceRule over many
+    sessions: validated records keep the result the teacher validated, and
+    cross-record rules would only see the other pending records. Use
+    session_results() for those. Given `rules`, only their findings are
+    replaced: the other rules' findings already on a record stay, and the
+    verdict is recomputed from both.
+    """
+    batch = RecordBatch.from_queryset(records.filter(is_present=False))
+    if not len(batch):
+        return {}
+    results = dict(zip(batch.ids.tolist(), FraudEngine(rules, partial=rules is not None).evaluate(batch)))
+    save_results(batch, results)
+    return results
+
+
+def save_results(batch, results):
+    """
+    Writes {record id: ai_result} for the records of a batch. Returns the new
+    submissions-feed version of each session, which the records now carry.
+    """
+    session_records = {}
+    for record_id, session_id in zip(batch.ids.tolist(), batch.session_ids.tolist()):
+        session_records.setdefault(session_id, []).append(record_id)
+
+    updates = [AttendanceRecord(id=record_id, ai_result=result) for record_id, result in results.items()]
+    with transaction.atomic():
+        AttendanceRecord.objects.bulk_update(updates, ['ai_result'], batch_size=500)
+        # bulk_update() skips post_save: refresh the ai_validated/ai_flagged rollups
+        refresh_daily_stats_for_sessions(ClassSession.objects.filter(id__in=session_records))
+        return {
+            session_id: submission_feed.touch_records(session_id, record_ids)
+            for session_id, record_ids in session_records.items()
+        }
+
+
+# --- Per-session evaluation ---
+
+def session_results(class_session_id, engine=None):
+    """
+    Scores, saves and caches every record of a session, validated ones
+    included: they are part of what the cross-record rules compare against.
+    Returns {record id: ai_result}.
+    """
+    batch = RecordBatch.from_queryset(AttendanceRecord.objects.filter(class_session_id=class_session_id))
+    if not len(batch):
+        return {}
+    results = dict(zip(batch.ids.tolist(), (engine or FraudEngine()).evaluate(batch)))
+    version = save_results(batch, results)[class_session_id]
+    cache.set_many({
+        RESULT_KEY.format(record_id=record_id, session_version=version): result
+        for record_id, result in results.items()
+    }, RESULT_TTL)
+    return results
+
+
+def record_result(record):
+    """The ai_result of one record, evaluating its whole session only if something changed."""
+    session_version, _ = submission_feed.current_version(record.class_session_id)
+    result = cache.get(RESULT_KEY.format(record_id=record.id, session_version=session_version))
+    if result is None:
+        result = session_results(record.class_session_id)[record.id]
+    return result
@@ -0,0 +1,117 @@
+# attendance/geofence.py
+"""
+Geofence fraud scoring of attendance records.
+
+A submission is in place if its simulated geolocation falls inside one of the
+campuses in settings.ATTENDANCE_CAMPUSES (DEFAULT_CAMPUSES if unset). A campus
+is either a point with a radius:
+
+    {'name': 'CESAE Digital Braga', 'latitude': 41.5431, 'longitude': -8.4079, 'radius_m': 500}
+
+or a polygon given as [latitude, longitude] vertices:
+
+    {'name': 'Campus', 'polygon': [[41.54, -8.41], [41.55, -8.41], [41.55, -8.40]]}
+
+score_geolocations() scores any number of locations in one vectorized pass:
+haversine distances to every point campus form a (records x campuses)
+matrix, and polygon containment is a ray-casting test run edge by edge over
+all records at once. It backs GeofenceRule in attendance.fraud_rules.
+"""
+import numpy as np
+from django.conf import settings
+
+
+EARTH_RADIUS_M = 6371008.8
+
+DEFAULT_CAMPUSES = [
+    {'name': 'CESAE Digital Braga', 'latitude': 41.5431, 'longitude': -8.4079, 'radius_m': 500},
+]
+
+OUTSIDE = "Geolocation is outside the expected classroom area."
+INCOMPLETE = "Incomplete geolocation data provided."
+MISSING = "Geolocation data missing or could not be obtained."
+
+
+def get_campuses():
+    return getattr(settings, 'ATTENDANCE_CAMPUSES', DEFAULT_CAMPUSES)
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres; arguments in degrees, broadcast like NumPy arrays."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def points_in_polygon(lat, lon, vertices):
+    """Ray casting over all points at once: True where (lat, lon) is inside the polygon."""
+    vertices = np.asarray(vertices, dtype=float)
+    inside = np.zeros(lat.shape, dtype=bool)
+    for (lat_a, lon_a), (lat_b, lon_b) in zip(vertices, np.roll(vertices, -1, axis=0)):
+        crosses = (lat_a > lat) != (lat_b > lat)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            lon_at_lat = lon_a + (lat - lat_a) * (lon_b - lon_a) / (lat_b - lat_a)
+        inside ^= crosses & (lon < lon_at_lat)
+    return inside
+
+
+def coordinates(geolocations):
+    """Latitude and longitude arrays (NaN where missing), plus a mask of missing geolocations."""
+    count = len(geolocations)
+    lat = np.full(count, np.nan)
+    lon = np.full(count, np.nan)
+    missing = np.zeros(count, dtype=bool)
+    for i, geolocation in enumerate(geolocations):
+        if not geolocation:
+            missing[i] = True
+            continue
+        try:
+            lat[i] = float(geolocation.get('latitude'))
+            lon[i] = float(geolocation.get('longitude'))
+        except (TypeError, ValueError):
+            lat[i] = lon[i] = np.nan
+    return lat, lon, missing
+
+
+def score_geolocations(geolocations, campuses=None):
+    """
+    Scores a list of simulated_geolocation dicts (or None). Returns one ai_result
+    dict per input: {'isFraudulent', 'fraudExplanation', 'distanceMeters', 'campus'},
+    where distanceMeters is the distance to the nearest campus (0 inside one).
+    """
+    campuses = get_campuses() if campuses is None else campuses
+    lat, lon, missing = coordinates(geolocations)
+    count = len(geolocations)
+
+    # (records x campuses) distance matrix; 0 inside a campus
+    distances = np.full((count, max(len(campuses), 1)), np.inf)
+    for column, campus in enumerate(campuses):
+        if 'polygon' in campus:
+            vertices = np.asarray(campus['polygon'], dtype=float)
+            # Outside the polygon: distance to its nearest vertex
+            to_vertices = haversine(lat[:, None], lon[:, None], vertices[None, :, 0], vertices[None, :, 1])
+            distances[:, column] = np.where(points_in_polygon(lat, lon, vertices), 0.0, to_vertices.min(axis=1))
+        else:
+            to_center = haversine(lat, lon, campus['latitude'], campus['longitude'])
+            distances[:, column] = np.maximum(to_center - campus.get('radius_m', 0), 0.0)
+
+    nearest = np.argmin(np.where(np.isnan(distances), np.inf, distances), axis=1)
+    nearest_distance = distances[np.arange(count), nearest]
+    incomplete = ~missing & np.isnan(nearest_distance)
+
+    results = []
+    for i in range(count):
+        if missing[i]:
+            results.append({'isFraudulent': True, 'fraudExplanation': MISSING})
+        elif incomplete[i]:
+            results.append({'isFraudulent': True, 'fraudExplanation': INCOMPLETE})
+        else:
+            inside = nearest_distance[i] == 0
+            results.append({
+                'isFraudulent': not inside,
+                'fraudExplanation': "No issues detected." if inside else OUTSIDE,
+                'distanceMeters': round(float(nearest_distance[i]), 1),
+                'campus': campuses[nearest[i]].get('name') if campuses else None,
+            })
+    return results
+
@@ -0,0 +1,350 @@
+# attendance/instrumentation.py
+"""
+Per-request timing and SQL metrics, aggregated per view.
+
+RequestMetricsMiddleware is opt-in (settings add it to MIDDLEWARE when the
+ATTENDANCE_METRICS environment variable is set). For every request it
+records the wall time, status and response size under the resolved view
+name; a sample of the requests (ATTENDANCE_METRICS_SAMPLE_RATE, default 0.1)
+also records:
+
+- the SQL query count and DB time, through an execute wrapper every database
+  connection gets when it is opened,
+- duplicate queries: statements run more than once in the request once their
+  literals are replaced by '?' (an N+1 shows up as one fingerprint repeated
+  per row),
+- the template render time (outermost Template.render calls, so {% include %}
+  and {% extends %} are not counted twice).
+
+Unsampled requests only pay for two clock reads and a few appends; the
+wrappers return straight away when no sampled request is running in their
+context. Streamed responses are timed up to the first byte and their size is
+only known when they set Content-Length.
+
+Each view keeps its last ATTENDANCE_METRICS_RESERVOIR observations (default
+1024) for the percentiles. Metrics are per process: with several workers,
+scrape each of them. snapshot() feeds the staff JSON endpoint and
+prometheus_text() the text exposition one.
+"""
+import math
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template import base as template_base
+
+
+DEFAULT_SAMPLE_RATE = 0.1
+DEFAULT_RESERVOIR = 1024
+MAX_FINGERPRINTS = 50 # per view; duplicates of further statements are counted but not itemised
+QUANTILES = (0.5, 0.95, 0.99)
+UNRESOLVED = '<unresolved>'
+
+_sample = ContextVar('attendance_request_sample', default=None)
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\bIN \((?:\s*(?:%s|\?)\s*,)*\s*(?:%s|\?)\s*\)', re.IGNORECASE)
+
+
+def fingerprint(sql):
+    """The statement with its literals and IN (...) lists normalised, so repeats with other values match."""
+    sql = _LITERALS.sub('?', sql)
+    return _IN_LISTS.sub('IN (...)', sql)
+
+
+def percentile(ordered, q):
+    """Nearest-rank percentile of an already sorted list (None when empty)."""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class RequestSample:
+    """What one sampled request did."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.template_time = 0.0
+        self.template_depth = 0
+        self.fingerprints = Counter()
+
+    def duplicates(self):
+        return {sql: count - 1 for sql, count in self.fingerprints.items() if count > 1}
+
+
+class ViewStats:
+    """Counters and bounded reservoirs of one view."""
+
+    def __init__(self, reservoir):
+        self.requests = 0
+        self.server_errors = 0
+        self.sampled = 0
+        self.duration_sum = 0.0
+        self.sized = 0
+        self.bytes_sum = 0
+        self.queries_sum = 0
+        self.db_time_sum = 0.0
+        self.template_time_sum = 0.0
+        self.duplicate_queries = 0
+        self.durations = deque(maxlen=reservoir)
+        self.sizes = deque(maxlen=reservoir)
+        self.queries = deque(maxlen=reservoir)
+        self.db_times = deque(maxlen=reservoir)
+        self.template_times = deque(maxlen=reservoir)
+        self.fingerprints = Counter() # fingerprint -> extra executions
+
+    def observe(self, status, duration, size, sample):
+        self.requests += 1
+        self.server_errors += status >= 500
+        self.duration_sum += duration
+        self.durations.append(duration)
+        if size is not None:
+            self.sized += 1
+            self.bytes_sum += size
+            self.sizes.append(size)
+        if sample is None:
+            return
+        self.sampled += 1
+        self.queries_sum += sample.queries
+        self.db_time_sum += sample.db_time
+        self.template_time_sum += sample.template_time
+        self.queries.append(sample.queries)
+        self.db_times.append(sample.db_time)
+        self.template_times.append(sample.template_time)
+        for sql, extra in sample.duplicates().items():
+            self.duplicate_queries += extra
+            if sql in self.fingerprints or len(self.fingerprints) < MAX_FINGERPRINTS:
+                self.fingerprints[sql] += extra
+
+    def summary(self):
+        def quantiles(values, scale=1):
+            ordered = [round(value * scale, 3) for value in sorted(values)]
+            return {f'p{int(q * 100)}': percentile(ordered, q) for q in QUANTILES}
+
+        return {
+            'requests': self.requests,
+            'server_errors': self.server_errors,
+            'sampled': self.sampled,
+            'duration_ms': quantiles(self.durations, 1000),
+            'response_bytes': quantiles(self.sizes),
+            'queries': quantiles(self.queries),
+            'db_ms': quantiles(self.db_times, 1000),
+            'template_ms': quantiles(self.template_times, 1000),
+            'duplicate_queries': self.duplicate_queries,
+            'top_duplicates': [
+                {'fingerprint': sql, 'extra_executions': count} for sql, count in self.fingerprints.most_common(10)
+            ],
+        }
+
+
+class MetricsRegistry:
+    """Thread-safe ViewStats per view name."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.views = {}
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self.views = {}
+
+    def observe(self, view, status, duration, size, sample=None):
+        with self._lock:
+            stats = self.views.get(view)
+            if stats is None:
+                stats = self.views[view] = ViewStats(getattr(settings, 'ATTENDANCE_METRICS_RESERVOIR', DEFAULT_RESERVOIR))
+            stats.observe(status, duration, size, sample)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'since': self.started,
+                'sample_rate': sample_rate(),
+                'views': {view: stats.summary() for view, stats in sorted(self.views.items())},
+            }
+
+    def prometheus_text(self):
+        """Text exposition format: a summary per measure, labelled by view."""
+        with self._lock:
+            views = sorted(self.views.items())
+            lines = []
+
+            def summary(name, help_text, reservoir, total, count, scale=1):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} summary')
+                for view, stats in views:
+                    label = _label(view)
+                    ordered = sorted(getattr(stats, reservoir))
+                    for q in QUANTILES:
+                        value = percentile(ordered, q)
+                        lines.append(f'{name}{{view="{label}",quantile="{q}"}} {"NaN" if value is None else value * scale}')
+                    lines.append(f'{name}_sum{{view="{label}"}} {getattr(stats, total) * scale}')
+                    lines.append(f'{name}_count{{view="{label}"}} {getattr(stats, count)}')
+
+            def counter(name, help_text, attribute):
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} counter')
+                for view, stats in views:
+                    lines.append(f'{name}{{view="{_label(view)}"}} {getattr(stats, attribute)}')
+
+            counter('attendance_http_requests_total', 'Requests handled.', 'requests')
+            counter('attendance_http_server_errors_total', 'Requests answered with a 5xx status.', 'server_errors')
+            counter('attendance_http_sampled_requests_total', 'Requests whose queries and templates were measured.', 'sampled')
+            summary('attendance_http_request_duration_seconds', 'Wall time to the response (first byte if streamed).',
+                    'durations', 'duration_sum', 'requests')
+            summary('attendance_http_response_size_bytes', 'Response body size, when known.',
+                    'sizes', 'bytes_sum', 'sized')
+            summary('attendance_http_request_queries', 'SQL queries per sampled request.',
+                    'queries', 'queries_sum', 'sampled')
+            summary('attendance_http_request_db_seconds', 'SQL time per sampled request.',
+                    'db_times', 'db_time_sum', 'sampled')
+            summary('attendance_http_request_template_seconds', 'Template render time per sampled request.',
+                    'template_times', 'template_time_sum', 'sampled')
+            counter('attendance_http_duplicate_queries_total',
+                    'Extra executions of a query fingerprint already run in the same sampled request.', 'duplicate_queries')
+        return '\n'.join(lines) + '\n'
+
+
+def _label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry = MetricsRegistry()
+
+
+def sample_rate():
+    return getattr(settings, 'ATTENDANCE_METRICS_SAMPLE_RATE', DEFAULT_SAMPLE_RATE)
+
+
+def snapshot():
+    """Per-view percentiles of this process since start (or the last reset())."""
+    return registry.snapshot()
+
+
+def prometheus_text():
+    return registry.prometheus_text()
+
+
+def reset():
+    registry.reset()
+
+
+# --- Hooks --------------------------------------------------------------------
+
+def _record_query(execute, sql, params, many, context):
+    sample = _sample.get()
+    if sample is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        sample.db_time += time.perf_counter() - started
+        sample.queries += 1
+        sample.fingerprints[fingerprint(sql)] += 1
+
+
+def _add_query_wrapper(connection, **kwargs):
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+_original_render = template_base.Template.render
+
+
+def _timed_render(self, context):
+    sample = _sample.get()
+    if sample is None or sample.template_depth:
+        return _original_render(self, context)
+    sample.template_depth += 1
+    started = time.perf_counter()
+    try:
+        return _original_render(self, context)
+    finally:
+        sample.template_time += time.perf_counter() - started
+        sample.template_depth -= 1
+
+
+_installed = False
+_install_lock = threading.Lock()
+
+
+def install():
+    """Hooks the query and template timers in once per process (the middleware does it on load)."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        connection_created.connect(_add_query_wrapper, dispatch_uid='attendance_request_metrics')
+        for connection in connections.all(initialized_only=True):
+            _add_query_wrapper(connection)
+        template_base.Template.render = _timed_render
+        _installed = True
+
+
+# --- Middleware -----------------------------------------------------------------
+
+class RequestMetricsMiddleware:
+    """Records every request in the registry; see the module docstring."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        sample, token = self._start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            if token is not None:
+                _sample.reset(token)
+        self._finish(request, response, time.perf_counter() - started, sample)
+        return response
+
+    async def __acall__(self, request):
+        sample, token = self._start()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                _sample.reset(token)
+        self._finish(request, response, time.perf_counter() - started, sample)
+        return response
+
+    @staticmethod
+    def _start():
+        if random.random() >= sample_rate():
+            return None, None
+        sample = RequestSample()
+        return sample, _sample.set(sample)
+
+    @staticmethod
+    def _finish(request, response, duration, sample):
+        match = getattr(request, 'resolver_match', None)
+        view = match.view_name if match is not None else UNRESOLVED
+        if response.streaming:
+            length = response.get('Content-Length')
+            size = int(length) if length and length.isdigit() else None
+        else:
+            size = len(response.content)
+        registry.observe(view, response.status_code, duration, size, sample)
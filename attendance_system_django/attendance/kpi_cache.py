@@ -0,0 +1,142 @@
+# attendance/kpi_cache.py
+"""
+Cache of the teacher dashboard counters (courses taught, distinct students
+enrolled, pending validations and active codes).
+
+An entry is stored per teacher together with the generation number of each
+of the teacher's courses. Anything that changes a course's counters (an
+enrollment, a record or a code, see attendance/signals.py and the rollup
+helpers) bumps that course's generation, which makes every entry built
+before it stale without having to know which teachers it belongs to. Entries
+also expire after KPI_TTL seconds, and no later than the first active code
+expiry they counted.
+
+Lookups and invalidations only touch the cache; the database is queried on
+misses. stats() reports hits and misses.
+"""
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Min
+from django.utils import timezone
+
+from courses.models import Course
+from attendance import analytics
+from attendance.models import AttendanceCode, Enrollment
+
+
+KPI_KEY = 'attendance:teacher_kpis:{teacher_id}'
+GENERATION_KEY = 'attendance:kpi_generation:{course_id}'
+KPI_TTL = 60
+
+
+class CacheStats:
+    """Thread-safe hit/miss/invalidation counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.counters = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+        lookups = counters['hits'] + counters['misses']
+        counters['hit_rate'] = round(counters['hits'] / lookups, 3) if lookups else None
+        return counters
+
+
+_stats = CacheStats()
+
+
+def stats():
+    """Hit/miss counters of this process since start (or the last reset_stats())."""
+    return _stats.snapshot()
+
+
+def reset_stats():
+    _stats.reset()
+
+
+def teacher_kpis(teacher):
+    """
+    Returns the teacher's dashboard counters:
+    {'courses', 'students', 'pending_validations', 'active_codes'}
+    """
+    key = KPI_KEY.format(teacher_id=teacher.pk)
+    entry = cache.get(key)
+    if entry is not None and entry['generations'] == _generations(entry['course_ids']):
+        _stats.incr('hits')
+        return entry['kpis']
+
+    _stats.incr('misses')
+    course_ids = list(Course.objects.filter(teachers=teacher).values_list('id', flat=True))
+    # Read before counting: a change committed while counting leaves the entry stale
+    generations = _generations(course_ids)
+    kpis, next_expiry = compute_kpis(course_ids)
+
+    ttl = KPI_TTL
+    if next_expiry is not None:
+        ttl = min(ttl, (next_expiry - timezone.now()).total_seconds())
+    if ttl > 0:
+        cache.set(key, {'course_ids': course_ids, 'generations': generations, 'kpis': kpis}, ttl)
+    return kpis
+
+
+def compute_kpis(course_ids):
+    """The counters for a set of courses, plus the earliest expiry among their active codes."""
+    codes = AttendanceCode.objects.filter(
+        class_session__course_id__in=course_ids,
+        expires_at__gt=timezone.now(),
+        is_active=True
+    ).aggregate(total=Count('id'), next_expiry=Min('expires_at'))
+
+    kpis = {
+        'courses': len(course_ids),
+        'students': Enrollment.objects.filter(
+            course_id__in=course_ids,
+            student__role='student',
+        ).values('student').distinct().count(),
+        'pending_validations': analytics.pending_validations(course_ids),
+        'active_codes': codes['total'],
+    }
+    return kpis, codes['next_expiry']
+
+
+def _generations(course_ids):
+    keys = [GENERATION_KEY.format(course_id=course_id) for course_id in course_ids]
+    values = cache.get_many(keys)
+    return [values.get(key, 0) for key in keys]
+
+
+# --- Invalidation ---
+
+def invalidate_courses(course_ids):
+    """Makes the entries of every teacher of these courses stale, once the transaction commits."""
+    course_ids = set(course_ids)
+    if course_ids:
+        transaction.on_commit(lambda: _bump_generations(course_ids))
+
+
+def invalidate_teachers(teacher_ids):
+    """Drops teachers' entries directly, e.g. when the courses they teach change."""
+    keys = [KPI_KEY.format(teacher_id=teacher_id) for teacher_id in teacher_ids]
+    if keys:
+        transaction.on_commit(lambda: cache.delete_many(keys))
+        _stats.incr('invalidations', len(keys))
+
+
+def _bump_generations(course_ids):
+    # A timestamp rather than a counter: an evicted key never comes back with a value seen before
+    generation = time.time_ns()
+    cache.set_many({GENERATION_KEY.format(course_id=course_id): generation for course_id in course_ids}, timeout=None)
+    _stats.incr('invalidations', len(course_ids))
@@ -0,0 +1,122 @@
+# attendance/management/commands/benchmark_channel_layer.py
+
+from django.core.management.base import BaseCommand, CommandError
+import asyncio
+
+from attendance.channel_benchmark import DEFAULT_MIX, LAYERS, MESSAGE_TYPES, PRODUCTION_CONFIG, run
+
+
+def int_list(value):
+    return [int(item) for item in value.split(',') if item.strip()]
+
+
+class Command(BaseCommand):
+    help = (
+        'Opens thousands of simulated ClassSessionConsumer/StudentNotificationConsumer sockets, drives '
+        'send_group_notification() traffic through a channel layer and reports messages/s, delivery '
+        'latency and drops by cause (capacity, expiry, group expiry). Pass several --capacity or '
+        '--group-expiry values to compare them. See attendance/channel_benchmark.py.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--layer', choices=LAYERS, default='memory',
+                            help="memory, redis-standin (in-process Redis approximation) or redis (needs --redis-url)")
+        parser.add_argument('--redis-url', type=str, default=None, help='Redis URL for --layer redis')
+        parser.add_argument('--rtt-ms', type=float, default=0.5, help='Simulated Redis round trip (default: 0.5)')
+        parser.add_argument('--capacity', type=int_list, default=None,
+                            help='Channel capacity, or a comma-separated list to sweep (default: the production value)')
+        parser.add_argument('--expiry', type=int, default=None, help='Message expiry in seconds (default: production value)')
+        parser.add_argument('--group-expiry', type=int_list, default=None,
+                            help='Group membership expiry in seconds, or a list to sweep (default: production value)')
+        parser.add_argument('--sessions', type=int, default=50, help='Class session groups (default: 50)')
+        parser.add_argument('--teachers-per-session', type=int, default=2, help='Dashboards per session (default: 2)')
+        parser.add_argument('--students', type=int, default=2000, help='Student sockets (default: 2,000)')
+        parser.add_argument('--courses', type=int, default=40, help='Course groups (default: 40)')
+        parser.add_argument('--courses-per-student', type=int, default=1,
+                            help='Course groups each student opts in to (default: 1)')
+        parser.add_argument('--messages', type=int, default=5000, help='Notifications to send (default: 5,000)')
+        parser.add_argument('--rate', type=float, default=0,
+                            help='Notifications per second (default: 0, as fast as possible)')
+        parser.add_argument('--mix', type=str, default=','.join(f'{kind}:{weight}' for kind, weight in DEFAULT_MIX.items()),
+                            help='Weights of the target groups (default: %(default)s)')
+        parser.add_argument('--settle', type=float, default=5.0,
+                            help='Seconds without deliveries before the rest count as dropped (default: 5)')
+        parser.add_argument('--coalesce', action='store_true',
+                            help='Teacher sockets ask for coalesced batch frames (?coalesce=1)')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed (default: 42)')
+
+    def handle(self, *args, **options):
+        mix = self.parse_mix(options['mix'])
+        for name in ('sessions', 'teachers_per_session', 'students', 'courses', 'messages'):
+            if options[name] < 0:
+                raise CommandError(f"--{name.replace('_', '-')} must not be negative")
+
+        defaults = PRODUCTION_CONFIG[options['layer']]
+        capacities = options['capacity'] or [defaults['capacity']]
+        group_expiries = options['group_expiry'] or [defaults['group_expiry']]
+        rate = f"{options['rate']:g}/s" if options['rate'] else 'unthrottled'
+        self.stdout.write(self.style.WARNING(
+            f"{options['layer']} layer: {options['sessions'] * options['teachers_per_session']} teacher and "
+            f"{options['students']} student sockets, {options['messages']} notifications "
+            f"({rate})..."
+        ))
+        self.stdout.write(
+            f"{'capacity':>8} {'grp exp':>8} {'sent/s':>9} {'deliv/s':>9} {'expected':>9} {'frames':>9} {'dropped':>8} "
+            f"{'full':>7} {'expired':>7} {'evicted':>7} {'peak':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}"
+        )
+
+        for capacity in capacities:
+            for group_expiry in group_expiries:
+                try:
+                    result = asyncio.run(run(
+                        layer=options['layer'], capacity=capacity, expiry=options['expiry'], group_expiry=group_expiry,
+                        redis_url=options['redis_url'], rtt_ms=options['rtt_ms'],
+                        sessions=options['sessions'], teachers_per_session=options['teachers_per_session'],
+                        students=options['students'], courses=options['courses'],
+                        courses_per_student=options['courses_per_student'], messages=options['messages'],
+                        rate=options['rate'], mix=mix, settle=options['settle'], seed=options['seed'],
+                        coalesce=options['coalesce'],
+                    ))
+                except ValueError as error:
+                    raise CommandError(str(error))
+                self.report(result)
+
+        self.stdout.write(
+            'peak: deepest channel queue seen, i.e. the smallest capacity that would have dropped nothing. '
+            'evicted: group memberships lost to group_expiry (or, in memory, to an expired message); '
+            'those sockets get nothing more until they reconnect.'
+        )
+
+    def parse_mix(self, value):
+        mix = {}
+        for item in value.split(','):
+            kind, _, weight = item.partition(':')
+            if kind.strip() not in MESSAGE_TYPES or not weight.strip().replace('.', '', 1).isdigit():
+                raise CommandError(f"--mix takes kind:weight pairs with kinds {', '.join(MESSAGE_TYPES)}, got '{item}'")
+            mix[kind.strip()] = float(weight)
+        if not any(mix.values()):
+            raise CommandError('--mix needs a positive weight')
+        return mix
+
+    def report(self, result):
+        counters = result.layer_counters or {}
+
+        def count(name):
+            return f'{counters[name]:>7}' if name in counters else f"{'-':>7}"
+
+        def latency(q):
+            value = result.latency(q)
+            return f'{value:>8.1f}' if value is not None else f"{'-':>8}"
+
+        line = (
+            f"{result.config['capacity']:>8} {result.config['group_expiry']:>8} "
+            f"{result.sent_per_second:>9,.0f} {result.delivered_per_second:>9,.0f} "
+            f"{result.expected:>9} {result.frames:>9} {result.dropped:>8} {count('full')} {count('expired')} {count('evicted')} "
+            f"{result.peak_depth if result.peak_depth is not None else '-':>6} "
+            f"{latency(0.5)} {latency(0.95)} {latency(0.99)} {latency(1)}"
+        )
+        self.stdout.write(self.style.ERROR(line) if result.dropped else line)
+        if result.queue_dropped:
+            self.stdout.write(self.style.ERROR(
+                f'  {result.queue_dropped} notifications dropped by the full dispatcher queue before reaching the layer'
+            ))
@@ -0,0 +1,82 @@
+# attendance/management/commands/benchmark_fraud_rules.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from datetime import timedelta
+import random
+import statistics
+import time
+
+from attendance.fraud_rules import FraudEngine, RecordBatch
+from attendance.geofence import get_campuses
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures the scoring throughput (records/second) of each fraud rule and of the '
+        'whole engine on a synthetic batch. Runs in memory: nothing is read from or written to the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=100_000, help='Records in the batch (default: 100,000)')
+        parser.add_argument('--sessions', type=int, default=200, help='Class sessions they belong to (default: 200)')
+        parser.add_argument('--students', type=int, default=5000, help='Distinct students (default: 5,000)')
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs per rule (default: 5)')
+
+    def handle(self, *args, **options):
+        if min(options['records'], options['sessions'], options['students'], options['repeat']) < 1:
+            raise CommandError('All options must be positive')
+        random.seed(42)
+
+        batch = self.synthetic_batch(options['records'], options['sessions'], options['students'])
+        engine = FraudEngine()
+        self.stdout.write(self.style.WARNING(
+            f"Scoring {len(batch)} records ({options['sessions']} sessions, {options['students']} students), "
+            f"median of {options['repeat']} runs..."
+        ))
+
+        self.stdout.write(f"{'rule':<16} {'median ms':>10} {'records/s':>14} {'flagged':>9}")
+        for rule in engine.rules:
+            self.report(rule.name, lambda: rule.evaluate(batch), options['repeat'], len(batch),
+                        lambda explanations: sum(1 for explanation in explanations if explanation))
+        self.report('engine', lambda: engine.evaluate(batch), options['repeat'], len(batch),
+                    lambda results: sum(1 for result in results if result['isFraudulent']))
+
+    def report(self, name, run, repeat, size, count_flagged):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = run()
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        self.stdout.write(
+            f"{name:<16} {median * 1000:>10.1f} {size / median:>14,.0f} {count_flagged(output):>9}"
+        )
+
+    def synthetic_batch(self, records, sessions, students):
+        """Submissions around the first campus, with a share of shared IPs, far-away and missing locations."""
+        campus = get_campuses()[0]
+        center = campus.get('latitude', 41.5431), campus.get('longitude', -8.4079)
+        now = timezone.now()
+
+        rows = []
+        for record_id in range(1, records + 1):
+            session_id = random.randrange(sessions)
+            roll = random.random()
+            if roll < 0.02:
+                geolocation = None
+            elif roll < 0.10:
+                geolocation = {'latitude': center[0] + random.uniform(-1, 1), 'longitude': center[1] + random.uniform(-1, 1)}
+            else:
+                geolocation = {'latitude': random.gauss(center[0], 0.002), 'longitude': random.gauss(center[1], 0.002)}
+            rows.append({
+                'id': record_id,
+                'student_id': random.randrange(students),
+                'class_session_id': session_id,
+                'timestamp': now - timedelta(minutes=session_id * 90) + timedelta(seconds=random.randrange(600)),
+                'simulated_ip': f'192.168.1.{random.randrange(1, 255)}' if random.random() < 0.9
+                                else f'10.0.{random.randrange(256)}.{random.randrange(1, 255)}',
+                'simulated_geolocation': geolocation,
+            })
+        # The batch is its own history, so VelocityRule does not query the database
+        return RecordBatch(rows, history=[])
@@ -0,0 +1,256 @@
+# attendance/management/commands/benchmark_query_plans.py
+
+from django.core.management.base import BaseCommand
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+from datetime import datetime, time, timedelta
+from itertools import islice
+import math
+import random
+import statistics
+import time as timer
+
+from core.models import User
+from courses.models import Course, ClassSession
+from attendance.models import AttendanceCode, AttendanceRecord, Enrollment, AbsenceJustification
+from attendance.rollups import rebuild_daily_stats
+
+
+# Indexes added for the attendance hot paths, grouped by model
+BENCHMARK_INDEXES = {
+    AttendanceRecord: ['attrecord_student_ts_idx', 'attrecord_pending_idx'],
+    ClassSession: ['classsession_date_time_idx'],
+    AttendanceCode: ['attcode_active_expiry_idx'],
+    AbsenceJustification: ['absjust_session_status_idx'],
+}
+
+# Views only count these rows, so they are timed with .count() instead of being fetched
+COUNTED_QUERIES = {'active_codes', 'pending_validations', 'approved_justifications'}
+
+BENCH_PREFIX = 'bench'
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds a large attendance data set and prints query plans and timings for the '
+        'hot-path queries with and without the composite/partial indexes. '
+        'Run it against a scratch database: the seeded rows are not removed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--records', type=int, default=1_000_000,
+                            help='Number of attendance records to seed (default: 1,000,000)')
+        parser.add_argument('--courses', type=int, default=20, help='Number of benchmark courses (default: 20)')
+        parser.add_argument('--students-per-course', type=int, default=200,
+                            help='Students enrolled in each benchmark course (default: 200)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_create batch size (default: 5000)')
+        parser.add_argument('--repeat', type=int, default=20, help='Timed runs per query (default: 20)')
+        parser.add_argument('--skip-seed', action='store_true', help='Reuse previously seeded benchmark data')
+
+    def handle(self, *args, **options):
+        random.seed(42)
+
+        if options['skip_seed'] or Course.objects.filter(code__startswith=BENCH_PREFIX.upper()).exists():
+            self.stdout.write(self.style.WARNING('Reusing existing benchmark data'))
+        else:
+            self.seed(options)
+
+        self.analyze()
+        queries = self.hot_queries()
+
+        self.stdout.write(self.style.SUCCESS('\n=== WITH INDEXES ==='))
+        after = self.measure(queries, options['repeat'])
+
+        self.drop_indexes()
+        try:
+            self.analyze()
+            self.stdout.write(self.style.SUCCESS('\n=== WITHOUT INDEXES ==='))
+            before = self.measure(queries, options['repeat'])
+        finally:
+            self.stdout.write(self.style.WARNING('\nRestoring indexes...'))
+            self.create_indexes()
+            self.analyze()
+
+        self.stdout.write(self.style.SUCCESS('\n=== SUMMARY (median ms) ==='))
+        self.stdout.write(f"{'query':<32} {'without':>10} {'with':>10} {'speedup':>9}")
+        for name in queries:
+            speedup = before[name] / after[name] if after[name] else float('inf')
+            self.stdout.write(f"{name:<32} {before[name]:>10.2f} {after[name]:>10.2f} {speedup:>8.1f}x")
+
+    # --- Seeding ---
+
+    def seed(self, options):
+        total_records = options['records']
+        courses_count = options['courses']
+        per_course = options['students_per_course']
+        batch_size = options['batch_size']
+        sessions_per_course = max(1, math.ceil(total_records / (courses_count * per_course)))
+
+        self.stdout.write(self.style.WARNING(
+            f'Seeding {courses_count} courses x {per_course} students x {sessions_per_course} sessions...'
+        ))
+        started = timer.monotonic()
+        password = make_password('password123')
+
+        with transaction.atomic():
+            teacher = User.objects.create(
+                username=f'{BENCH_PREFIX}.teacher', role='teacher', password=password, is_staff=True
+            )
+            courses = Course.objects.bulk_create([
+                Course(name=f'Benchmark Course {i}', code=f'{BENCH_PREFIX.upper()}{i:04d}')
+                for i in range(courses_count)
+            ])
+            teacher.courses_taught.add(*courses)
+
+            students = User.objects.bulk_create([
+                User(username=f'{BENCH_PREFIX}_student{i}', role='student', password=password)
+                for i in range(courses_count * per_course)
+            ], batch_size=batch_size)
+            roster = {
+                course.id: students[i * per_course:(i + 1) * per_course]
+                for i, course in enumerate(courses)
+            }
+            Enrollment.objects.bulk_create([
+                Enrollment(student=student, course_id=course_id)
+                for course_id, course_students in roster.items()
+                for student in course_students
+            ], batch_size=batch_size)
+
+            # One session per weekday going back from today, rotating through three slots
+            slots = [(time(9, 0), time(12, 0)), (time(14, 0), time(17, 0)), (time(18, 30), time(21, 30))]
+            dates = []
+            day = timezone.localdate()
+            while len(dates) < sessions_per_course:
+                if day.weekday() < 5:
+                    dates.append(day)
+                day -= timedelta(days=1)
+            sessions = ClassSession.objects.bulk_create([
+                ClassSession(course=course, date=date, start_time=slots[n % 3][0], end_time=slots[n % 3][1])
+                for course in courses
+                for n, date in enumerate(dates)
+            ], batch_size=batch_size)
+
+            now = timezone.now()
+            today = timezone.localdate()
+            AttendanceCode.objects.bulk_create([
+                AttendanceCode(
+                    class_session=session,
+                    code=f'{n:06X}'[-6:],
+                    expires_at=now + timedelta(minutes=10) if session.date == today else
+                    timezone.make_aware(datetime.combine(session.date, session.start_time)) + timedelta(minutes=10),
+                    is_active=session.date == today,
+                    generated_by=teacher,
+                )
+                for n, session in enumerate(sessions)
+            ], batch_size=batch_size)
+
+            records = self._iter_records(sessions, roster, total_records)
+            written = 0
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                AttendanceRecord.objects.bulk_create(batch, batch_size=batch_size)
+                written += len(batch)
+                if written % (batch_size * 20) == 0:
+                    self.stdout.write(f'  {written:,} records')
+
+            AbsenceJustification.objects.bulk_create(self._iter_justifications(sessions, roster), batch_size=batch_size)
+
+        rebuild_daily_stats()
+        elapsed = timer.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(f'✓ Seeded {written:,} records in {elapsed:.1f}s'))
+
+    def _iter_records(self, sessions, roster, limit):
+        produced = 0
+        for session in sessions:
+            for student in roster[session.course_id]:
+                if produced >= limit:
+                    return
+                produced += 1
+                yield AttendanceRecord(
+                    class_session=session,
+                    student=student,
+                    is_present=random.random() < 0.85,
+                    simulated_ip=f'192.168.1.{random.randint(1, 254)}',
+                    simulated_geolocation={
+                        'latitude': 41.5369 + random.uniform(-0.01, 0.01),
+                        'longitude': -8.4239 + random.uniform(-0.01, 0.01),
+                    },
+                )
+
+    def _iter_justifications(self, sessions, roster):
+        for session in sessions:
+            for student in random.sample(roster[session.course_id], 2):
+                yield AbsenceJustification(
+                    student=student,
+                    class_session=session,
+                    description='Benchmark justification',
+                    status=random.choice(['pending', 'approved', 'rejected']),
+                    justification_type=random.choice(['absence', 'late_arrival']),
+                )
+
+    # --- Measuring ---
+
+    def hot_queries(self):
+        teacher = User.objects.get(username=f'{BENCH_PREFIX}.teacher')
+        courses = list(Course.objects.filter(teachers=teacher).values_list('id', flat=True))
+        student = User.objects.filter(username__startswith=f'{BENCH_PREFIX}_student').order_by('id').first()
+        today = timezone.localdate()
+        now = timezone.now()
+        recent_sessions = ClassSession.objects.filter(course_id__in=courses, date__gte=today - timedelta(days=30))
+
+        return {
+            'student_history': lambda: AttendanceRecord.objects.filter(
+                student=student).order_by('-timestamp')[:10],
+            'current_sessions': lambda: ClassSession.objects.filter(
+                date=today, start_time__lte=now.time(), end_time__gte=now.time()),
+            'teacher_today_sessions': lambda: ClassSession.objects.filter(
+                course_id__in=courses, date=today).order_by('start_time'),
+            'active_codes': lambda: AttendanceCode.objects.filter(
+                is_active=True, expires_at__gt=now),
+            'pending_validations': lambda: AttendanceRecord.objects.filter(
+                class_session__course_id__in=courses, is_present=False).order_by(),
+            'approved_justifications': lambda: AbsenceJustification.objects.filter(
+                class_session__in=recent_sessions, status='approved').order_by(),
+        }
+
+    def measure(self, queries, repeat):
+        medians = {}
+        for name, build in queries.items():
+            queryset = build()
+            self.stdout.write(self.style.HTTP_INFO(f'\n-- {name}'))
+            self.stdout.write(queryset.explain())
+
+            runs = []
+            for _ in range(repeat):
+                started = timer.perf_counter()
+                if name in COUNTED_QUERIES:
+                    build().count()
+                else:
+                    list(build())
+                runs.append((timer.perf_counter() - started) * 1000)
+            medians[name] = statistics.median(runs)
+            self.stdout.write(f'median {medians[name]:.2f} ms over {repeat} runs')
+        return medians
+
+    def analyze(self):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def drop_indexes(self):
+        with connection.schema_editor() as editor:
+            for model, index in self._indexes():
+                editor.remove_index(model, index)
+
+    def create_indexes(self):
+        with connection.schema_editor() as editor:
+            for model, index in self._indexes():
+                editor.add_index(model, index)
+
+    def _indexes(self):
+        for model, names in BENCHMARK_INDEXES.items():
+            for index in model._meta.indexes:
+                if index.name in names:
+                    yield model, index
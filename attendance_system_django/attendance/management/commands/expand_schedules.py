@@ -0,0 +1,49 @@
+# attendance/management/commands/expand_schedules.py
+
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime
+import time
+
+from courses.scheduling import reconcile
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates the class sessions of the scheduled courses from their CourseSchedule rows, '
+        'inserting missing sessions and updating or deleting the ones the schedules no longer describe. '
+        'Only the difference is written, so re-running it is cheap.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course', type=int, action='append', default=None,
+                            help='Course ID (repeat for several courses; default: every scheduled course)')
+        parser.add_argument('--from', dest='date_from', type=str, default=None,
+                            help='First date to reconcile (YYYY-MM-DD; default: start of the terms)')
+        parser.add_argument('--to', dest='date_to', type=str, default=None,
+                            help='Last date to reconcile (YYYY-MM-DD; default: end of the terms)')
+        parser.add_argument('--dry-run', action='store_true', help='Report the changes without writing them')
+
+    def handle(self, *args, **options):
+        try:
+            date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date() if options['date_from'] else None
+            date_to = datetime.strptime(options['date_to'], '%Y-%m-%d').date() if options['date_to'] else None
+        except ValueError:
+            raise CommandError('Dates must be in YYYY-MM-DD format')
+        if date_from and date_to and date_from > date_to:
+            raise CommandError('--from must not be after --to')
+
+        started = time.monotonic()
+        result = reconcile(options['course'], date_from, date_to, dry_run=options['dry_run'])
+        elapsed = time.monotonic() - started
+
+        summary = (f'{result.expected} scheduled sessions: {result.created} created, '
+                   f'{result.updated} updated, {result.deleted} deleted ({elapsed:.2f}s)')
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'Dry run, nothing written. {summary}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✓ {summary}'))
+        if result.kept:
+            self.stdout.write(self.style.WARNING(
+                f'{len(result.kept)} sessions are no longer scheduled but have attendance, so they were kept: '
+                f'{result.kept[:20]}{" ..." if len(result.kept) > 20 else ""}'
+            ))
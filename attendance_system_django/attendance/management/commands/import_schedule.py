@@ -0,0 +1,72 @@
+# attendance/management/commands/import_schedule.py
+
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.schedule_import import TABLES, ImportResult, ScheduleImportError, import_schedule, parse_csv, parse_json
+
+
+class Command(BaseCommand):
+    help = (
+        'Imports users, courses, teacher assignments, enrollments and recurring class sessions '
+        'from a JSON document or one CSV file per table. Rows are validated first, existing ones '
+        'are skipped and the rest are bulk inserted. See attendance/schedule_import.py for the columns.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', type=str, default=None, help='JSON document with any of: ' + ', '.join(TABLES))
+        for table in TABLES:
+            parser.add_argument(f'--{table}', type=str, default=None, help=f'CSV file of {table}')
+        parser.add_argument('--default-password', type=str, default=None,
+                            help='Password of new users without one (default: unusable password)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per INSERT (default: 1000)')
+        parser.add_argument('--dry-run', action='store_true', help='Validate and count, then roll back')
+
+    def handle(self, *args, **options):
+        data = {table: [] for table in TABLES}
+        try:
+            if options['json']:
+                with open(options['json'], encoding='utf-8') as file:
+                    data.update(parse_json(file))
+            for table in TABLES:
+                if options[table]:
+                    with open(options[table], newline='', encoding='utf-8-sig') as file:
+                        data.update(parse_csv(table, file))
+        except (OSError, ValueError) as error:
+            raise CommandError(f'Could not read the input: {error}')
+        if not any(data.values()):
+            raise CommandError('Pass --json FILE or at least one of: ' + ', '.join(f'--{table}' for table in TABLES))
+
+        try:
+            result = import_schedule(
+                data,
+                default_password=options['default_password'],
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+            )
+        except ScheduleImportError as error:
+            for table, row, message in error.errors[:50]:
+                self.stderr.write(f'{table} row {row}: {message}')
+            raise CommandError(f'{len(error.errors)} invalid rows, nothing was imported')
+
+        self.report(result, options['dry_run'])
+
+    def report(self, result: ImportResult, dry_run):
+        self.stdout.write(f"{'table':<12} {'rows':>9} {'created':>9} {'existing':>9}")
+        for table, counts in result.tables.items():
+            self.stdout.write(f"{table:<12} {counts['rows']:>9} {counts['created']:>9} {counts['existing']:>9}")
+        self.stdout.write('(sessions: rows are recurring rules, created/existing are class sessions)')
+        schedules = result.schedules
+        self.stdout.write(f"course schedules: {schedules['created']} created, {schedules['updated']} updated, "
+                          f"{schedules['existing']} unchanged")
+        reconciled = result.reconciled
+        if reconciled is not None and (reconciled.updated or reconciled.deleted or reconciled.kept):
+            self.stdout.write(self.style.WARNING(
+                f'{reconciled.updated} existing sessions updated and {reconciled.deleted} deleted to match the schedules; '
+                f'{len(reconciled.kept)} no longer scheduled but kept because they have attendance'
+            ))
+
+        summary = f'{result.total_rows} rows in {result.elapsed:.2f}s ({result.rows_per_second:,.0f} rows/s)'
+        if dry_run:
+            self.stdout.write(self.style.WARNING(f'Dry run, rolled back: {summary}'))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'✓ Imported {summary}'))
@@ -0,0 +1,251 @@
+# attendance/management/commands/loadtest_submissions.py
+
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from http.cookiejar import CookieJar
+from urllib.parse import urlencode
+from urllib.error import HTTPError
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+import json
+import re
+import statistics
+import threading
+import time
+
+from core.models import User
+from courses.models import Course, ClassSession
+from attendance.models import AttendanceCode, AttendanceRecord, Enrollment
+from attendance.notifications import dispatcher
+
+
+LOADTEST_PREFIX = 'loadtest'
+LOADTEST_PASSWORD = 'password123'
+SUBMIT_PATH = '/api/submit-attendance/'
+
+
+def device_fields(student):
+    """A device of its own per student: a distinct IP and a fix a few metres from the others."""
+    return {
+        'simulated_ip': f'10.{student.id // 65536 % 256}.{student.id // 256 % 256}.{student.id % 256}',
+        'simulated_latitude': f'{41.5369 + (student.id % 20) * 0.00003:.6f}',
+        'simulated_longitude': f'{-8.4239 + (student.id // 20 % 20) * 0.00003:.6f}',
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Replays many concurrent attendance submissions against a single code and reports '
+        'p50/p99 latency. Runs in-process by default, or against a running server with --url.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--submissions', type=int, default=500, help='Number of students submitting (default: 500)')
+        parser.add_argument('--concurrency', type=int, default=None,
+                            help='Concurrent clients (default: same as --submissions)')
+        parser.add_argument('--url', type=str, default=None,
+                            help='Base URL of a running server, e.g. http://127.0.0.1:8001')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the load test data when finished')
+
+    def handle(self, *args, **options):
+        total = options['submissions']
+        concurrency = options['concurrency'] or total
+        if total < 1 or concurrency < 1:
+            raise CommandError('--submissions and --concurrency must be positive')
+
+        code, students = self.prepare(total)
+        self.stdout.write(self.style.WARNING(
+            f'Replaying {total} submissions of code {code} with {concurrency} concurrent clients...'
+        ))
+
+        if options['url']:
+            clients = [self.http_client(options['url'], student) for student in students]
+        else:
+            clients = [self.django_client(student) for student in students]
+
+        results = self.replay(clients, code, concurrency)
+        failed = self.report(results)
+        if not options['url']:
+            dispatcher.wait_idle()
+            self.stdout.write('notifications            ' + ', '.join(
+                f'{name}={value}' for name, value in dispatcher.stats().items()
+            ))
+
+        if options['cleanup']:
+            self.cleanup()
+        if failed:
+            raise CommandError(f'{failed} of {len(results)} submissions failed')
+
+    # --- Fixture ---
+
+    def prepare(self, total):
+        teacher, _ = User.objects.get_or_create(
+            username=f'{LOADTEST_PREFIX}.teacher',
+            defaults={'role': 'teacher', 'password': make_password(LOADTEST_PASSWORD)},
+        )
+        course, _ = Course.objects.get_or_create(
+            code=LOADTEST_PREFIX.upper(), defaults={'name': 'Load Test Course'}
+        )
+        course.teachers.add(teacher)
+
+        now = timezone.localtime()
+        class_session, _ = ClassSession.objects.get_or_create(
+            course=course,
+            date=now.date(),
+            start_time=now.replace(minute=0, second=0, microsecond=0).time(),
+            defaults={'end_time': (now + timedelta(hours=1)).time()},
+        )
+
+        existing = set(User.objects.filter(
+            username__startswith=f'{LOADTEST_PREFIX}_student'
+        ).values_list('username', flat=True))
+        password = make_password(LOADTEST_PASSWORD)
+        User.objects.bulk_create([
+            User(username=f'{LOADTEST_PREFIX}_student{i}', role='student', password=password)
+            for i in range(total)
+            if f'{LOADTEST_PREFIX}_student{i}' not in existing
+        ], batch_size=1000)
+        students = list(User.objects.filter(
+            username__in=[f'{LOADTEST_PREFIX}_student{i}' for i in range(total)]
+        ).order_by('id'))
+        Enrollment.objects.bulk_create(
+            [Enrollment(student=student, course=course) for student in students],
+            ignore_conflicts=True, batch_size=1000,
+        )
+
+        # Fresh run: remove earlier submissions and issue a new code
+        AttendanceRecord.objects.filter(class_session=class_session).delete()
+        AttendanceCode.objects.filter(class_session=class_session).delete()
+        attendance_code = AttendanceCode.objects.create(
+            class_session=class_session,
+            expires_at=timezone.now() + timedelta(minutes=10),
+            generated_by=teacher,
+        )
+        return attendance_code.code, students
+
+    def cleanup(self):
+        Course.objects.filter(code=LOADTEST_PREFIX.upper()).delete()
+        User.objects.filter(username__startswith=LOADTEST_PREFIX).delete()
+        self.stdout.write(self.style.SUCCESS('✓ Load test data removed'))
+
+    # --- Clients ---
+
+    def django_client(self, student):
+        # 'testserver' is not in ALLOWED_HOSTS; localhost is accepted by every settings module
+        client = Client(HTTP_HOST='localhost')
+        client.force_login(student)
+
+        def submit(code):
+            response = client.post(SUBMIT_PATH, {
+                'attendance_code': code,
+                **device_fields(student),
+            })
+            return response.status_code, response.content
+
+        return submit
+
+    def http_client(self, base_url, student):
+        base_url = base_url.rstrip('/')
+        jar = CookieJar()
+        opener = build_opener(HTTPCookieProcessor(jar))
+
+        login_page = opener.open(f'{base_url}/login/').read().decode()
+        match = re.search(r'name="csrfmiddlewaretoken" value="([^"]+)"', login_page)
+        if not match:
+            raise CommandError(f'Could not find a CSRF token on {base_url}/login/')
+        opener.open(Request(
+            f'{base_url}/login/',
+            data=urlencode({
+                'username': student.username,
+                'password': LOADTEST_PASSWORD,
+                'csrfmiddlewaretoken': match.group(1),
+            }).encode(),
+            headers={'Referer': f'{base_url}/login/'},
+        ))
+        csrf_token = next(cookie.value for cookie in jar if cookie.name == 'csrftoken')
+
+        def submit(code):
+            request = Request(
+                f'{base_url}{SUBMIT_PATH}',
+                data=urlencode({
+                    'attendance_code': code,
+                    **device_fields(student),
+                }).encode(),
+                headers={'X-CSRFToken': csrf_token, 'Referer': f'{base_url}/'},
+            )
+            try:
+                with opener.open(request) as response:
+                    return response.status, response.read()
+            except HTTPError as e:
+                return e.code, e.read()
+
+        return submit
+
+    # --- Replay ---
+
+    def replay(self, clients, code, concurrency):
+        """
+        (outcome, latency ms, ok) per client. Only 200 responses with a JSON body
+        are ok: anything else is a failed request, whatever the view answered.
+        """
+        # All clients wait on the barrier so the first wave hits the server at once
+        barrier = threading.Barrier(min(concurrency, len(clients)))
+
+        def run(submit):
+            try:
+                barrier.wait(timeout=60)
+            except threading.BrokenBarrierError:
+                pass
+            started = time.perf_counter()
+            ok = False
+            try:
+                status, body = submit(code)
+                if status != 200:
+                    outcome = f'http {status}'
+                else:
+                    payload = json.loads(body)
+                    outcome = payload.get('status', 'error')
+                    ok = True
+            except Exception as e:
+                outcome = f'error: {e.__class__.__name__}'
+            finally:
+                connection.close()
+            return outcome, (time.perf_counter() - started) * 1000, ok
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = list(executor.map(run, clients))
+        self.wall_time = time.perf_counter() - started
+        return results
+
+    def report(self, results):
+        """Prints the outcomes and the latencies of the ok requests; returns the number of failed ones."""
+        latencies = sorted(latency for _, latency, ok in results if ok)
+        failed = len(results) - len(latencies)
+        outcomes = {}
+        for outcome, _, ok in results:
+            label = outcome if ok else f'failed: {outcome}'
+            outcomes[label] = outcomes.get(label, 0) + 1
+
+        def percentile(p):
+            index = min(len(latencies) - 1, max(0, round(p / 100 * len(latencies)) - 1))
+            return latencies[index]
+
+        self.stdout.write(self.style.SUCCESS('\n=== SUBMISSION LOAD TEST ==='))
+        for outcome, count in sorted(outcomes.items()):
+            line = f'{outcome:<24} {count}'
+            self.stdout.write(self.style.ERROR(line) if outcome.startswith('failed: ') else line)
+        if not latencies:
+            self.stdout.write(self.style.ERROR('No submission succeeded: no latencies to report'))
+            return failed
+        self.stdout.write(f"{'p50':<24} {percentile(50):.1f} ms")
+        self.stdout.write(f"{'p90':<24} {percentile(90):.1f} ms")
+        self.stdout.write(f"{'p99':<24} {percentile(99):.1f} ms")
+        self.stdout.write(f"{'max':<24} {latencies[-1]:.1f} ms")
+        self.stdout.write(f"{'mean':<24} {statistics.mean(latencies):.1f} ms")
+        self.stdout.write(f"{'throughput':<24} {len(latencies) / self.wall_time:.1f} req/s")
+        return failed
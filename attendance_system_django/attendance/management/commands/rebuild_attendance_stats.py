@@ -0,0 +1,19 @@
+# attendance/management/commands/rebuild_attendance_stats.py
+
+from django.core.management.base import BaseCommand
+import time
+
+from attendance.rollups import rebuild_daily_stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the DailyAttendanceStat rollup table from attendance records and justifications'
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.WARNING('Rebuilding daily attendance stats...'))
+
+        started = time.monotonic()
+        rows = rebuild_daily_stats()
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(self.style.SUCCESS(f'✓ Wrote {rows} daily stat rows in {elapsed:.2f}s'))
@@ -0,0 +1,51 @@
+# attendance/management/commands/score_geofence.py
+
+from django.core.management.base import BaseCommand, CommandError
+from datetime import datetime
+import time
+
+from attendance.fraud_rules import GeofenceRule, score_records
+from attendance.geofence import get_campuses
+from attendance.models import AttendanceRecord
+
+
+class Command(BaseCommand):
+    help = (
+        'Geofence-scores the pending attendance records of a class session or a date range '
+        'against settings.ATTENDANCE_CAMPUSES and saves their AI result'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session', type=int, default=None, help='Class session ID')
+        parser.add_argument('--from', dest='date_from', type=str, default=None, help='First session date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', type=str, default=None,
+                            help='Last session date (YYYY-MM-DD, default: same as --from)')
+        parser.add_argument('--course', type=int, default=None, help='Only records of this course ID')
+
+    def handle(self, *args, **options):
+        records = AttendanceRecord.objects.all()
+        if options['session']:
+            records = records.filter(class_session_id=options['session'])
+        elif options['date_from']:
+            try:
+                date_from = datetime.strptime(options['date_from'], '%Y-%m-%d').date()
+                date_to = datetime.strptime(options['date_to'] or options['date_from'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('Dates must be in YYYY-MM-DD format')
+            records = records.filter(class_session__date__range=(date_from, date_to))
+        else:
+            raise CommandError('Pass --session or --from/--to')
+        if options['course']:
+            records = records.filter(class_session__course_id=options['course'])
+
+        campuses = get_campuses()
+        self.stdout.write(self.style.WARNING(f'Scoring pending records against {len(campuses)} campus(es)...'))
+
+        started = time.monotonic()
+        results = score_records(records, [GeofenceRule(campuses)])
+        elapsed = time.monotonic() - started
+
+        flagged = sum(1 for result in results.values() if result['isFraudulent'])
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ Scored {len(results)} records in {elapsed:.2f}s ({flagged} flagged)'
+        ))
@@ -1,5 +1,6 @@
 from django.core.management.base import BaseCommand
-from attendance.models import AttendanceRecord, AttendanceCode
+from django.db.models import Sum
+from attendance.models import AttendanceRecord, AttendanceCode, DailyAttendanceStat
 
 class Command(BaseCommand):
     help = 'Mostra dados capturados de forma organizada'
@@ -7,9 +8,10 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         self.stdout.write("=== DADOS DE PRESENÇA ===")
         
-        # Estatísticas gerais
-        total = AttendanceRecord.objects.count()
-        approved = AttendanceRecord.objects.filter(is_present=True).count()
+        # Estatísticas gerais (a partir da tabela agregada DailyAttendanceStat)
+        totals = DailyAttendanceStat.objects.aggregate(total=Sum('submitted'), approved=Sum('present'))
+        total = totals['total'] or 0
+        approved = totals['approved'] or 0
         
         self.stdout.write(f"Total submissões: {total}")
         self.stdout.write(f"Aprovadas: {approved}")
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:13
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0009_dailyattendancestat'),
+        ('courses', '0002_classsession_date_time_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='absencejustification',
+            index=models.Index(fields=['class_session', 'status', 'justification_type'], name='absjust_session_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancecode',
+            index=models.Index(fields=['is_active', 'expires_at'], name='attcode_active_expiry_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(fields=['student', '-timestamp'], name='attrecord_student_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(condition=models.Q(('is_present', False)), fields=['class_session', 'timestamp'], name='attrecord_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0010_hot_path_indexes'),
+        ('courses', '0002_classsession_date_time_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionFeedVersion',
+            fields=[
+                ('class_session', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='submission_feed', serialize=False, to='courses.classsession')),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('reset_version', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='attendancerecord',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='attendancerecord',
+            index=models.Index(fields=['class_session', 'version'], name='attrecord_session_version_idx'),
+        ),
+    ]
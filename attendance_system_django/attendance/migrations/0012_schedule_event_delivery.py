@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0011_submission_feed_version'),
+        ('courses', '0003_course_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleEventDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('sent_at', models.DateTimeField(auto_now_add=True)),
+                ('class_session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedule_event_deliveries', to='courses.classsession')),
+            ],
+            options={
+                'unique_together': {('class_session', 'kind')},
+            },
+        ),
+    ]
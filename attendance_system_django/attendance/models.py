@@ -16,6 +16,11 @@ class AttendanceCode(models.Model):
     generated_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
     is_active = models.BooleanField(default=True)
 
+    class Meta:
+        indexes = [
+            # Active-code counts: is_active=True AND expires_at > now
+            models.Index(fields=['is_active', 'expires_at'], name='attcode_active_expiry_idx'),
+        ]
 
     def save(self, *args, **kwargs):
         if not self.code:
@@ -43,10 +48,23 @@ class AttendanceRecord(models.Model):
     simulated_ip = models.GenericIPAddressField(null=True, blank=True)
     simulated_geolocation = models.JSONField(null=True, blank=True)
     ai_result = models.JSONField(null=True, blank=True) # Stores {"isFraudulent": bool, "fraudExplanation": str}
+    version = models.PositiveBigIntegerField(default=0) # Session feed version of the last change (see SubmissionFeedVersion)
 
     class Meta:
         unique_together = ('class_session', 'student') # A student can only have one record per session
         ordering = ['-timestamp'] # Order by most recent first
+        indexes = [
+            # Student attendance history, newest first
+            models.Index(fields=['student', '-timestamp'], name='attrecord_student_ts_idx'),
+            # Pending validations only: stays small while the table grows
+            models.Index(
+                fields=['class_session', 'timestamp'],
+                condition=models.Q(is_present=False),
+                name='attrecord_pending_idx',
+            ),
+            # Submission feed deltas: rows of a session changed after a version
+            models.Index(fields=['class_session', 'version'], name='attrecord_session_version_idx'),
+        ]
 
     def __str__(self):
         status = "Present" if self.is_present else "Pending/Absent"
@@ -87,6 +105,68 @@ class AbsenceJustification(models.Model):
     class Meta:
         unique_together = ('student', 'class_session')
         ordering = ['-submitted_at']
+        indexes = [
+            # Per-session counts by status and type can be answered from the index alone
+            models.Index(fields=['class_session', 'status', 'justification_type'], name='absjust_session_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.student.username} - {self.class_session.course.name} ({self.status})"
+
+class DailyAttendanceStat(models.Model):
+    """
+    Per-course, per-day rollup of attendance activity.
+    Kept up to date by the signal handlers in attendance/signals.py and
+    rebuilt from scratch with `python manage.py rebuild_attendance_stats`.
+    """
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='daily_stats')
+    date = models.DateField()
+    submitted = models.PositiveIntegerField(default=0)
+    present = models.PositiveIntegerField(default=0)
+    ai_validated = models.PositiveIntegerField(default=0)
+    ai_flagged = models.PositiveIntegerField(default=0)
+    justified = models.PositiveIntegerField(default=0) # Approved justifications
+    late = models.PositiveIntegerField(default=0) # Late-arrival justifications
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('course', 'date')
+        ordering = ['date']
+
+    def __str__(self):
+        return f"{self.course.name} on {self.date}: {self.present}/{self.submitted} present"
+
+
+class SubmissionFeedVersion(models.Model):
+    """
+    Change counter of a class session's submissions feed.
+    Bumped whenever one of the session's records is inserted, updated or
+    deleted (see attendance/submission_feed.py); each changed record stores
+    the version it was changed at, so clients can ask for rows changed since
+    the version they already have.
+    """
+    class_session = models.OneToOneField(
+        ClassSession, on_delete=models.CASCADE, primary_key=True, related_name='submission_feed'
+    )
+    version = models.PositiveBigIntegerField(default=0)
+    reset_version = models.PositiveBigIntegerField(default=0) # Last version at which records were deleted
+
+    def __str__(self):
+        return f"Submissions feed of session {self.class_session_id} at version {self.version}"
+
+
+class ScheduleEventDelivery(models.Model):
+    """
+    A "class started"/"class ended" event that has been sent. The unique
+    (class_session, kind) pair is what lets only one of several server
+    processes send each event (see attendance/schedule_events.py).
+    """
+    class_session = models.ForeignKey(ClassSession, on_delete=models.CASCADE, related_name='schedule_event_deliveries')
+    kind = models.CharField(max_length=20) # An event type of schedule_events.BOUNDARIES
+    sent_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('class_session', 'kind')
 
     def __str__(self):
-        return f"{self.student.username} - {self.class_session.course.name} ({self.status})"
\ No newline at end of file
+        return f"{self.kind} of session {self.class_session_id}"
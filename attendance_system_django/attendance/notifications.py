@@ -0,0 +1,207 @@
+# attendance/notifications.py
+"""
+Channel-layer notifications sent outside the request thread.
+
+Views hand messages to a NotificationDispatcher: a bounded in-process queue
+drained by a single background sender task, which sends whatever has piled
+up as one concurrent batch of group_send calls. Request latency therefore
+never includes a channel-layer (Redis) round trip. Messages of one batch for
+the same group travel as a single BATCH_TYPE channel-layer message (in
+order), which the consumers unpack, so a burst costs one group_send and one
+channel slot per group instead of one per message.
+
+Under ASGI (Daphne) the sender task runs on the server's event loop, where
+the consumers live; elsewhere (WSGI, management commands) it runs on a
+daemon thread with its own loop.
+"""
+import asyncio
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+
+from asgiref.sync import SyncToAsync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = 10000
+BATCH_SIZE = 200
+LATE_AFTER = 1.0 # seconds between queueing and sending
+BATCH_TYPE = 'notification_batch'
+
+
+# --- Group names ---
+
+def user_group(user_id):
+    """Personal group: every socket of one user (one send reaches only them)."""
+    return f'user_{user_id}_notifications'
+
+
+def course_group(course_id):
+    """Students of a course who opted in to course-wide notifications."""
+    return f'course_{course_id}_notifications'
+
+
+def class_session_group(class_session_id):
+    """Teacher dashboards following a class session."""
+    return f'class_session_{class_session_id}_notifications'
+
+
+# --- Dispatcher ---
+
+class NotificationDispatcher:
+    """
+    Bounded queue of group messages plus the task that sends them.
+
+    put() never blocks: when the queue is full the message is dropped and
+    counted. Messages sent more than `late_after` seconds after being queued
+    are counted as late.
+    """
+
+    def __init__(self, maxsize=QUEUE_SIZE, batch_size=BATCH_SIZE, late_after=LATE_AFTER):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.late_after = late_after
+        self.counters = dict.fromkeys(('queued', 'sent', 'dropped', 'late', 'failed', 'batches', 'group_sends'), 0)
+
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._loop = None
+        self._wakeup = None
+
+    def put(self, group_name, event):
+        """Queues a message; returns False if it was dropped."""
+        with self._lock:
+            full = len(self._queue) >= self.maxsize
+            if full:
+                self.counters['dropped'] += 1
+            else:
+                self._queue.append((time.monotonic(), group_name, event))
+                self.counters['queued'] += 1
+
+        if full:
+            logger.warning(f"Notification queue full, dropped '{event['type']}' for {group_name}")
+            return False
+
+        loop = self._ensure_sender()
+        loop.call_soon_threadsafe(self._wakeup.set)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {**self.counters, 'pending': len(self._queue) + self._in_flight}
+
+    def wait_idle(self, timeout=5.0):
+        """Blocks until every queued message has been handed to the channel layer."""
+        deadline = time.monotonic() + timeout
+        while self.stats()['pending']:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    # --- Sender ---
+
+    def _ensure_sender(self):
+        with self._lock:
+            if self._loop is not None and self._loop.is_running():
+                return self._loop
+
+            loop = _server_event_loop()
+            if loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='attendance-notifications', daemon=True).start()
+
+            self._loop = loop
+            self._wakeup = asyncio.Event()
+            loop.call_soon_threadsafe(loop.create_task, self._run())
+            return loop
+
+    async def _run(self):
+        channel_layer = get_channel_layer()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            while True:
+                with self._lock:
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                    self._in_flight = len(batch)
+                if not batch:
+                    break
+                await self._send_batch(channel_layer, batch)
+
+    async def _send_batch(self, channel_layer, batch):
+        by_group = {}
+        for item in batch:
+            by_group.setdefault(item[1], []).append(item)
+        results = await asyncio.gather(
+            *(channel_layer.group_send(group_name, _merged(items)) for group_name, items in by_group.items()),
+            return_exceptions=True,
+        )
+        now = time.monotonic()
+        with self._lock:
+            self._in_flight = 0
+            self.counters['batches'] += 1
+            self.counters['group_sends'] += len(by_group)
+            for (group_name, items), result in zip(by_group.items(), results):
+                for queued_at, _, event in items:
+                    if isinstance(result, Exception):
+                        self.counters['failed'] += 1
+                        logger.error(f"Failed to send '{event['type']}' to {group_name}: {result}")
+                        continue
+                    self.counters['sent'] += 1
+                    if now - queued_at > self.late_after:
+                        self.counters['late'] += 1
+
+
+def _merged(items):
+    """The channel-layer message for the (queued_at, group, event) items of one group."""
+    if len(items) == 1:
+        return items[0][2]
+    return {'type': BATCH_TYPE, 'events': [event for _, _, event in items]}
+
+
+dispatcher = NotificationDispatcher()
+
+
+def send_group_notification(group_name, message_type, message, context=None):
+    """
+    Queues a group message once the current transaction commits (right away
+    in autocommit mode), so clients never hear about rows they cannot read yet.
+    """
+    transaction.on_commit(
+        lambda: send_group_notification_nowait(group_name, message_type, message, context)
+    )
+
+
+def send_group_notification_nowait(group_name, message_type, message, context=None):
+    """Queues a group message immediately and returns."""
+    if not get_channel_layer():
+        return False
+    return dispatcher.put(group_name, {
+        'type': message_type,
+        'id': event_id(),
+        'message': message,
+        'context': context or {},
+    })
+
+
+def event_id():
+    """
+    A unique id for a group message: the consumers of a process encode the
+    WebSocket frame of each id once for all their sockets (see frame_codecs).
+    """
+    return uuid.uuid4().hex
+
+
+def _server_event_loop():
+    # Set by asgiref for threads that run sync views on behalf of the ASGI server
+    loop = getattr(SyncToAsync.threadlocal, 'main_event_loop', None)
+    if loop is not None and loop.is_running() and not loop.is_closed():
+        return loop
+    return None
@@ -0,0 +1,174 @@
+# attendance/rollups.py
+"""
+Maintenance of the DailyAttendanceStat rollup table.
+
+Saving or deleting a record or justification applies the difference it
+makes to the counters of its (course, date) row with F() increments (see
+the signal handlers in attendance/signals.py), and bulk update() paths pass
+their own deltas to increment_daily_stats(). Rows are only recounted from
+the raw tables when they do not exist yet, after bulk rescoring
+(refresh_daily_stats_for_sessions) and by the rebuild_attendance_stats
+command. Readers then only scan a few hundred rollup rows instead of every
+AttendanceRecord in the period.
+"""
+from django.db import transaction
+from django.db.models import Count, F, Q
+
+from attendance import kpi_cache
+from attendance.models import AttendanceRecord, AbsenceJustification, DailyAttendanceStat
+
+
+COUNTER_FIELDS = ('submitted', 'present', 'ai_validated', 'ai_flagged', 'justified', 'late')
+
+RECORD_COUNTERS = {
+    'submitted': Count('id'),
+    'present': Count('id', filter=Q(is_present=True)),
+    'ai_validated': Count('id', filter=Q(ai_result__isnull=False)),
+    'ai_flagged': Count('id', filter=Q(ai_result__isFraudulent=True)),
+}
+
+JUSTIFICATION_COUNTERS = {
+    'justified': Count('id', filter=Q(status='approved')),
+    'late': Count('id', filter=Q(justification_type='late_arrival')),
+}
+
+
+def row_counters(model, values):
+    """
+    What one AttendanceRecord or AbsenceJustification adds to the counters of
+    its day, from its field values (the per-row form of the Count()s above).
+    """
+    if model is AttendanceRecord:
+        ai_result = values['ai_result']
+        return {
+            'submitted': 1,
+            'present': int(bool(values['is_present'])),
+            'ai_validated': int(ai_result is not None),
+            'ai_flagged': int(isinstance(ai_result, dict) and ai_result.get('isFraudulent') is True),
+        }
+    return {
+        'justified': int(values['status'] == 'approved'),
+        'late': int(values['justification_type'] == 'late_arrival'),
+    }
+
+
+# Fields row_counters() reads, per model
+COUNTED_FIELDS = {
+    AttendanceRecord: ('is_present', 'ai_result'),
+    AbsenceJustification: ('status', 'justification_type'),
+}
+
+
+def apply_row_change(before, after):
+    """
+    Applies the counter difference between two ((course_id, date), counters)
+    states of one row (None for "not there"): a new row only adds, a deleted
+    one only subtracts, and a row moved to another day does both.
+    """
+    deltas = {}
+    for sign, state in ((-1, before), (1, after)):
+        if state is not None:
+            key, counters = state
+            amounts = deltas.setdefault(key, {})
+            for field, amount in counters.items():
+                amounts[field] = amounts.get(field, 0) + sign * amount
+    apply_daily_stat_deltas(deltas)
+
+
+def refresh_daily_stat(course_id, date):
+    """Recomputes the rollup row for one (course, date) key."""
+    counters = AttendanceRecord.objects.filter(
+        class_session__course_id=course_id,
+        class_session__date=date,
+    ).aggregate(**RECORD_COUNTERS)
+    counters.update(AbsenceJustification.objects.filter(
+        class_session__course_id=course_id,
+        class_session__date=date,
+    ).aggregate(**JUSTIFICATION_COUNTERS))
+
+    if not any(counters.values()):
+        # Nothing left for this day (or the course is being deleted)
+        DailyAttendanceStat.objects.filter(course_id=course_id, date=date).delete()
+        return None
+
+    stat, _ = DailyAttendanceStat.objects.update_or_create(
+        course_id=course_id, date=date, defaults=counters
+    )
+    return stat
+
+
+def ensure_daily_stat(course_id, date):
+    """
+    Creates the (course, date) row ahead of a burst of submissions (e.g. when an
+    attendance code is issued), so concurrent increment_daily_stats() calls all
+    take the F() update path instead of racing to build the row.
+    """
+    if DailyAttendanceStat.objects.filter(course_id=course_id, date=date).exists():
+        return
+    with transaction.atomic():
+        if refresh_daily_stat(course_id, date) is None:
+            DailyAttendanceStat.objects.get_or_create(course_id=course_id, date=date)
+
+
+def refresh_daily_stats_for_sessions(class_sessions):
+    """Refreshes every (course, date) key touched by the given sessions."""
+    keys = set(class_sessions.values_list('course_id', 'date'))
+    for course_id, date in keys:
+        refresh_daily_stat(course_id, date)
+    kpi_cache.invalidate_courses(course_id for course_id, _ in keys)
+    return len(keys)
+
+
+def rebuild_daily_stats():
+    """Drops and recomputes the whole rollup table. Returns the number of rows written."""
+    rows = {}
+
+    record_rows = AttendanceRecord.objects.values(
+        'class_session__course', 'class_session__date'
+    ).annotate(**RECORD_COUNTERS).order_by()
+    justification_rows = AbsenceJustification.objects.values(
+        'class_session__course', 'class_session__date'
+    ).annotate(**JUSTIFICATION_COUNTERS).order_by()
+
+    for source in (record_rows, justification_rows):
+        for row in source:
+            key = (row.pop('class_session__course'), row.pop('class_session__date'))
+            rows.setdefault(key, dict.fromkeys(COUNTER_FIELDS, 0)).update(row)
+
+    stats = [
+        DailyAttendanceStat(course_id=course_id, date=date, **counters)
+        for (course_id, date), counters in rows.items()
+    ]
+
+    with transaction.atomic():
+        DailyAttendanceStat.objects.all().delete()
+        DailyAttendanceStat.objects.bulk_create(stats, batch_size=1000)
+
+    return len(stats)
+
+
+def increment_daily_stats(deltas, field='present'):
+    """
+    Applies counter deltas without re-reading the raw tables.
+    `deltas` maps (course_id, date) to the amount to add to `field`; used by
+    bulk update() paths that bypass the post_save signal.
+    """
+    apply_daily_stat_deltas({key: {field: amount} for key, amount in deltas.items()})
+
+
+def apply_daily_stat_deltas(deltas):
+    """Adds {(course_id, date): {field: amount}} to the rollup rows with one F() UPDATE per row."""
+    changed = set()
+    for (course_id, date), amounts in deltas.items():
+        amounts = {field: amount for field, amount in amounts.items() if amount}
+        if not amounts:
+            continue
+        changed.add(course_id)
+        updated = DailyAttendanceStat.objects.filter(course_id=course_id, date=date).update(
+            **{field: F(field) + amount for field, amount in amounts.items()}
+        )
+        if not updated:
+            # First activity of the day for this course: build the row from the raw tables
+            with transaction.atomic():
+                refresh_daily_stat(course_id, date)
+    kpi_cache.invalidate_courses(changed)
@@ -0,0 +1,119 @@
+# attendance/schedule_events.py
+"""
+Pushes "class started" / "class ended" events to the course groups.
+
+A single task per server process sleeps until the next ClassSession
+start_time/end_time of the day (at most MAX_SLEEP seconds, so sessions
+created in the meantime are picked up), then sends an event for every
+session whose boundary fell in the elapsed window. It is started by the
+first student socket to connect; see StudentNotificationConsumer.
+
+With several server processes sharing a channel layer, each event is only
+sent by the process that manages to insert its ScheduleEventDelivery row
+(unique per session and event type); the others see the row and skip it.
+The default cache is per process, so it cannot be used for this.
+"""
+import asyncio
+import logging
+from datetime import datetime, time, timedelta
+
+from channels.layers import get_channel_layer
+from django.db import IntegrityError
+from django.db.models import Min, Q
+from django.utils import timezone
+
+from courses.models import ClassSession
+from attendance.models import ScheduleEventDelivery
+from attendance.notifications import course_group, event_id
+from attendance.serializers import session_json
+
+logger = logging.getLogger(__name__)
+
+MAX_SLEEP = 300
+
+# Event type -> ClassSession field holding the boundary
+BOUNDARIES = {
+    'class_started': 'start_time',
+    'class_ended': 'end_time',
+}
+
+_tasks = {}
+
+
+def ensure_schedule_events_started():
+    """Starts the scheduler on the running event loop unless it is already running there."""
+    loop = asyncio.get_running_loop()
+    task = _tasks.get(loop)
+    if task is None or task.done():
+        _tasks[loop] = loop.create_task(run_schedule_events())
+
+
+async def run_schedule_events():
+    last_run = timezone.localtime()
+    while True:
+        await asyncio.sleep(await seconds_until_next_boundary(last_run))
+        now = timezone.localtime()
+        try:
+            await emit_schedule_events(last_run, now)
+        except Exception:
+            logger.exception('Failed to emit schedule events')
+        last_run = now
+
+
+async def seconds_until_next_boundary(now):
+    """Seconds until the next start/end time of today's sessions, capped at MAX_SLEEP."""
+    boundaries = await ClassSession.objects.filter(date=now.date()).aaggregate(
+        next_start=Min('start_time', filter=Q(start_time__gt=now.time())),
+        next_end=Min('end_time', filter=Q(end_time__gt=now.time())),
+    )
+    upcoming = [value for value in boundaries.values() if value is not None]
+    midnight = timezone.make_aware(datetime.combine(now.date() + timedelta(days=1), time.min))
+    if upcoming:
+        target = timezone.make_aware(datetime.combine(now.date(), min(upcoming)))
+    else:
+        target = midnight
+    return max(0.0, min((target - now).total_seconds(), MAX_SLEEP))
+
+
+async def emit_schedule_events(since, until):
+    """Sends an event for every session boundary in the window (since, until]."""
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return 0
+
+    # (date, boundaries strictly after, boundaries up to and including)
+    if since.date() == until.date():
+        windows = [(until.date(), since.time(), until.time())]
+    else:
+        # The window crossed midnight: finish yesterday, then today from 00:00
+        windows = [(since.date(), since.time(), time.max), (until.date(), None, until.time())]
+
+    sent = 0
+    for kind, field in BOUNDARIES.items():
+        for date, after, upper in windows:
+            sessions = ClassSession.objects.filter(date=date, **{f'{field}__lte': upper})
+            if after is not None:
+                sessions = sessions.filter(**{f'{field}__gt': after})
+            sessions = sessions.select_related('course')
+
+            async for session in sessions.aiterator():
+                if not await claim_event(session.id, kind):
+                    continue # Another server process already sent it
+                message = 'A aula de {} começou.' if kind == 'class_started' else 'A aula de {} terminou.'
+                await channel_layer.group_send(course_group(session.course_id), {
+                    'type': kind,
+                    'id': event_id(),
+                    'message': message.format(session.course.name),
+                    'context': session_json(session),
+                })
+                sent += 1
+    return sent
+
+
+async def claim_event(class_session_id, kind):
+    """True when this process is the first to claim the event, and so must send it."""
+    try:
+        await ScheduleEventDelivery.objects.acreate(class_session_id=class_session_id, kind=kind)
+    except IntegrityError:
+        return False
+    return True
@@ -0,0 +1,527 @@
+# attendance/schedule_import.py
+"""
+Bulk import of a semester: users, courses, teacher assignments, enrollments
+and recurring class sessions.
+
+The input is a dict of tables (a JSON document, or one CSV file per table):
+
+    users        username, first_name, last_name, email, role, password
+    courses      code, name, description
+    teachers     course (code), teacher (username)
+    enrollments  course (code), student (username)
+    sessions     course (code), weekdays (e.g. "mon,wed" or "0,2"), start_time, end_time,
+                 start_date, end_date, exclude (optional, ";"-separated dates)
+
+Every row is validated in memory first and nothing is written if any row is
+invalid. Existing keys are then read with one query per table, and only the
+missing rows are inserted: bulk_create(ignore_conflicts=True) in batches, or
+COPY into a temporary table followed by INSERT ... ON CONFLICT DO NOTHING on
+PostgreSQL.
+
+Session rules are stored as CourseSchedule rows (one per weekday, with the
+rule's exclude dates), and the sessions are then generated by
+courses.scheduling.reconcile(), each course over the span of its own
+imported rules, like the expand_schedules command does: holidays are
+skipped, and a later expand_schedules run keeps the imported sessions. It
+also means that within that span the schedules now own the course's
+sessions: ones they do not describe are deleted unless they already have
+attendance activity. Other courses' sessions, and a course's sessions
+outside its own rules' span, are left alone.
+"""
+import csv
+import io
+import json
+import time
+from datetime import date, time as dtime
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+
+from core.models import User
+from courses.models import Course, CourseSchedule
+from courses.scheduling import ReconcileResult, reconcile, session_dates
+from attendance import code_cache, kpi_cache
+from attendance.models import Enrollment
+
+
+TABLES = ('users', 'courses', 'teachers', 'enrollments', 'sessions')
+
+REQUIRED_FIELDS = {
+    'users': ('username',),
+    'courses': ('code', 'name'),
+    'teachers': ('course', 'teacher'),
+    'enrollments': ('course', 'student'),
+    'sessions': ('course', 'weekdays', 'start_time', 'end_time', 'start_date', 'end_date'),
+}
+
+WEEKDAYS = {'mon': 0, 'tue': 1, 'wed': 2, 'thu': 3, 'fri': 4, 'sat': 5, 'sun': 6}
+ROLES = {role for role, _ in User.ROLE_CHOICES}
+BATCH_SIZE = 1000
+
+
+class ScheduleImportError(Exception):
+    """Raised with every validation error found, as (table, row number, message) tuples."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f'{len(errors)} invalid rows')
+
+    def __str__(self):
+        return '\n'.join(f'{table} row {row}: {message}' for table, row, message in self.errors)
+
+
+class ImportResult:
+    """Per-table counts of an import and its rows/second rate."""
+
+    def __init__(self):
+        self.tables = {table: {'rows': 0, 'created': 0, 'existing': 0} for table in TABLES}
+        self.schedules = {'created': 0, 'updated': 0, 'existing': 0}
+        self.reconciled = None # courses.scheduling.ReconcileResult of the session rules
+        self.elapsed = 0.0
+
+    @property
+    def total_rows(self):
+        return sum(counts['created'] + counts['existing'] for counts in self.tables.values())
+
+    @property
+    def rows_per_second(self):
+        return self.total_rows / self.elapsed if self.elapsed else 0.0
+
+
+# --- Parsing ---
+
+def parse_json(file):
+    """Reads a JSON document with some of the TABLES keys, each a list of row objects."""
+    document = json.load(file)
+    if not isinstance(document, dict):
+        raise ScheduleImportError([('document', 0, 'Expected an object with ' + ', '.join(TABLES))])
+    return {table: document.get(table) or [] for table in TABLES}
+
+
+def parse_csv(table, file):
+    """Reads one table from a CSV file with a header row."""
+    if table not in TABLES:
+        raise ScheduleImportError([(table, 0, 'Unknown table')])
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig')
+    return {table: list(csv.DictReader(file))}
+
+
+# --- Validation ---
+
+def validate(data):
+    """Cleans the rows of every table; raises ScheduleImportError listing all the problems."""
+    errors = []
+    cleaned = {table: [] for table in TABLES}
+    seen = {table: set() for table in TABLES}
+
+    for table in TABLES:
+        for number, row in enumerate(data.get(table) or [], start=1):
+            if not isinstance(row, dict):
+                errors.append((table, number, 'Expected an object'))
+                continue
+            row = {key: value.strip() if isinstance(value, str) else value for key, value in row.items()}
+            missing = [field for field in REQUIRED_FIELDS[table] if not row.get(field)]
+            if missing:
+                errors.append((table, number, f"Missing {', '.join(missing)}"))
+                continue
+            try:
+                row = CLEANERS[table](row)
+            except ValueError as error:
+                errors.append((table, number, str(error)))
+                continue
+
+            key = row.pop('_key')
+            if key in seen[table]:
+                errors.append((table, number, f'Duplicate row {key}'))
+                continue
+            seen[table].add(key)
+            cleaned[table].append(row)
+
+    if errors:
+        raise ScheduleImportError(errors)
+    return cleaned
+
+
+def _clean_user(row):
+    role = row.get('role') or 'student'
+    if role not in ROLES:
+        raise ValueError(f"Unknown role '{role}'")
+    if len(row['username']) > 150:
+        raise ValueError('Username longer than 150 characters')
+    return {
+        '_key': row['username'],
+        'username': row['username'],
+        'first_name': row.get('first_name') or '',
+        'last_name': row.get('last_name') or '',
+        'email': row.get('email') or '',
+        'role': role,
+        'password': row.get('password') or None,
+    }
+
+
+def _clean_course(row):
+    if len(row['code']) > 20:
+        raise ValueError('Course code longer than 20 characters')
+    return {'_key': row['code'], 'code': row['code'], 'name': row['name'], 'description': row.get('description') or ''}
+
+
+def _clean_teacher(row):
+    return {'_key': (row['course'], row['teacher']), 'course': row['course'], 'user': row['teacher']}
+
+
+def _clean_enrollment(row):
+    return {'_key': (row['course'], row['student']), 'course': row['course'], 'user': row['student']}
+
+
+def _clean_session_rule(row):
+    weekdays = row['weekdays']
+    if isinstance(weekdays, str):
+        weekdays = weekdays.replace(';', ',').replace(' ', ',').split(',')
+    days = set()
+    for day in weekdays:
+        day = str(day).strip().lower()[:3]
+        if not day:
+            continue
+        if day.isdigit() and int(day) in range(7):
+            days.add(int(day))
+        elif day in WEEKDAYS:
+            days.add(WEEKDAYS[day])
+        else:
+            raise ValueError(f"Unknown weekday '{day}'")
+
+    try:
+        start_time = dtime.fromisoformat(str(row['start_time']))
+        end_time = dtime.fromisoformat(str(row['end_time']))
+        start_date = date.fromisoformat(str(row['start_date']))
+        end_date = date.fromisoformat(str(row['end_date']))
+        exclude = row.get('exclude') or []
+        if isinstance(exclude, str):
+            exclude = exclude.split(';')
+        exclude = {date.fromisoformat(str(value).strip()) for value in exclude if str(value).strip()}
+    except ValueError:
+        raise ValueError('Times must be HH:MM and dates YYYY-MM-DD')
+    if not days:
+        raise ValueError('No weekdays given')
+    if start_time >= end_time:
+        raise ValueError('start_time must be before end_time')
+    if start_date > end_date:
+        raise ValueError('start_date must not be after end_date')
+
+    return {
+        '_key': (row['course'], tuple(sorted(days)), start_time, start_date, end_date),
+        'course': row['course'],
+        'weekdays': days,
+        'start_time': start_time,
+        'end_time': end_time,
+        'start_date': start_date,
+        'end_date': end_date,
+        'exclude': exclude,
+    }
+
+
+CLEANERS = {
+    'users': _clean_user,
+    'courses': _clean_course,
+    'teachers': _clean_teacher,
+    'enrollments': _clean_enrollment,
+    'sessions': _clean_session_rule,
+}
+
+
+def expand_session_rule(rule):
+    """The (date, start_time, end_time) of every session a recurring rule describes."""
+    for weekday in sorted(rule['weekdays']):
+        for day in session_dates(weekday, rule['start_date'], rule['end_date'], rule['exclude']):
+            yield day, rule['start_time'], rule['end_time']
+
+
+# --- Import ---
+
+def import_schedule(data, default_password=None, batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Validates and imports `data` ({table: rows}) in one transaction.
+    Users without a password get `default_password`, or an unusable password.
+    With dry_run the transaction is rolled back after counting.
+    """
+    started = time.monotonic()
+    cleaned = validate(data)
+    result = ImportResult()
+    for table in TABLES:
+        result.tables[table]['rows'] = len(cleaned[table])
+
+    with transaction.atomic():
+        user_ids = _import_users(cleaned, result, default_password, batch_size)
+        course_ids = _import_courses(cleaned, result, batch_size)
+        teacher_pairs = _import_pairs(
+            'teachers', cleaned, result, Course.teachers.through, 'user_id', 'teacher', user_ids, course_ids, batch_size,
+        )
+        enrollment_pairs = _import_pairs(
+            'enrollments', cleaned, result, Enrollment, 'student_id', 'student', user_ids, course_ids, batch_size,
+        )
+        _import_sessions(cleaned['sessions'], course_ids, result, batch_size)
+
+        if dry_run:
+            transaction.set_rollback(True)
+        else:
+            transaction.on_commit(lambda: _invalidate_caches(teacher_pairs, enrollment_pairs))
+
+    result.elapsed = time.monotonic() - started
+    return result
+
+
+def _invalidate_caches(teacher_pairs, enrollment_pairs):
+    """
+    Drops what the enrollment/teacher signals would have (bulk inserts send
+    none). Runs after commit: a dashboard request served in between would
+    otherwise refill the caches from the rows as they were before the import.
+    """
+    kpi_cache.invalidate_courses(course_id for course_id, _ in teacher_pairs + enrollment_pairs)
+    kpi_cache.invalidate_teachers(user_id for _, user_id in teacher_pairs)
+    for course_id in {course_id for course_id, _ in enrollment_pairs}:
+        code_cache.invalidate_course(course_id)
+
+
+def _import_users(cleaned, result, default_password, batch_size):
+    """Creates the missing users; returns {username: (id, role)} for every username the import refers to."""
+    referenced = {row['user'] for table in ('teachers', 'enrollments') for row in cleaned[table]}
+    usernames = {row['username'] for row in cleaned['users']} | referenced
+    users = {
+        username: (user_id, role)
+        for username, user_id, role in User.objects.filter(username__in=usernames).values_list('username', 'id', 'role')
+    }
+
+    new_rows = [row for row in cleaned['users'] if row['username'] not in users]
+    result.tables['users']['existing'] = len(cleaned['users']) - len(new_rows)
+    if new_rows:
+        # Hashing is slow on purpose: hash each distinct password once
+        passwords = {row['password'] or default_password for row in new_rows}
+        hashes = {password: make_password(password) for password in passwords}
+        bulk_insert(User, [
+            User(
+                username=row['username'],
+                first_name=row['first_name'],
+                last_name=row['last_name'],
+                email=row['email'],
+                role=row['role'],
+                is_staff=row['role'] in ('teacher', 'admin'),
+                password=hashes[row['password'] or default_password],
+            ) for row in new_rows
+        ], batch_size)
+        result.tables['users']['created'] = len(new_rows)
+        users.update(
+            (username, (user_id, role)) for username, user_id, role in
+            User.objects.filter(username__in=[row['username'] for row in new_rows]).values_list('username', 'id', 'role')
+        )
+    return users
+
+
+def _import_courses(cleaned, result, batch_size):
+    """Creates the missing courses; returns {code: id} for every course code the import refers to."""
+    codes = {row['code'] for row in cleaned['courses']}
+    codes |= {row['course'] for table in ('teachers', 'enrollments', 'sessions') for row in cleaned[table]}
+    courses = dict(Course.objects.filter(code__in=codes).values_list('code', 'id'))
+
+    new_rows = [row for row in cleaned['courses'] if row['code'] not in courses]
+    result.tables['courses']['existing'] = len(cleaned['courses']) - len(new_rows)
+    if new_rows:
+        bulk_insert(Course, [Course(**row) for row in new_rows], batch_size)
+        result.tables['courses']['created'] = len(new_rows)
+        courses.update(Course.objects.filter(code__in=[row['code'] for row in new_rows]).values_list('code', 'id'))
+    return courses
+
+
+def _import_pairs(table, cleaned, result, model, user_field, role, users, courses, batch_size):
+    """Teacher assignments or enrollments. Returns the (course id, user id) pairs created."""
+    errors = []
+    pairs = []
+    for number, row in enumerate(cleaned[table], start=1):
+        if row['course'] not in courses:
+            errors.append((table, number, f"Unknown course '{row['course']}'"))
+        elif row['user'] not in users:
+            errors.append((table, number, f"Unknown user '{row['user']}'"))
+        elif users[row['user']][1] != role:
+            errors.append((table, number, f"'{row['user']}' is not a {role}"))
+        else:
+            pairs.append((courses[row['course']], users[row['user']][0]))
+    if errors:
+        raise ScheduleImportError(errors)
+    if not pairs:
+        return []
+
+    existing = set(model.objects.filter(**{
+        'course_id__in': {course_id for course_id, _ in pairs},
+        f'{user_field}__in': {user_id for _, user_id in pairs},
+    }).values_list('course_id', user_field))
+    new_pairs = [pair for pair in pairs if pair not in existing]
+    result.tables[table]['existing'] = len(pairs) - len(new_pairs)
+    result.tables[table]['created'] = len(new_pairs)
+    bulk_insert(model, [model(**{'course_id': course_id, user_field: user_id}) for course_id, user_id in new_pairs], batch_size)
+    return new_pairs
+
+
+def _import_sessions(rules, courses, result, batch_size):
+    """Stores the rules as CourseSchedule rows, then generates their sessions with reconcile()."""
+    errors = [
+        ('sessions', number, f"Unknown course '{rule['course']}'")
+        for number, rule in enumerate(rules, start=1) if rule['course'] not in courses
+    ]
+    if errors:
+        raise ScheduleImportError(errors)
+    if not rules:
+        return
+
+    schedules = {}
+    for rule in rules:
+        excluded_dates = sorted(day.isoformat() for day in rule['exclude'])
+        for weekday in rule['weekdays']:
+            key = (courses[rule['course']], weekday, rule['start_time'], rule['start_date'])
+            schedules.setdefault(key, (rule['end_time'], rule['end_date'], excluded_dates))
+
+    course_ids = {course_id for course_id, _, _, _ in schedules}
+    existing = {
+        (schedule.course_id, schedule.weekday, schedule.start_time, schedule.term_start): schedule
+        for schedule in CourseSchedule.objects.filter(course_id__in=course_ids)
+    }
+    to_create, to_update = [], []
+    for key, (end_time, term_end, excluded_dates) in schedules.items():
+        schedule = existing.get(key)
+        if schedule is None:
+            course_id, weekday, start_time, term_start = key
+            to_create.append(CourseSchedule(
+                course_id=course_id, weekday=weekday, start_time=start_time, end_time=end_time,
+                term_start=term_start, term_end=term_end, excluded_dates=excluded_dates,
+            ))
+        elif (schedule.end_time, schedule.term_end, schedule.excluded_dates) != (end_time, term_end, excluded_dates):
+            schedule.end_time, schedule.term_end, schedule.excluded_dates = end_time, term_end, excluded_dates
+            to_update.append(schedule)
+    CourseSchedule.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+    CourseSchedule.objects.bulk_update(to_update, ['end_time', 'term_end', 'excluded_dates'], batch_size=batch_size)
+    result.schedules = {
+        'created': len(to_create), 'updated': len(to_update), 'existing': len(schedules) - len(to_create) - len(to_update),
+    }
+
+    # Each course over its own rules' span: one reconcile() per distinct span
+    spans = {}
+    for rule in rules:
+        course_id = courses[rule['course']]
+        first, last = spans.get(course_id, (rule['start_date'], rule['end_date']))
+        spans[course_id] = (min(first, rule['start_date']), max(last, rule['end_date']))
+    by_span = {}
+    for course_id, span in spans.items():
+        by_span.setdefault(span, []).append(course_id)
+    reconciled = result.reconciled = ReconcileResult()
+    for (date_from, date_to), span_course_ids in by_span.items():
+        part = reconcile(span_course_ids, date_from, date_to, batch_size=batch_size)
+        reconciled.expected += part.expected
+        reconciled.created += part.created
+        reconciled.updated += part.updated
+        reconciled.deleted += part.deleted
+        reconciled.kept += part.kept
+    counts = result.tables['sessions']
+    counts['created'] = reconciled.created
+    counts['existing'] = reconciled.expected - reconciled.created
+
+
+# --- Inserts ---
+
+def bulk_insert(model, objs, batch_size=BATCH_SIZE):
+    """Inserts new rows, skipping any that conflict with rows created in the meantime."""
+    if not objs:
+        return
+    if connection.vendor == 'postgresql':
+        copy_insert(model, objs)
+    else:
+        model.objects.bulk_create(objs, batch_size=batch_size, ignore_conflicts=True)
+
+
+def insert_rows(model, columns, rows, batch_size=BATCH_SIZE, ignore_conflicts=False):
+    """
+    Inserts an iterable of tuples of database-ready values for `columns`
+    (column names). No model instances are built, so this is the path for
+    millions of rows (see attendance.synthetic_data).
+    """
+    if connection.vendor == 'postgresql':
+        copy_rows(model, columns, rows, ignore_conflicts)
+        return
+    table = connection.ops.quote_name(model._meta.db_table)
+    column_list = ', '.join(connection.ops.quote_name(column) for column in columns)
+    insert = connection.ops.insert_statement(on_conflict=OnConflict.IGNORE if ignore_conflicts else None)
+    sql = f"{insert} {table} ({column_list}) VALUES ({', '.join(['%s'] * len(columns))})"
+    rows = iter(rows)
+    with connection.cursor() as cursor:
+        while batch := list(islice(rows, batch_size)):
+            cursor.executemany(sql, batch)
+
+
+def copy_insert(model, objs):
+    """PostgreSQL: bulk_insert() of model instances through copy_rows()."""
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key or not field.auto_created]
+    copy_rows(model, [field.column for field in fields], (
+        [field.get_db_prep_save(field.pre_save(obj, add=True), connection) for field in fields] for obj in objs
+    ), ignore_conflicts=True)
+
+
+def copy_rows(model, columns, rows, ignore_conflicts=True):
+    """
+    PostgreSQL: COPY the rows into the table. To skip conflicting rows, they are
+    COPYed into a temporary table first, then INSERT ... ON CONFLICT DO NOTHING.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    column_list = ', '.join(connection.ops.quote_name(column) for column in columns)
+    staging = connection.ops.quote_name(f'import_{model._meta.db_table}')
+    lines = ('\t'.join(_copy_value(value) for value in values) + '\n' for values in rows)
+
+    with connection.cursor() as cursor:
+        if ignore_conflicts:
+            cursor.execute(f'CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {column_list} FROM {table} WITH NO DATA')
+        copy_sql = f'COPY {staging if ignore_conflicts else table} ({column_list}) FROM STDIN'
+        raw = cursor.cursor
+        if hasattr(raw, 'copy_expert'): # psycopg2
+            raw.copy_expert(copy_sql, _LineReader(lines))
+        else: # psycopg 3
+            with raw.copy(copy_sql) as copy:
+                for line in lines:
+                    copy.write(line)
+        if ignore_conflicts:
+            cursor.execute(f'INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {staging} ON CONFLICT DO NOTHING')
+            cursor.execute(f'DROP TABLE {staging}')
+
+
+class _LineReader:
+    """File-like read() over an iterator of lines, so psycopg2 streams COPY data without one big buffer."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ''
+
+    def read(self, size=-1):
+        parts = [self.buffer]
+        length = len(self.buffer)
+        while size < 0 or length < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            parts.append(line)
+            length += len(line)
+        data = ''.join(parts)
+        if size < 0:
+            self.buffer = ''
+            return data
+        self.buffer = data[size:]
+        return data[:size]
+
+
+def _copy_value(value):
+    """A value in COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value)
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if not isinstance(value, str):
+        value = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
@@ -0,0 +1,44 @@
+# attendance/serializers.py
+"""
+JSON shapes returned by the student APIs.
+
+The a-prefixed helpers consume a queryset with the async ORM, so async views
+can serialize without a thread-pool hop.
+"""
+from datetime import datetime
+
+from django.utils import timezone
+
+
+def session_json(session):
+    """A ClassSession (with its course selected) as the student APIs return it."""
+    return {
+        'id': session.id,
+        'course_name': session.course.name,
+        'start_datetime': timezone.make_aware(
+            datetime.combine(session.date, session.start_time)
+        ).isoformat(),
+        'end_datetime': timezone.make_aware(
+            datetime.combine(session.date, session.end_time)
+        ).isoformat(),
+    }
+
+
+def attendance_record_json(record):
+    """An AttendanceRecord (with class_session__course selected) for the history list."""
+    return {
+        'id': str(record.id),
+        'course_name': record.class_session.course.name,
+        'timestamp': record.timestamp.isoformat(),
+        'is_present': record.is_present,
+        'status': 'Present' if record.is_present else 'Pending',
+        'session_date': record.class_session.date.isoformat()
+    }
+
+
+async def asessions_json(sessions):
+    return [session_json(session) async for session in sessions.aiterator()]
+
+
+async def aattendance_records_json(records):
+    return [attendance_record_json(record) async for record in records.aiterator()]
@@ -0,0 +1,116 @@
+# attendance/signals.py
+from django.db.models.signals import m2m_changed, pre_save, post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver
+
+from attendance import code_cache, kpi_cache
+from attendance.models import AttendanceCode, AttendanceRecord, AbsenceJustification, Enrollment
+from attendance.rollups import COUNTED_FIELDS, apply_row_change, ensure_daily_stat, row_counters
+from attendance import submission_feed
+from courses.models import Course
+
+
+def rollup_state(sender, instance):
+    """The (course, date) key and counters of a record or justification as it is in memory."""
+    class_session = instance.class_session
+    values = {field: getattr(instance, field) for field in COUNTED_FIELDS[sender]}
+    return (class_session.course_id, class_session.date), row_counters(sender, values)
+
+
+@receiver(pre_save, sender=AttendanceRecord)
+@receiver(pre_save, sender=AbsenceJustification)
+def remember_daily_attendance_counters(sender, instance, **kwargs):
+    """What the row counted for before this save, so post_save only applies the difference."""
+    instance._rollup_before = None
+    if instance._state.adding:
+        return
+    old = sender.objects.filter(pk=instance.pk).values(
+        'class_session__course_id', 'class_session__date', *COUNTED_FIELDS[sender]
+    ).first()
+    if old is not None:
+        key = (old.pop('class_session__course_id'), old.pop('class_session__date'))
+        instance._rollup_before = key, row_counters(sender, old)
+
+
+@receiver(post_save, sender=AttendanceRecord)
+@receiver(post_save, sender=AbsenceJustification)
+def update_daily_attendance_stat(sender, instance, **kwargs):
+    """Applies the saved row's counter changes to the DailyAttendanceStat row of its course/day."""
+    apply_row_change(instance.__dict__.pop('_rollup_before', None), rollup_state(sender, instance))
+
+
+@receiver(post_delete, sender=AttendanceRecord)
+@receiver(post_delete, sender=AbsenceJustification)
+def discount_daily_attendance_stat(sender, instance, **kwargs):
+    """Takes a deleted row's counters off the DailyAttendanceStat row of its course/day."""
+    apply_row_change(rollup_state(sender, instance), None)
+
+
+@receiver(post_save, sender=AttendanceCode)
+def prepare_daily_attendance_stat(sender, instance, **kwargs):
+    """An active code means a burst of submissions is coming: have the rollup row ready."""
+    if instance.is_active:
+        class_session = instance.class_session
+        transaction.on_commit(lambda: ensure_daily_stat(class_session.course_id, class_session.date))
+
+
+@receiver(post_save, sender=AttendanceRecord)
+def bump_submission_feed(sender, instance, **kwargs):
+    """Stamps the saved record with a new version of its session's submissions feed once committed."""
+    submission_feed.touch_records_on_commit(instance.class_session_id, [instance.pk])
+
+
+@receiver(post_delete, sender=AttendanceRecord)
+def reset_submission_feed(sender, instance, **kwargs):
+    submission_feed.mark_deleted(instance.class_session_id)
+
+
+@receiver(pre_save, sender=AttendanceCode)
+def invalidate_replaced_code(sender, instance, **kwargs):
+    """Drops the cached entry of the code being replaced (regeneration changes the code string)."""
+    if instance.pk:
+        old_code = AttendanceCode.objects.filter(pk=instance.pk).values_list('code', flat=True).first()
+        if old_code and old_code != instance.code:
+            code_cache.invalidate(old_code)
+            transaction.on_commit(lambda: code_cache.invalidate(old_code))
+
+
+@receiver(post_save, sender=AttendanceCode)
+@receiver(post_delete, sender=AttendanceCode)
+def invalidate_code(sender, instance, **kwargs):
+    """Drops the cached entry once the new expiry/session is committed."""
+    code = instance.code
+    code_cache.invalidate(code)
+    transaction.on_commit(lambda: code_cache.invalidate(code))
+
+
+@receiver(post_save, sender=Enrollment)
+@receiver(post_delete, sender=Enrollment)
+def invalidate_course_codes(sender, instance, **kwargs):
+    """Cached code entries carry the course's enrolled-student set."""
+    course_id = instance.course_id
+    transaction.on_commit(lambda: code_cache.invalidate_course(course_id))
+
+
+@receiver(post_save, sender=Enrollment)
+@receiver(post_delete, sender=Enrollment)
+@receiver(post_save, sender=AttendanceRecord)
+@receiver(post_delete, sender=AttendanceRecord)
+@receiver(post_save, sender=AttendanceCode)
+@receiver(post_delete, sender=AttendanceCode)
+def invalidate_teacher_kpis(sender, instance, **kwargs):
+    """Dashboard counters of the course's teachers (students, pending validations, active codes)."""
+    course_id = instance.course_id if sender is Enrollment else instance.class_session.course_id
+    kpi_cache.invalidate_courses([course_id])
+
+
+@receiver(m2m_changed, sender=Course.teachers.through)
+def invalidate_teacher_course_kpis(sender, instance, action, reverse, pk_set, **kwargs):
+    """Teachers gained or lost courses: their cached counters cover the wrong set."""
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        kpi_cache.invalidate_teachers([instance.pk])
+    else:
+        kpi_cache.invalidate_teachers(pk_set or ())
+        kpi_cache.invalidate_courses([instance.pk]) # post_clear has no pk_set
@@ -0,0 +1,60 @@
+# attendance/submission_feed.py
+"""
+Versioning of the per-session submissions feed (get_session_submissions).
+
+Every change to a session's records bumps its SubmissionFeedVersion and
+stamps the changed rows with the new version, inside one transaction: the
+counter row stays locked until commit, so a client that has seen version N
+has also seen every row stamped N or lower. The feed's ETag is the counter
+alone, and ?since=N returns only rows with a higher version.
+
+Submissions and save() do the bump in a short transaction of its own once
+theirs has committed (touch_records_on_commit()), so the whole class
+submitting at once does not queue on the counter row for the length of
+each submit transaction. Until then a new record has version 0: full
+fetches already include it and delta fetches get it once it is stamped.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from attendance.models import AttendanceRecord, SubmissionFeedVersion
+
+
+def next_version(class_session_id):
+    """Increments the session's counter and returns the new version. Call inside a transaction."""
+    updated = SubmissionFeedVersion.objects.filter(class_session_id=class_session_id).update(
+        version=F('version') + 1
+    )
+    if not updated:
+        SubmissionFeedVersion.objects.get_or_create(class_session_id=class_session_id)
+        SubmissionFeedVersion.objects.filter(class_session_id=class_session_id).update(version=F('version') + 1)
+    return SubmissionFeedVersion.objects.values_list('version', flat=True).get(class_session_id=class_session_id)
+
+
+def touch_records(class_session_id, record_ids):
+    """Marks records of one session as changed; for save() and update() paths."""
+    with transaction.atomic():
+        version = next_version(class_session_id)
+        AttendanceRecord.objects.filter(id__in=record_ids).update(version=version)
+    return version
+
+
+def touch_records_on_commit(class_session_id, record_ids):
+    """touch_records() once the current transaction commits (straight away outside one)."""
+    transaction.on_commit(lambda: touch_records(class_session_id, record_ids))
+
+
+def mark_deleted(class_session_id):
+    """Records were deleted: clients holding an older version must refetch the whole feed."""
+    # update() only: the session itself may be in the middle of a cascade delete
+    SubmissionFeedVersion.objects.filter(class_session_id=class_session_id).update(
+        version=F('version') + 1,
+        reset_version=F('version') + 1,
+    )
+
+
+def current_version(class_session_id):
+    """(version, reset_version) of a session's feed; (0, 0) before its first change."""
+    return SubmissionFeedVersion.objects.filter(class_session_id=class_session_id).values_list(
+        'version', 'reset_version'
+    ).first() or (0, 0)
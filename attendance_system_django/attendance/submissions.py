@@ -0,0 +1,75 @@
+# attendance/submissions.py
+"""
+Fast path for student attendance code submissions.
+
+When a teacher shows a code the whole class submits within seconds, so the
+per-request work is kept to a cache lookup for the code (see
+attendance/code_cache.py) and a single INSERT that also acts as the
+duplicate check.
+"""
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from attendance.models import AttendanceRecord
+from attendance.rollups import increment_daily_stats
+from attendance.submission_feed import touch_records_on_commit
+
+
+def insert_attendance_record(entry, student, simulated_ip=None, simulated_geolocation=None):
+    """
+    Creates the student's record for the session in `entry`.
+    Returns (record_id, timestamp), or None if the student already submitted.
+    """
+    timestamp = timezone.now()
+
+    if connection.vendor in ('postgresql', 'sqlite') and connection.features.can_return_rows_from_bulk_insert:
+        record_id = _insert_on_conflict_do_nothing(
+            class_session=entry['class_session_id'],
+            student=student.id,
+            timestamp=timestamp,
+            is_present=False,
+            simulated_ip=simulated_ip,
+            simulated_geolocation=simulated_geolocation,
+            version=0, # Stamped by the feed bump below, see attendance/submission_feed.py
+        )
+        if record_id is None:
+            return None
+        # The raw INSERT skips post_save, so move the feed forward and count the submission in the rollup here
+        touch_records_on_commit(entry['class_session_id'], [record_id])
+        increment_daily_stats({(entry['course_id'], entry['date']): 1}, field='submitted')
+        return record_id, timestamp
+
+    # Other backends: rely on the unique constraint (post_save keeps the rollup and feed in sync)
+    try:
+        with transaction.atomic():
+            record = AttendanceRecord.objects.create(
+                class_session_id=entry['class_session_id'],
+                student=student,
+                is_present=False,
+                simulated_ip=simulated_ip,
+                simulated_geolocation=simulated_geolocation,
+            )
+    except IntegrityError:
+        return None
+    return record.id, record.timestamp
+
+
+def _insert_on_conflict_do_nothing(**values):
+    """INSERT ... ON CONFLICT (class_session, student) DO NOTHING RETURNING id."""
+    opts = AttendanceRecord._meta
+    qn = connection.ops.quote_name
+
+    fields = [opts.get_field(name) for name in values]
+    columns = ', '.join(qn(field.column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    params = [field.get_db_prep_save(value, connection) for field, value in zip(fields, values.values())]
+    conflict = ', '.join(qn(opts.get_field(name).column) for name in ('class_session', 'student'))
+
+    sql = (
+        f'INSERT INTO {qn(opts.db_table)} ({columns}) VALUES ({placeholders}) '
+        f'ON CONFLICT ({conflict}) DO NOTHING RETURNING {qn(opts.pk.column)}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return row[0] if row else None
@@ -0,0 +1,413 @@
+# attendance/synthetic_data.py
+"""
+Reproducible synthetic data sets for benchmarks and load tests.
+
+generate() builds a whole term for `students` students and `courses`
+courses: teachers, enrollments (a few popular courses, a long tail of small
+ones), weekly CourseSchedule slots expanded to sessions by
+courses.scheduling, and the attendance of every session up to now. Users
+are named <prefix>.teacher<n> / <prefix>.student<n> and courses coded
+<PREFIX><5 digits>, and a data set is found by exactly those patterns, so it
+can be regenerated or removed without touching anything else.
+
+Attendance follows simple but realistic patterns:
+
+- each student has their own attendance rate (Beta(9, 2), about 82% on
+  average, with a tail of frequently absent students), which slowly drops
+  over the term and on Fridays and evening slots;
+- arrival times scatter around the start of the class, with a few late ones;
+- most submissions come from the classroom network and the campus, a small
+  share from elsewhere (and those get a fraud flag);
+- older records are validated, last week's are partly pending, today's are
+  all pending; some absences and late arrivals have a justification.
+
+Every random draw comes from one seeded generator, and the term is laid out
+around `as_of` (default: now), so the same arguments, as_of included, give
+the same data set whatever the database already holds: attendance codes
+that clash with existing ones are redrawn from a generator of their own.
+Rows are inserted with schedule_import.insert_rows() (COPY on PostgreSQL),
+without building model instances.
+"""
+import json
+import re
+import time
+from datetime import datetime, time as dtime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import User
+from courses.models import ClassSession, Course, CourseSchedule
+from courses.scheduling import reconcile
+from attendance import geofence
+from attendance.fraud_rules import NO_ISSUES
+from attendance.models import (
+    AbsenceJustification, AttendanceCode, AttendanceRecord, DailyAttendanceStat, Enrollment, SubmissionFeedVersion,
+)
+from attendance.rollups import rebuild_daily_stats
+from attendance.schedule_import import bulk_insert, insert_rows
+
+
+DEFAULT_PREFIX = 'synth'
+PREFIX_PATTERN = re.compile(r'[a-z][a-z0-9]*')
+COURSE_DIGITS = 5
+DEFAULT_PASSWORD = 'password123'
+BATCH_SIZE = 5000
+
+SLOTS = [(dtime(9, 0), dtime(12, 0)), (dtime(14, 0), dtime(17, 0)), (dtime(18, 30), dtime(21, 30))]
+FIRST_NAMES = ['Ana', 'Bruno', 'Carla', 'David', 'Eva', 'Filipe', 'Gabriela', 'Hugo', 'Inês', 'João',
+               'Leonor', 'Miguel', 'Nuno', 'Beatriz', 'Rita', 'Pedro', 'Sofia', 'Tiago', 'Marta', 'Rui']
+LAST_NAMES = ['Silva', 'Santos', 'Ferreira', 'Pereira', 'Oliveira', 'Costa', 'Rodrigues', 'Martins',
+              'Sousa', 'Fernandes', 'Gonçalves', 'Gomes', 'Lopes', 'Marques', 'Alves', 'Almeida']
+TOPICS = ['Web Development', 'Data Science', 'Cybersecurity', 'Mobile Apps', 'Cloud Computing',
+          'Networks', 'Databases', 'UX Design', 'Machine Learning', 'DevOps', 'Game Development', 'IoT']
+JUSTIFICATIONS = [
+    'Consulta médica. Anexo comprovativo.',
+    'Problema de transporte devido a greve.',
+    'Assunto familiar urgente.',
+    'Doença. Envio atestado.',
+]
+CODE_ALPHABET = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'))
+
+
+def generate(students=2000, courses=40, weeks=12, seed=42, teachers=None, courses_per_student=3,
+             slots_per_week=2, prefix=DEFAULT_PREFIX, batch_size=BATCH_SIZE, as_of=None, log=None):
+    """
+    Creates the data set in one transaction and returns {table: rows created}.
+    The term ends on the Sunday of the week of `as_of` (an aware datetime,
+    default now) and started `weeks` weeks earlier; sessions up to as_of have
+    their attendance.
+    """
+    validate_prefix(prefix)
+    log = log or (lambda message: None)
+    now = as_of or timezone.now()
+    rng = np.random.default_rng(seed)
+    teachers = teachers or max(1, courses // 4)
+    courses_per_student = min(courses_per_student, courses)
+    counts = {}
+    started = time.monotonic()
+
+    with transaction.atomic():
+        password = make_password(DEFAULT_PASSWORD)
+        teacher_ids, student_ids = _create_users(rng, prefix, teachers, students, password, batch_size)
+        counts['users'] = teachers + students
+        log(f'  {counts["users"]:,} users ({time.monotonic() - started:.1f}s)')
+
+        course_ids = _create_courses(rng, prefix, courses, teacher_ids, batch_size)
+        counts['courses'] = courses
+
+        roster = _create_enrollments(rng, course_ids, student_ids, courses_per_student, now, batch_size)
+        counts['enrollments'] = students * courses_per_student
+        log(f'  {counts["enrollments"]:,} enrollments ({time.monotonic() - started:.1f}s)')
+
+        today = timezone.localdate(now)
+        term_end = today + timedelta(days=6 - today.weekday())
+        term_start = term_end - timedelta(weeks=weeks) + timedelta(days=1)
+        CourseSchedule.objects.bulk_create([
+            CourseSchedule(course_id=course_id, weekday=weekday, start_time=SLOTS[slot][0], end_time=SLOTS[slot][1],
+                           term_start=term_start, term_end=term_end)
+            for course_id in course_ids
+            for slot in [rng.integers(len(SLOTS))]
+            for weekday in sorted(rng.choice(5, size=min(slots_per_week, 5), replace=False).tolist())
+        ], batch_size=batch_size)
+        counts['sessions'] = reconcile(course_ids, term_start, term_end, batch_size=batch_size).created
+        log(f'  {counts["sessions"]:,} sessions ({time.monotonic() - started:.1f}s)')
+
+        sessions = list(ClassSession.objects.filter(
+            course_id__in=course_ids, date__lte=today
+        ).order_by('date', 'start_time', 'course_id').values_list('id', 'course_id', 'date', 'start_time', 'end_time'))
+        teacher_of = dict(Course.teachers.through.objects.filter(course_id__in=course_ids).values_list('course_id', 'user_id'))
+        counts['codes'] = _create_codes(rng, seed, sessions, teacher_of, now, batch_size)
+
+        records, justifications = _attendance_rows(rng, sessions, roster, student_ids, teacher_of, term_start, weeks, now)
+        insert_rows(AttendanceRecord, [
+            'class_session_id', 'student_id', 'timestamp', 'is_present', 'simulated_ip',
+            'simulated_geolocation', 'ai_result', 'version',
+        ], _counted(records, counts, 'records', log, started), batch_size)
+        insert_rows(AbsenceJustification, [
+            'student_id', 'class_session_id', 'description', 'submitted_at', 'justification_type',
+            'status', 'teacher_comment', 'reviewed_at', 'reviewed_by_id',
+        ], _counted(justifications, counts, 'justifications'), batch_size)
+        log(f'  {counts["records"]:,} records, {counts["justifications"]:,} justifications '
+            f'({time.monotonic() - started:.1f}s)')
+
+        # Raw inserts send no signals: rebuild the rollups in one pass
+        rebuild_daily_stats()
+    return counts
+
+
+def _counted(rows, counts, name, log=None, started=None):
+    counts[name] = 0
+    for row in rows:
+        counts[name] += 1
+        if log and counts[name] % 250_000 == 0:
+            log(f'  {counts[name]:,} {name} ({time.monotonic() - started:.1f}s)')
+        yield row
+
+
+def validate_prefix(prefix):
+    """Raises ValueError unless the prefix makes usernames and course codes that fit their columns."""
+    if not PREFIX_PATTERN.fullmatch(prefix):
+        raise ValueError(f"Invalid prefix '{prefix}': use lowercase letters and digits, starting with a letter")
+    max_length = Course._meta.get_field('code').max_length - COURSE_DIGITS
+    if len(prefix) > max_length:
+        raise ValueError(f"Invalid prefix '{prefix}': at most {max_length} characters")
+
+
+def dataset_users(prefix):
+    """The users of the data set with this prefix (regex lookups are case-sensitive, unlike LIKE on SQLite)."""
+    return User.objects.filter(username__regex=rf'^{re.escape(prefix)}\.(teacher|student)[0-9]+$')
+
+
+def dataset_courses(prefix):
+    """The courses of the data set with this prefix."""
+    return Course.objects.filter(code__regex=rf'^{re.escape(prefix.upper())}[0-9]{{{COURSE_DIGITS}}}$')
+
+
+def _create_users(rng, prefix, teachers, students, password, batch_size):
+    first = rng.integers(len(FIRST_NAMES), size=teachers + students)
+    last = rng.integers(len(LAST_NAMES), size=teachers + students)
+    users = [
+        User(username=f'{prefix}.teacher{i}', first_name=FIRST_NAMES[first[i]], last_name=LAST_NAMES[last[i]],
+             email=f'{prefix}.teacher{i}@example.com', role='teacher', is_staff=True, password=password)
+        for i in range(teachers)
+    ] + [
+        User(username=f'{prefix}.student{i}', first_name=FIRST_NAMES[first[teachers + i]],
+             last_name=LAST_NAMES[last[teachers + i]], email=f'{prefix}.student{i}@example.com',
+             role='student', password=password)
+        for i in range(students)
+    ]
+    bulk_insert(User, users, batch_size)
+
+    ids = dict(dataset_users(prefix).values_list('username', 'id'))
+    return ([ids[f'{prefix}.teacher{i}'] for i in range(teachers)],
+            np.array([ids[f'{prefix}.student{i}'] for i in range(students)], dtype=np.int64))
+
+
+def _create_courses(rng, prefix, courses, teacher_ids, batch_size):
+    bulk_insert(Course, [
+        Course(name=f'{TOPICS[i % len(TOPICS)]} {i // len(TOPICS) + 1}', code=f'{prefix.upper()}{i:05d}',
+               description='Synthetic course')
+        for i in range(courses)
+    ], batch_size)
+    ids = dict(dataset_courses(prefix).values_list('code', 'id'))
+    course_ids = [ids[f'{prefix.upper()}{i:05d}'] for i in range(courses)]
+
+    # Every teacher gets courses round-robin; a third of the courses have a second teacher
+    pairs = {(course_id, teacher_ids[i % len(teacher_ids)]) for i, course_id in enumerate(course_ids)}
+    pairs |= {
+        (course_id, teacher_ids[int(rng.integers(len(teacher_ids)))])
+        for course_id in course_ids if rng.random() < 1 / 3
+    }
+    insert_rows(Course.teachers.through, ['course_id', 'user_id'], sorted(pairs), batch_size)
+    return course_ids
+
+
+def _create_enrollments(rng, course_ids, student_ids, courses_per_student, now, batch_size):
+    """Enrolls each student in `courses_per_student` courses; returns {course id: array of student ids}."""
+    # Course popularity falls off with rank (1/sqrt): a few large courses, many small ones
+    weights = 1 / np.sqrt(np.arange(1, len(course_ids) + 1))
+    weights = weights[rng.permutation(len(course_ids))]
+    weights /= weights.sum()
+    choices = np.array([
+        rng.choice(len(course_ids), size=courses_per_student, replace=False, p=weights)
+        for _ in range(len(student_ids))
+    ]).reshape(len(student_ids), courses_per_student)
+
+    enrolled_at = connection.ops.adapt_datetimefield_value(now)
+    course_array = np.array(course_ids, dtype=np.int64)
+    pairs = np.stack([np.repeat(student_ids, courses_per_student), course_array[choices.ravel()]], axis=1)
+    insert_rows(Enrollment, ['student_id', 'course_id', 'enrollment_date'],
+                ((student_id, course_id, enrolled_at) for student_id, course_id in pairs.tolist()), batch_size)
+
+    order = np.argsort(pairs[:, 1], kind='stable')
+    course_column, student_column = pairs[order, 1], pairs[order, 0]
+    bounds = np.searchsorted(course_column, course_array, side='left'), np.searchsorted(course_column, course_array, side='right')
+    return {course_id: student_column[start:end] for course_id, start, end in zip(course_ids, *bounds)}
+
+
+def _create_codes(rng, seed, sessions, teacher_of, now, batch_size):
+    """One attendance code per session up to now; the ones running now stay active."""
+    # Always one draw per session from the shared generator, whatever is already in the database
+    drawn = [''.join(row) for row in CODE_ALPHABET[rng.integers(len(CODE_ALPHABET), size=(len(sessions), 6))]]
+    taken = set(AttendanceCode.objects.filter(code__in=drawn).values_list('code', flat=True))
+    codes = []
+    for index, code in enumerate(drawn):
+        attempt = 0
+        while code in taken:
+            # Clashes are redrawn from a generator of their own, keyed by session and attempt
+            attempt += 1
+            retry = np.random.default_rng([seed, index, attempt])
+            code = ''.join(CODE_ALPHABET[retry.integers(len(CODE_ALPHABET), size=6)])
+            if AttendanceCode.objects.filter(code=code).exists():
+                taken.add(code)
+        taken.add(code)
+        codes.append(code)
+    adapt = connection.ops.adapt_datetimefield_value
+
+    rows = []
+    for code, (session_id, course_id, day, start_time, end_time) in zip(codes, sessions):
+        start = timezone.make_aware(datetime.combine(day, start_time))
+        end = timezone.make_aware(datetime.combine(day, end_time))
+        if start > now:
+            continue
+        running = end > now
+        expires_at = now + timedelta(minutes=10) if running else start + timedelta(minutes=15)
+        rows.append((session_id, code, adapt(expires_at), adapt(min(start, now)), teacher_of.get(course_id), running))
+    insert_rows(AttendanceCode, ['class_session_id', 'code', 'expires_at', 'created_at', 'generated_by_id', 'is_active'],
+                rows, batch_size)
+    return len(rows)
+
+
+def _attendance_rows(rng, sessions, roster, student_ids, teacher_of, term_start, weeks, now):
+    """Generators of the record and justification rows of every session that has started by `now`."""
+    adapt = connection.ops.adapt_datetimefield_value
+    now_utc = np.datetime64(now.astimezone(dt_timezone.utc).replace(tzinfo=None), 'us')
+    campus = geofence.get_campuses()[0]
+    center = campus.get('latitude', 41.5431), campus.get('longitude', -8.4079)
+
+    # Per-student traits: attendance rate and the device (IP) they submit from
+    student_index = np.zeros(int(student_ids.max()) + 1 if len(student_ids) else 1, dtype=np.int64)
+    student_index[student_ids] = np.arange(len(student_ids))
+    rate = rng.beta(9, 2, size=len(student_ids))
+    device = rng.integers(2, 254, size=len(student_ids))
+    classroom_ip = [f'192.168.1.{host}' for host in device.tolist()]
+    weekday_factor = [0.97, 1.0, 1.0, 0.99, 0.92, 0.9, 0.9]
+    validated = json.dumps({'isFraudulent': False, 'fraudExplanation': NO_ISSUES, 'rules': {}})
+    flagged = {
+        'geofence': json.dumps({
+            'isFraudulent': True,
+            'fraudExplanation': 'Location is far from any campus.',
+            'rules': {'geofence': 'Location is far from any campus.'},
+        }),
+        'subnet': json.dumps({
+            'isFraudulent': True,
+            'fraudExplanation': 'IP address is outside the classroom network.',
+            'rules': {'subnet': 'IP address is outside the classroom network.'},
+        }),
+    }
+    justifications = []
+
+    def records():
+        for session_id, course_id, day, start_time, end_time in sessions:
+            start = timezone.make_aware(datetime.combine(day, start_time))
+            if start > now:
+                continue
+            students = roster.get(course_id)
+            if students is None or not len(students):
+                continue
+            size = len(students)
+            positions = student_index[students]
+            week = (day - term_start).days / 7
+            age = (now.date() - day).days
+            factor = (1 - 0.12 * week / weeks) * weekday_factor[day.weekday()] * (0.95 if start_time.hour >= 18 else 1)
+
+            attended = rng.random(size) < rate[positions] * factor
+            arrivals = rng.gamma(2.0, 3.0, size=size) - 4 # minutes after the start
+            arrivals[rng.random(size) < 0.04] += rng.uniform(15, 45) # late
+            outcome = rng.random(size)
+            excuse = rng.random(size)
+            latitudes = center[0] + rng.normal(0, 0.0004, size=size)
+            longitudes = center[1] + rng.normal(0, 0.0004, size=size)
+
+            # Submission times as naive UTC text, which both SQLite and PostgreSQL (UTC session) store as is
+            start_utc = np.datetime64(start.astimezone(dt_timezone.utc).replace(tzinfo=None), 'us')
+            stamps = np.minimum(start_utc + (arrivals * 60e6).astype('timedelta64[us]'), now_utc)
+            stamps = np.char.replace(np.datetime_as_string(stamps, unit='us'), 'T', ' ').tolist()
+
+            teacher_id = teacher_of.get(course_id)
+            if age > 0:
+                for i in np.flatnonzero(~attended & (excuse < 0.08)).tolist():
+                    justifications.append(_justification(
+                        rng, int(students[i]), session_id, start, age, 'absence', teacher_id, adapt))
+                for i in np.flatnonzero(attended & (arrivals > 15) & (excuse < 0.25)).tolist():
+                    justifications.append(_justification(
+                        rng, int(students[i]), session_id, start, age, 'late_arrival', teacher_id, adapt))
+
+            # Older submissions were reviewed; the last week's partly, today's not yet
+            pending = (outcome < 0.3) if 0 < age <= 7 else np.full(size, age == 0)
+            for i in np.flatnonzero(attended).tolist():
+                ip = classroom_ip[positions[i]]
+                latitude, longitude = float(latitudes[i]), float(longitudes[i])
+                fraud = None
+                if outcome[i] > 0.99:
+                    latitude, longitude, fraud = latitude + 0.5, longitude + 0.5, 'geofence'
+                elif outcome[i] > 0.98:
+                    ip, fraud = f'10.0.{device[positions[i]]}.{i % 250 + 1}', 'subnet'
+
+                if pending[i]:
+                    is_present, ai_result = False, None
+                elif fraud:
+                    is_present, ai_result = False, flagged[fraud]
+                else:
+                    is_present, ai_result = True, validated
+                yield (session_id, int(students[i]), stamps[i], is_present, ip,
+                       f'{{"latitude": {latitude!r}, "longitude": {longitude!r}}}', ai_result, 0)
+
+    def justification_rows():
+        # Filled in while the records are generated, so iterate only after they are inserted
+        yield from justifications
+
+    return records(), justification_rows()
+
+
+def _justification(rng, student_id, session_id, when, age, kind, teacher_id, adapt):
+    roll = rng.random()
+    if age > 7:
+        status = 'approved' if roll < 0.7 else 'rejected'
+    else:
+        status = 'pending' if roll < 0.6 else 'approved' if roll < 0.9 else 'rejected'
+    reviewed = status != 'pending'
+    return (
+        student_id, session_id, JUSTIFICATIONS[int(roll * 1000) % len(JUSTIFICATIONS)],
+        adapt(when + timedelta(hours=2)), kind, status, None,
+        adapt(when + timedelta(hours=12)) if reviewed else None, teacher_id if reviewed else None,
+    )
+
+
+# --- Removal ---
+
+def clear(prefix=DEFAULT_PREFIX):
+    """
+    Deletes a data set (its users and courses, and everything hanging off them)
+    with set-based DELETEs, and rebuilds the rollups. Returns the users and
+    courses removed.
+    """
+    validate_prefix(prefix)
+    users = dataset_users(prefix)
+    courses = dataset_courses(prefix)
+    sessions = ClassSession.objects.filter(course__in=courses)
+    with transaction.atomic():
+        removed = users.count(), courses.count()
+        for queryset in [
+            AbsenceJustification.objects.filter(class_session__in=sessions),
+            AbsenceJustification.objects.filter(student__in=users),
+            AttendanceRecord.objects.filter(class_session__in=sessions),
+            AttendanceRecord.objects.filter(student__in=users),
+            AttendanceCode.objects.filter(class_session__in=sessions),
+            SubmissionFeedVersion.objects.filter(class_session__in=sessions),
+            DailyAttendanceStat.objects.filter(course__in=courses),
+            Enrollment.objects.filter(course__in=courses),
+            Enrollment.objects.filter(student__in=users),
+            CourseSchedule.objects.filter(course__in=courses),
+            sessions,
+            Course.teachers.through.objects.filter(course__in=courses),
+            Course.teachers.through.objects.filter(user__in=users),
+            courses,
+            users,
+        ]:
+            _raw_delete(queryset)
+        rebuild_daily_stats()
+    return removed
+
+
+def _raw_delete(queryset):
+    """DELETE ... WHERE pk IN (subquery) without loading rows or sending signals."""
+    model = queryset.model
+    sql, params = queryset.values('pk').query.sql_with_params()
+    table = connection.ops.quote_name(model._meta.db_table)
+    pk = connection.ops.quote_name(model._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE {pk} IN ({sql})', params)
@@ -0,0 +1,140 @@
+# attendance/teacher_context.py
+"""
+Data shared by the teacher dashboards (dashboard_view, teacher_dashboard and
+teacher_generate_code_page).
+
+TeacherContext loads each piece once, on first use, and for_request() keeps
+one instance per request, so a view (or a template tag) asking twice for the
+same thing does not query twice. Today's sessions come with their course and
+attendance code in a single joined query; the counters come from
+attendance.kpi_cache.
+"""
+from functools import cached_property
+
+from django.core.exceptions import ObjectDoesNotExist
+from django.utils import timezone
+
+from courses.models import ClassSession
+from attendance import kpi_cache
+from attendance.models import AttendanceRecord
+
+
+REQUEST_ATTR = '_teacher_context'
+
+
+def for_request(request):
+    """The TeacherContext of the request's user, built on first use."""
+    context = getattr(request, REQUEST_ATTR, None)
+    if context is None or context.teacher != request.user:
+        context = TeacherContext(request.user)
+        setattr(request, REQUEST_ATTR, context)
+    return context
+
+
+def session_code(session):
+    """The session's AttendanceCode (selected with it), or None."""
+    try:
+        return session.attendance_code
+    except ObjectDoesNotExist:
+        return None
+
+
+class TeacherContext:
+
+    def __init__(self, teacher):
+        self.teacher = teacher
+        self.now = timezone.now()
+        self.today = timezone.localdate(self.now)
+
+    @cached_property
+    def sessions_today(self):
+        """Today's sessions, with course and attendance code, ordered by start time."""
+        return list(ClassSession.objects.filter(
+            course__teachers=self.teacher,
+            date=self.today,
+        ).order_by('start_time').select_related('course', 'attendance_code'))
+
+    @cached_property
+    def upcoming_sessions_today(self):
+        """Today's sessions that are ongoing or still to start."""
+        now_time = timezone.localtime(self.now).time()
+        return [
+            session for session in self.sessions_today
+            if session.start_time > now_time or session.end_time >= now_time
+        ]
+
+    def code_details(self, sessions):
+        """
+        Picks the session to display among `sessions`: the first one with a valid
+        code, else the first one. Returns (session or None, code details dict).
+        """
+        for session in sessions:
+            code_obj = session_code(session)
+            if code_obj is not None and code_obj.is_valid():
+                return session, {
+                    'code': code_obj.code,
+                    'class_session_id': str(session.id),
+                    'expires_at': code_obj.expires_at.isoformat(),
+                    'code_status': 'active'
+                }
+
+        if not sessions:
+            return None, {'code_status': 'inactive', 'code': None, 'class_session_id': None, 'expires_at': None}
+
+        session = sessions[0]
+        code_obj = session_code(session)
+        if code_obj is None:
+            return session, {
+                'code_status': 'inactive',
+                'code': None,
+                'class_session_id': str(session.id),
+                'expires_at': None
+            }
+        return session, {
+            'code': code_obj.code,
+            'class_session_id': str(session.id),
+            'expires_at': code_obj.expires_at.isoformat() if code_obj.expires_at else None,
+            'code_status': 'expired'
+        }
+
+    @cached_property
+    def active_session(self):
+        """(session, code details) among all of today's sessions."""
+        return self.code_details(self.sessions_today)
+
+    @cached_property
+    def active_upcoming_session(self):
+        """(session, code details) among today's ongoing/upcoming sessions."""
+        return self.code_details(self.upcoming_sessions_today)
+
+    def submissions(self, session):
+        """Initial submissions list of the dashboard for one session."""
+        if session is None:
+            return []
+        records = AttendanceRecord.objects.filter(
+            class_session=session
+        ).select_related('student').order_by('timestamp')
+        return [{
+            'id': str(record.id),
+            'name': record.student.get_full_name() or record.student.username,
+            'timestamp': record.timestamp.isoformat(),
+            'simulatedIp': record.simulated_ip,
+            'simulatedGeolocation': record.simulated_geolocation,
+            'aiResult': record.ai_result,
+            'is_present': record.is_present,
+            'class_session_id': str(session.id),
+        } for record in records]
+
+    @cached_property
+    def kpis(self):
+        return kpi_cache.teacher_kpis(self.teacher)
+
+    def metrics(self):
+        """The dashboard counters."""
+        return {
+            'total_students_enrolled': self.kpis['students'],
+            'total_courses_taught': self.kpis['courses'],
+            'current_day_sessions': len(self.sessions_today),
+            'pending_validations': self.kpis['pending_validations'],
+            'active_codes_count': self.kpis['active_codes'],
+        }
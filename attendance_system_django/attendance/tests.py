@@ -1,3 +1,1367 @@
-from django.test import TestCase
+"""
+Query-count benchmark of every view in attendance/urls.py.
 
-# Create your tests here.
+Two synthetic data sets (attendance.synthetic_data) are seeded, the second
+with four times the students and twice the courses and weeks. Every URL is
+requested as a teacher and as a student of each data set, with cold caches,
+and the SQL query count, DB time and wall time of each request are
+recorded. The run fails when:
+
+- a URL in attendance/urls.py has no request in view_requests(),
+- a view runs more queries on the large data set than on the small one
+  (its query count grows with the data: an N+1), or
+- a view runs more queries than its committed baseline in
+  attendance/query_baselines.json.
+
+After an intended change, rewrite the baselines with
+    UPDATE_QUERY_BASELINES=1 python manage.py test attendance
+Set VIEW_BENCHMARK_REPORT to a file path (or '-' for stdout) to also get the
+timings.
+
+The behaviour tests below the benchmark reuse its seeded data sets.
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime, time as dtime, timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from django.utils import timezone
+
+from core.models import User
+from courses.models import ClassSession, Course, Holiday
+from courses.scheduling import reconcile
+from attendance import (
+    code_cache, device_sharing, exports, frame_codecs, fraud_rules, geofence, instrumentation, kpi_cache, notifications,
+    rollups, schedule_import, submissions, synthetic_data,
+)
+from attendance.models import AbsenceJustification, AttendanceCode, AttendanceRecord, DailyAttendanceStat, Enrollment
+from attendance.routing import websocket_urlpatterns
+from attendance.urls import urlpatterns
+
+
+BASELINES_PATH = Path(__file__).with_name('query_baselines.json')
+
+DATA_SETS = {
+    'small': {'students': 30, 'courses': 4, 'weeks': 2},
+    'large': {'students': 120, 'courses': 8, 'weeks': 4},
+}
+ROLES = ('teacher', 'student')
+
+
+def view_requests(fixture):
+    """URL name -> (method, data) of the request made to each view."""
+    live = fixture['live_session']
+    campus = {'simulated_latitude': '41.5431', 'simulated_longitude': '-8.4079'}
+    return {
+        'dashboard': ('get', {}),
+        'teacher_dashboard': ('get', {}),
+        'teacher_portal': ('get', {}),
+        'teacher_generate_code': ('get', {}),
+        'teacher_generate_code_page': ('get', {}),
+        'teacher_analytics': ('get', {'period': 30}),
+        'student_dashboard': ('get', {}),
+        'student_portal': ('get', {}),
+        'student_calendar': ('get', {}),
+        'student_enter_code': ('get', {}),
+        'student_justify_absence': ('get', {}),
+        'generate_code_api_view': ('post', {'class_session_id': live.id}),
+        'generate_attendance_code': ('post', {'class_session_id': live.id}),
+        'run_ai_validation': ('post', {'attendance_record_id': fixture['record_ids'][0], 'class_session_id': live.id}),
+        'run_ai_validation_bulk': ('post', {'class_session_id': live.id}),
+        'validate_attendance': ('post', {'attendance_record_id': fixture['record_ids'][0]}),
+        'validate_attendance_batch': ('post', {'attendance_record_ids': fixture['record_ids'], 'class_session_id': live.id}),
+        'get_session_submissions': ('get', {'class_session_id': live.id}),
+        'export_attendance': ('get', {'course': live.course_id, 'format': 'csv'}),
+        'submit_attendance_code': ('post', {'attendance_code': fixture['code'], 'simulated_ip': '192.168.1.250', **campus}),
+        'api_student_current_classes': ('get', {}),
+        'api_student_today_classes': ('get', {}),
+        'api_student_weekly_classes': ('get', {}),
+        'api_student_attendance_history': ('get', {}),
+        'submit_justification': ('post', {
+            'class_session_id': live.id, 'description': 'Atraso do autocarro.', 'is_late_arrival': 'true',
+        }),
+        'request_metrics': ('get', {}),
+        'request_metrics_prometheus': ('get', {}),
+        'home': ('get', {}),
+    }
+
+
+def url_names():
+    return [pattern.name for pattern in urlpatterns if isinstance(pattern, URLPattern) and pattern.name]
+
+
+def seed(prefix, students, courses, weeks):
+    """A synthetic data set plus a session running today with an active code and pending submissions."""
+    # Anchored on the last Wednesday at noon, so the data set only ever moves by whole weeks
+    wednesday = timezone.localdate() - timedelta(days=(timezone.localdate().weekday() - 2) % 7)
+    as_of = timezone.make_aware(datetime.combine(wednesday, dtime(12)))
+    synthetic_data.generate(students=students, courses=courses, weeks=weeks, teachers=1, prefix=prefix, as_of=as_of)
+    teacher = User.objects.get(username=f'{prefix}.teacher0')
+    student = User.objects.get(username=f'{prefix}.student0')
+    course = student.student_enrollments.select_related('course').first().course
+
+    today = timezone.localdate()
+    live = ClassSession.objects.create(course=course, date=today, start_time=dtime(0, 0, 1), end_time=dtime(23, 59, 59))
+    code = AttendanceCode.objects.create(
+        class_session=live, generated_by=teacher, expires_at=timezone.now() + timedelta(hours=1)
+    )
+    classmates = User.objects.filter(student_enrollments__course=course).exclude(id=student.id).order_by('id')
+    AttendanceRecord.objects.bulk_create([
+        AttendanceRecord(
+            class_session=live, student=classmate, simulated_ip=f'192.168.1.{n % 250 + 1}',
+            simulated_geolocation={'latitude': 41.5431, 'longitude': -8.4079},
+        )
+        for n, classmate in enumerate(classmates)
+    ])
+    # What the code's post_save does once committed (on_commit never runs inside a TestCase)
+    rollups.ensure_daily_stat(course.id, today)
+    return {
+        'teacher': teacher,
+        'student': student,
+        'live_session': live,
+        'code': code.code,
+        'record_ids': list(AttendanceRecord.objects.filter(class_session=live).values_list('id', flat=True)),
+    }
+
+
+def measure(client, method, url, data):
+    """Query count, DB time and wall time (ms) of one request with cold caches; its writes are rolled back."""
+    cache.clear()
+    code_cache._local.clear()
+    device_sharing._indexes.clear()
+    with transaction.atomic():
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            wall = time.perf_counter() - started
+        transaction.set_rollback(True)
+    return {
+        'status': response.status_code,
+        'queries': len(queries.captured_queries),
+        'db_ms': round(sum(float(query['time']) for query in queries.captured_queries) * 1000, 2),
+        'wall_ms': round(wall * 1000, 2),
+    }
+
+
+class ViewQueryBenchmarkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.results = {}
+        for size, options in DATA_SETS.items():
+            fixture = seed(f'bench{size}', **options)
+            requests = view_requests(fixture)
+            cls.unbenchmarked = sorted(set(url_names()) - set(requests))
+            for role in ROLES:
+                client = cls.client_class()
+                client.force_login(fixture[role])
+                for name in url_names():
+                    if name not in requests:
+                        continue
+                    method, data = requests[name]
+                    cls.results[(size, role, name)] = measure(client, method, reverse(name), data)
+        cls.write_report()
+
+    @classmethod
+    def write_report(cls):
+        target = os.environ.get('VIEW_BENCHMARK_REPORT')
+        if not target:
+            return
+        lines = [f"{'view':<32} {'role':<8} {'size':<6} {'status':>6} {'queries':>8} {'db ms':>8} {'wall ms':>8}"]
+        for (size, role, name), result in sorted(cls.results.items(), key=lambda item: (item[0][2], item[0][1], item[0][0])):
+            lines.append(f"{name:<32} {role:<8} {size:<6} {result['status']:>6} {result['queries']:>8} "
+                         f"{result['db_ms']:>8.2f} {result['wall_ms']:>8.2f}")
+        if target == '-':
+            sys.stdout.write('\n' + '\n'.join(lines) + '\n')
+        else:
+            Path(target).write_text(json.dumps(
+                [{'view': name, 'role': role, 'size': size, **result} for (size, role, name), result in cls.results.items()],
+                indent=2,
+            ))
+
+    def test_every_url_is_benchmarked(self):
+        self.assertFalse(self.unbenchmarked, f'Add these URL names to view_requests(): {self.unbenchmarked}')
+
+    def test_query_counts_do_not_grow_with_data(self):
+        grown = [
+            f"{name} as {role}: {self.results[('small', role, name)]['queries']} -> {result['queries']} queries"
+            for (size, role, name), result in self.results.items()
+            if size == 'large' and result['queries'] > self.results[('small', role, name)]['queries']
+        ]
+        self.assertFalse(grown, 'Query counts grow with the data set:\n' + '\n'.join(grown))
+
+    def test_query_counts_within_baselines(self):
+        measured = {}
+        for (size, role, name), result in self.results.items():
+            counts = measured.setdefault(name, {})
+            counts[role] = max(counts.get(role, 0), result['queries'])
+
+        if os.environ.get('UPDATE_QUERY_BASELINES'):
+            BASELINES_PATH.write_text(json.dumps(dict(sorted(measured.items())), indent=2) + '\n')
+            return
+
+        baselines = json.loads(BASELINES_PATH.read_text())
+        exceeded = [
+            f'{name} as {role}: {count} queries (baseline {baselines.get(name, {}).get(role)})'
+            for name, counts in sorted(measured.items())
+            for role, count in counts.items()
+            if count > baselines.get(name, {}).get(role, 0)
+        ]
+        self.assertFalse(exceeded, 'Query counts above the committed baselines:\n' + '\n'.join(exceeded)
+                         + '\nIf intended, rerun with UPDATE_QUERY_BASELINES=1.')
+
+
+class ExportStreamingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.fixture = seed('export', students=30, courses=2, weeks=2)
+
+    def export(self):
+        return reverse('export_attendance'), {'course': self.fixture['live_session'].course_id, 'format': 'csv'}
+
+    def test_csv_streams_in_chunks_under_asgi(self):
+        self.client.force_login(self.fixture['teacher'])
+        response = self.client.get(*self.export())
+        self.assertFalse(response.is_async)
+        expected = b''.join(response.streaming_content)
+
+        async def stream():
+            await self.async_client.aforce_login(self.fixture['teacher'])
+            response = await self.async_client.get(*self.export())
+            return response, [chunk async for chunk in response.streaming_content]
+
+        with mock.patch.object(exports, 'ASYNC_CHUNK_LINES', 5):
+            response, chunks = async_to_sync(stream)()
+        self.assertEqual(response.status_code, 200)
+        # An async iterator: Django would otherwise list() the whole file before the first byte
+        self.assertTrue(response.is_async)
+        lines = len(expected.splitlines())
+        self.assertGreater(lines, 5)
+        self.assertEqual(len(chunks), -(-lines // 5))
+        self.assertEqual(b''.join(chunks), expected)
+
+
+class TeacherAnalyticsTests(TestCase):
+    """teacher_analytics against a small hand-counted fixture (see the comments for the expected numbers)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='stats.teacher', password='x', role='teacher')
+        cls.maths = Course.objects.create(name='Maths', code='STATS1')
+        cls.physics = Course.objects.create(name='Physics', code='STATS2')
+        for course in (cls.maths, cls.physics):
+            course.teachers.add(cls.teacher)
+        cls.ana, cls.rui, cls.eva = [
+            User.objects.create_user(username=username, first_name=first_name, password='x', role='student')
+            for username, first_name in (('stats.ana', 'Ana'), ('stats.rui', 'Rui'), ('stats.eva', 'Eva'))
+        ]
+        for student in (cls.ana, cls.rui, cls.eva):
+            Enrollment.objects.create(student=student, course=cls.maths)
+        Enrollment.objects.create(student=cls.ana, course=cls.physics)
+
+        cls.day = timezone.now().date() - timedelta(days=1)
+        morning, afternoon, evening = [
+            ClassSession.objects.create(course=course, date=cls.day, start_time=dtime(hour), end_time=dtime(hour + 2))
+            for course, hour in ((cls.maths, 9), (cls.maths, 14), (cls.physics, 19))
+        ]
+        earlier = ClassSession.objects.create(
+            course=cls.maths, date=cls.day - timedelta(days=40), start_time=dtime(9), end_time=dtime(11)
+        )
+        AttendanceCode.objects.create(class_session=morning, expires_at=timezone.now())
+        clean = {'isFraudulent': False, 'fraudExplanation': 'No issues detected.', 'rules': {}}
+        flagged = {'isFraudulent': True, 'fraudExplanation': 'Outside.', 'rules': {'geofence': 'Outside.'}}
+        for session, student, is_present, ai_result in (
+            (morning, cls.ana, True, None),
+            (morning, cls.rui, False, clean),
+            (morning, cls.eva, True, None),
+            (afternoon, cls.ana, True, None),
+            (evening, cls.ana, False, flagged),
+            (earlier, cls.ana, False, None), # Previous period only
+        ):
+            AttendanceRecord.objects.create(class_session=session, student=student, is_present=is_present, ai_result=ai_result)
+        AbsenceJustification.objects.create(
+            student=cls.rui, class_session=morning, description='Bus', justification_type='late_arrival', status='approved'
+        )
+
+    def test_numbers(self):
+        self.client.force_login(self.teacher)
+        context = self.client.get(reverse('teacher_analytics')).context
+        # 5 submissions in the period, 3 of them present; the previous period had 0 of 1
+        self.assertEqual(context['total_submissions'], 5)
+        self.assertEqual(context['present_submissions'], 3)
+        self.assertEqual(context['global_attendance_rate'], 60.0)
+        self.assertEqual(context['rate_change'], 60.0)
+        self.assertEqual((context['total_students'], context['total_classes'], context['total_codes']), (3, 3, 1))
+        self.assertEqual((context['codes_per_session'], context['avg_students_per_class']), (0.33, 1.7))
+        self.assertEqual((context['ai_validated_records'], context['ai_flagged_records']), (2, 1))
+
+        self.assertEqual(json.loads(context['time_distribution_data'])['data'], [1, 1, 1])
+        # Present, justified, unjustified (2 pending - 1 justified - 1 late), late
+        self.assertEqual(json.loads(context['attendance_status_data'])['data'], [3, 1, 0, 1])
+        self.assertEqual(json.loads(context['course_performance_data']), {'labels': ['Maths', 'Physics'], 'data': [75.0, 0]})
+        self.assertEqual([
+            (row['name'], row['students'], row['avg_rate'], row['total_classes'], row['total_submissions'], row['present_submissions'])
+            for row in context['course_stats']
+        ], [('Maths', 3, 75.0, 2, 4, 3), ('Physics', 1, 0, 1, 1, 0)])
+        self.assertEqual([(row['name'], row['rate'], row['classes']) for row in context['top_students']], [
+            ('Eva', 100.0, 1), ('Ana', 66.7, 3), ('Rui', 0.0, 1),
+        ])
+
+        weekdays = json.loads(context['weekly_distribution_data'])['data']
+        self.assertEqual(weekdays, [60.0 if self.day.weekday() == day else 0 for day in range(5)])
+        end = timezone.now().date()
+        weeks_ago = ((end - timedelta(days=end.weekday())) - (self.day - timedelta(days=self.day.weekday()))).days // 7
+        trend = json.loads(context['attendance_trend_data'])['data']
+        self.assertEqual(trend, [60.0 if 7 - position == weeks_ago else 0 for position in range(8)])
+
+
+class RollupTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(name='Rollup Course', code='ROLL1')
+        cls.session = ClassSession.objects.create(course=cls.course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        cls.students = [User.objects.create_user(username=f'roll{i}', password='x', role='student') for i in range(3)]
+
+    def counters(self):
+        stat = DailyAttendanceStat.objects.filter(course=self.course, date=self.session.date).first()
+        return {field: getattr(stat, field) if stat else 0 for field in rollups.COUNTER_FIELDS}
+
+    def assertRollup(self, **expected):
+        counters = self.counters()
+        self.assertEqual(counters, {**dict.fromkeys(rollups.COUNTER_FIELDS, 0), **expected})
+        # Recounting from the raw tables agrees with the increments
+        rollups.rebuild_daily_stats()
+        self.assertEqual(self.counters(), counters)
+
+    def test_saves_and_deletes_apply_deltas(self):
+        first = AttendanceRecord.objects.create(class_session=self.session, student=self.students[0])
+        second = AttendanceRecord.objects.create(class_session=self.session, student=self.students[1])
+        self.assertRollup(submitted=2)
+
+        first.is_present = True
+        first.ai_result = {'isFraudulent': True, 'fraudExplanation': 'Outside.', 'rules': {}}
+        first.save()
+        second.ai_result = {'isFraudulent': False, 'fraudExplanation': 'No issues detected.', 'rules': {}}
+        second.save()
+        second.save() # Unchanged: nothing to apply
+        self.assertRollup(submitted=2, present=1, ai_validated=2, ai_flagged=1)
+
+        justification = AbsenceJustification.objects.create(
+            student=self.students[2], class_session=self.session, description='Late', justification_type='late_arrival'
+        )
+        self.assertRollup(submitted=2, present=1, ai_validated=2, ai_flagged=1, late=1)
+        justification.status = 'approved'
+        justification.save()
+        self.assertRollup(submitted=2, present=1, ai_validated=2, ai_flagged=1, late=1, justified=1)
+
+        first.delete()
+        justification.delete()
+        self.assertRollup(submitted=1, ai_validated=1)
+
+    def test_rebuild_and_refresh_count_rows_written_without_signals(self):
+        AttendanceRecord.objects.bulk_create([
+            AttendanceRecord(class_session=self.session, student=student, is_present=present)
+            for student, present in zip(self.students, (True, True, False))
+        ])
+        self.assertEqual(self.counters(), dict.fromkeys(rollups.COUNTER_FIELDS, 0))
+        self.assertEqual(rollups.refresh_daily_stats_for_sessions(ClassSession.objects.filter(id=self.session.id)), 1)
+        self.assertEqual(self.counters()['present'], 2)
+
+        DailyAttendanceStat.objects.update(present=0, submitted=0)
+        call_command('rebuild_attendance_stats', stdout=io.StringIO())
+        self.assertEqual((self.counters()['submitted'], self.counters()['present']), (3, 2))
+
+    def test_updates_run_one_counter_query(self):
+        record = AttendanceRecord.objects.create(class_session=self.session, student=self.students[0])
+        record.is_present = True
+        with CaptureQueriesContext(connection) as queries:
+            record.save()
+        stat_queries = [query['sql'] for query in queries if 'dailyattendancestat' in query['sql']]
+        self.assertEqual(len(stat_queries), 1)
+        self.assertTrue(stat_queries[0].startswith('UPDATE'))
+
+
+class BatchValidateTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='batch.teacher', password='x', role='teacher')
+        cls.other_teacher = User.objects.create_user(username='batch.other', password='x', role='teacher')
+        cls.course = Course.objects.create(name='Batch Course', code='BATCH1')
+        cls.course.teachers.add(cls.teacher)
+        cls.other_course = Course.objects.create(name='Other Batch Course', code='BATCH2')
+        cls.other_course.teachers.add(cls.other_teacher)
+        cls.session = ClassSession.objects.create(course=cls.course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        cls.other_session = ClassSession.objects.create(
+            course=cls.other_course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.teacher)
+
+    def validate(self, **data):
+        return self.client.post(reverse('validate_attendance_batch'), data)
+
+    def test_invalid_session_ids_are_rejected(self):
+        self.assertEqual(self.validate(class_session_id='abc').status_code, 400)
+        response = self.client.post(reverse('run_ai_validation_bulk'), {'class_session_id': 'abc'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_sessions_of_other_teachers_are_not_found(self):
+        # Even without records, so nothing to check them against
+        self.assertEqual(self.validate(class_session_id=self.other_session.id).status_code, 404)
+        self.assertEqual(self.validate(class_session_id=self.session.id).status_code, 200)
+
+    def test_records_of_other_teachers_are_forbidden(self):
+        student = User.objects.create_user(username='batch.student', password='x', role='student')
+        own = AttendanceRecord.objects.create(class_session=self.session, student=student)
+        other = AttendanceRecord.objects.create(class_session=self.other_session, student=student)
+        response = self.validate(attendance_record_ids=f'{own.id},{other.id}')
+        self.assertEqual(response.status_code, 403)
+        # Nothing of the batch was validated
+        self.assertFalse(AttendanceRecord.objects.filter(is_present=True).exists())
+
+    def test_unknown_records_are_not_found(self):
+        self.assertEqual(self.validate(attendance_record_ids='999999').status_code, 404)
+        self.assertEqual(self.validate(attendance_record_ids='1,x').status_code, 400)
+
+    def test_validates_pending_records_and_counts_them_once(self):
+        students = [User.objects.create_user(username=f'batch.student{i}', password='x', role='student') for i in range(3)]
+        records = [
+            AttendanceRecord.objects.create(class_session=self.session, student=student, is_present=i == 0)
+            for i, student in enumerate(students)
+        ]
+        stat = DailyAttendanceStat.objects.get(course=self.course, date=self.session.date)
+        self.assertEqual((stat.submitted, stat.present), (3, 1))
+
+        response = self.validate(attendance_record_ids=[record.id for record in records])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(sorted(response.json()['validated_ids']), sorted(str(record.id) for record in records[1:]))
+        self.assertEqual(response.json()['already_validated'], 1)
+        # Validating again changes nothing
+        self.assertEqual(self.validate(class_session_id=self.session.id).json()['validated_ids'], [])
+
+        stat.refresh_from_db()
+        self.assertEqual((stat.submitted, stat.present), (3, 3))
+        self.assertEqual(AttendanceRecord.objects.filter(is_present=True).count(), 3)
+        rollups.rebuild_daily_stats()
+        self.assertEqual(DailyAttendanceStat.objects.get(course=self.course, date=self.session.date).present, 3)
+
+    def test_student_notices_are_opt_in(self):
+        students = [User.objects.create_user(username=f'batch.student{i}', password='x', role='student') for i in range(3)]
+        for student in students:
+            AttendanceRecord.objects.create(class_session=self.session, student=student)
+        with mock.patch('attendance.views.send_group_notification') as send:
+            self.validate(class_session_id=self.session.id)
+        self.assertEqual([call.kwargs['group_name'] for call in send.call_args_list], [
+            notifications.class_session_group(self.session.id),
+        ])
+
+        AttendanceRecord.objects.update(is_present=False)
+        with mock.patch('attendance.views.send_group_notification') as send:
+            self.validate(class_session_id=self.session.id, notify_students='1')
+        self.assertEqual(len(send.call_args_list), 1 + len(students))
+
+
+class SubmissionInsertTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(name='Insert Course', code='INSERT1')
+        cls.session = ClassSession.objects.create(course=cls.course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        cls.student = User.objects.create_user(username='insert.student', password='x', role='student')
+        cls.entry = {'class_session_id': cls.session.id, 'course_id': cls.course.id, 'date': cls.session.date}
+
+    def submitted(self):
+        return DailyAttendanceStat.objects.filter(course=self.course).values_list('submitted', flat=True).first()
+
+    def test_second_submission_is_a_no_op(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            record_id, timestamp = submissions.insert_attendance_record(self.entry, self.student, '192.168.1.5', {'latitude': 1.0})
+        record = AttendanceRecord.objects.get(id=record_id)
+        self.assertEqual(
+            (record.student_id, record.simulated_ip, record.simulated_geolocation),
+            (self.student.id, '192.168.1.5', {'latitude': 1.0}),
+        )
+        self.assertGreater(record.version, 0) # Stamped by the feed once committed
+        self.assertEqual(self.submitted(), 1)
+        self.assertTrue(callbacks)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertIsNone(submissions.insert_attendance_record(self.entry, self.student, '192.168.1.6'))
+        self.assertEqual(callbacks, [])
+        self.assertEqual(AttendanceRecord.objects.get().simulated_ip, '192.168.1.5')
+        self.assertEqual(self.submitted(), 1)
+
+    def test_backends_without_on_conflict_rely_on_the_constraint(self):
+        features = type(connection.features)
+        with mock.patch.object(features, 'can_return_rows_from_bulk_insert', new_callable=mock.PropertyMock, return_value=False):
+            self.assertIsNotNone(submissions.insert_attendance_record(self.entry, self.student))
+            self.assertIsNone(submissions.insert_attendance_record(self.entry, self.student))
+        self.assertEqual(AttendanceRecord.objects.count(), 1)
+        self.assertEqual(self.submitted(), 1)
+
+
+class CodeCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='codecache.teacher', password='x', role='teacher')
+        cls.course = Course.objects.create(name='Code Cache Course', code='CACHE1')
+        cls.course.teachers.add(cls.teacher)
+        # Codes can only be generated for today's classes that have not ended
+        cls.session = ClassSession.objects.create(
+            course=cls.course, date=timezone.localdate(), start_time=dtime(0), end_time=dtime(23, 59, 59)
+        )
+        cls.students = [User.objects.create_user(username=f'codecache{i}', password='x', role='student') for i in range(2)]
+        Enrollment.objects.create(course=cls.course, student=cls.students[0])
+
+    def setUp(self):
+        cache.clear()
+        code_cache._local.clear()
+
+    def generate(self):
+        self.client.force_login(self.teacher)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('generate_attendance_code'), {'class_session_id': self.session.id})
+        self.assertEqual(response.status_code, 200)
+        return AttendanceCode.objects.get(class_session=self.session).code
+
+    def test_regenerating_drops_the_replaced_code(self):
+        old_code = self.generate()
+        self.assertEqual(code_cache.lookup(old_code)['class_session_id'], self.session.id)
+
+        new_code = self.generate()
+        self.assertNotEqual(new_code, old_code)
+        with self.assertNumQueries(1):
+            self.assertIsNone(code_cache.lookup(old_code))
+        entry = code_cache.lookup(new_code)
+        self.assertTrue(code_cache.is_valid(entry))
+        # Served from the cache from now on
+        with self.assertNumQueries(0):
+            self.assertEqual(code_cache.lookup(new_code), entry)
+
+    def test_enrollment_changes_refresh_the_student_set(self):
+        code = self.generate()
+        self.assertEqual(code_cache.lookup(code)['student_ids'], {self.students[0].id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrollment.objects.create(course=self.course, student=self.students[1])
+        self.assertEqual(code_cache.lookup(code)['student_ids'], {self.students[0].id, self.students[1].id})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Enrollment.objects.filter(student=self.students[0]).delete()
+        entry = code_cache.lookup(code)
+        self.assertEqual(entry['student_ids'], {self.students[1].id})
+        self.assertFalse(code_cache.is_enrolled(entry, self.students[0]))
+
+
+class StudentGroupTests(TestCase):
+    """Student sockets join their personal group and only the course groups they ask for."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='groups.teacher', password='x', role='teacher')
+        cls.course = Course.objects.create(name='Groups Course', code='GROUPS1')
+        cls.course.teachers.add(cls.teacher)
+        cls.other_course = Course.objects.create(name='Other Groups Course', code='GROUPS2')
+        cls.session = ClassSession.objects.create(course=cls.course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        cls.students = [User.objects.create_user(username=f'groups{i}', password='x', role='student') for i in range(3)]
+        for student in cls.students:
+            Enrollment.objects.create(course=cls.course, student=student)
+
+    def test_validation_is_one_send_to_the_student(self):
+        record = AttendanceRecord.objects.create(class_session=self.session, student=self.students[0])
+        self.client.force_login(self.teacher)
+        with mock.patch.object(notifications.dispatcher, 'put') as put, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('validate_attendance'), {'attendance_record_id': record.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([call.args[0] for call in put.call_args_list], [notifications.user_group(self.students[0].id)])
+
+    def test_sends_reach_only_the_sockets_of_their_group(self):
+        # Not opted in, opted in to every course, opted in to a course the student is not enrolled in
+        queries = ['', '?courses=all', f'?courses={self.other_course.id}']
+        event = {'type': 'attendance_validated', 'id': 'event-1', 'message': 'Validated', 'context': {}}
+
+        async def receive():
+            application = URLRouter(websocket_urlpatterns)
+            communicators = []
+            for student, query in zip(self.students, queries):
+                communicator = WebsocketCommunicator(application, f'/ws/student/notifications/{query}')
+                communicator.scope['user'] = student
+                self.assertTrue((await communicator.connect())[0])
+                communicators.append(communicator)
+
+            received = []
+            for group_name in (notifications.user_group(self.students[0].id), notifications.course_group(self.course.id)):
+                await get_channel_layer().group_send(group_name, event)
+                received.append([not await communicator.receive_nothing() for communicator in communicators])
+                for communicator, got in zip(communicators, received[-1]):
+                    if got:
+                        await communicator.receive_from()
+            for communicator in communicators:
+                await communicator.disconnect()
+            return received
+
+        with mock.patch('attendance.consumers.ensure_schedule_events_started'):
+            personal, course = async_to_sync(receive)()
+        self.assertEqual(personal, [True, False, False])
+        self.assertEqual(course, [False, True, False])
+
+
+class NotificationDispatcherTests(TestCase):
+
+    class Layer:
+        """Records group sends; sends to 'held' wait for `release`, sends to 'broken' fail."""
+
+        def __init__(self):
+            self.sends = []
+            self.release = threading.Event()
+
+        async def group_send(self, group_name, message):
+            self.sends.append((group_name, message))
+            while group_name == 'held' and not self.release.is_set():
+                await asyncio.sleep(0.01)
+            if group_name == 'broken':
+                raise ConnectionError('Channel layer unavailable')
+
+    def event(self, number):
+        return {'type': 'student_submitted', 'id': f'event-{number}', 'message': str(number), 'context': {}}
+
+    def stop_sender(self, dispatcher):
+        def stop():
+            for task in asyncio.all_tasks(dispatcher._loop):
+                task.cancel()
+            dispatcher._loop.call_soon(dispatcher._loop.stop)
+        dispatcher._loop.call_soon_threadsafe(stop)
+
+    def test_batches_per_group_and_counts_drops_and_failures(self):
+        layer = self.Layer()
+        dispatcher = notifications.NotificationDispatcher(maxsize=4, late_after=0.2)
+        self.addCleanup(self.stop_sender, dispatcher)
+        with mock.patch('attendance.notifications.get_channel_layer', return_value=layer), self.assertLogs(notifications.logger):
+            self.assertTrue(dispatcher.put('held', self.event(0)))
+            while not layer.sends:
+                time.sleep(0.01)
+            # Queued while the sender is busy: one batch once it is free
+            results = [dispatcher.put(group_name, self.event(number)) for number, group_name in enumerate(
+                ['first', 'broken', 'first', 'broken', 'first'], start=1
+            )]
+            time.sleep(0.3)
+            layer.release.set()
+            self.assertTrue(dispatcher.wait_idle())
+            dispatcher.put('first', self.event(6))
+            self.assertTrue(dispatcher.wait_idle())
+
+        self.assertEqual(results, [True, True, True, True, False])
+        self.assertEqual(layer.sends, [
+            ('held', self.event(0)),
+            ('first', {'type': notifications.BATCH_TYPE, 'events': [self.event(1), self.event(3)]}),
+            ('broken', {'type': notifications.BATCH_TYPE, 'events': [self.event(2), self.event(4)]}),
+            ('first', self.event(6)),
+        ])
+        self.assertEqual(dispatcher.stats(), {
+            'queued': 6, 'sent': 4, 'dropped': 1, 'late': 3, 'failed': 2, 'batches': 3, 'group_sends': 4, 'pending': 0,
+        })
+
+    def test_messages_wait_for_the_transaction_to_commit(self):
+        with mock.patch.object(notifications.dispatcher, 'put') as put:
+            with self.captureOnCommitCallbacks() as callbacks:
+                notifications.send_group_notification('group', 'student_submitted', 'Submitted', {'id': 1})
+            put.assert_not_called()
+            for callback in callbacks:
+                callback()
+        (group_name, event), _ = put.call_args
+        self.assertEqual((group_name, event['type'], event['context']), ('group', 'student_submitted', {'id': 1}))
+
+
+class SubmissionFeedTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='feed.teacher', password='x', role='teacher')
+        cls.course = Course.objects.create(name='Feed Course', code='FEED1')
+        cls.course.teachers.add(cls.teacher)
+        cls.session = ClassSession.objects.create(course=cls.course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        cls.students = [User.objects.create_user(username=f'feed{i}', password='x', role='student') for i in range(3)]
+
+    def setUp(self):
+        self.client.force_login(self.teacher)
+
+    def submit(self, student):
+        with self.captureOnCommitCallbacks(execute=True):
+            return AttendanceRecord.objects.create(class_session=self.session, student=student)
+
+    def feed(self, etag=None, **params):
+        headers = {'If-None-Match': etag} if etag else {}
+        return self.client.get(reverse('get_session_submissions'), {'class_session_id': self.session.id, **params}, headers=headers)
+
+    def ids(self, response):
+        return sorted(int(row['id']) for row in response.json()['submissions'])
+
+    def test_etag_and_deltas(self):
+        first, second = self.submit(self.students[0]), self.submit(self.students[1])
+        response = self.feed()
+        version = response.json()['version']
+        self.assertEqual((response.json()['full'], self.ids(response)), (True, [first.id, second.id]))
+        self.assertEqual(response['ETag'], f'"{self.session.id}-{version}"')
+
+        # Unchanged: 304 without reading the records
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.feed(response['ETag'])
+        self.assertEqual((not_modified.status_code, not_modified['ETag']), (304, response['ETag']))
+        self.assertFalse([query for query in queries if 'attendance_attendancerecord' in query['sql']])
+
+        first.is_present = True
+        with self.captureOnCommitCallbacks(execute=True):
+            first.save()
+        third = self.submit(self.students[2])
+        delta = self.feed(since=version)
+        self.assertEqual((delta.json()['full'], self.ids(delta)), (False, [first.id, third.id]))
+        self.assertEqual(self.feed(since=delta.json()['version']).json()['submissions'], [])
+        self.assertEqual(self.feed(response['ETag']).status_code, 200)
+        self.assertEqual(self.feed(since='x').status_code, 400)
+
+    def test_deletes_reset_older_versions(self):
+        first, second = self.submit(self.students[0]), self.submit(self.students[1])
+        version = self.feed().json()['version']
+        second.delete()
+        response = self.feed(since=version)
+        self.assertEqual((response.json()['full'], self.ids(response)), (True, [first.id]))
+        # Versions from after the delete get deltas again
+        self.assertEqual(self.feed(since=response.json()['version']).json()['full'], False)
+
+
+class KpiCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = User.objects.create_user(username='kpi.teacher', password='x', role='teacher')
+        cls.other_teacher = User.objects.create_user(username='kpi.other', password='x', role='teacher')
+        cls.course = Course.objects.create(name='KPI Course', code='KPI1')
+        cls.course.teachers.add(cls.teacher)
+        cls.other_course = Course.objects.create(name='Other KPI Course', code='KPI2')
+        cls.other_course.teachers.add(cls.other_teacher)
+        cls.session = ClassSession.objects.create(course=cls.course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        cls.student = User.objects.create_user(username='kpi.student', password='x', role='student')
+
+    def setUp(self):
+        cache.clear()
+        kpi_cache.reset_stats()
+
+    def kpis(self, teacher=None):
+        kpis = kpi_cache.teacher_kpis(teacher or self.teacher)
+        return kpis['courses'], kpis['students'], kpis['pending_validations'], kpis['active_codes']
+
+    def change(self, function, *args, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            return function(*args, **kwargs)
+
+    def test_changes_to_a_course_refresh_its_teachers_only(self):
+        self.assertEqual(self.kpis(), (1, 0, 0, 0))
+        self.assertEqual(self.kpis(self.other_teacher), (1, 0, 0, 0))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.kpis(), (1, 0, 0, 0))
+
+        self.change(Enrollment.objects.create, course=self.course, student=self.student)
+        self.assertEqual(self.kpis(), (1, 1, 0, 0))
+        record = self.change(AttendanceRecord.objects.create, class_session=self.session, student=self.student)
+        self.assertEqual(self.kpis(), (1, 1, 1, 0))
+        record.is_present = True
+        self.change(record.save)
+        self.assertEqual(self.kpis(), (1, 1, 0, 0))
+        self.change(
+            AttendanceCode.objects.create, class_session=self.session, code='KPI001',
+            expires_at=timezone.now() + timedelta(minutes=10),
+        )
+        self.assertEqual(self.kpis(), (1, 1, 0, 1))
+
+        # The other teacher's entry was never made stale
+        with self.assertNumQueries(0):
+            self.assertEqual(self.kpis(self.other_teacher), (1, 0, 0, 0))
+        self.assertEqual(kpi_cache.stats()['misses'], 6)
+
+    def test_teaching_another_course_refreshes_the_teacher(self):
+        self.assertEqual(self.kpis()[0], 1)
+        self.change(self.other_course.teachers.add, self.teacher)
+        self.assertEqual(self.kpis()[0], 2)
+        # From the teacher's side of the relation
+        self.change(self.teacher.courses_taught.remove, self.other_course)
+        self.assertEqual(self.kpis()[0], 1)
+
+
+class GeofenceTests(TestCase):
+    campus = {'name': 'Campus', 'latitude': 41.5431, 'longitude': -8.4079, 'radius_m': 500}
+    square = {'name': 'Square', 'polygon': [[0, 0], [0, 1], [1, 1], [1, 0]]}
+
+    def test_haversine(self):
+        # One degree of latitude, and of longitude at the equator
+        self.assertAlmostEqual(float(geofence.haversine(0, 0, 1, 0)), 111195.1, delta=0.1)
+        self.assertAlmostEqual(float(geofence.haversine(0, 0, 0, 1)), 111195.1, delta=0.1)
+        # Broadcast over arrays; a degree of longitude at 60° is about half as long
+        distances = geofence.haversine(np.array([0, 60]), 0, np.array([0, 60]), 1)
+        np.testing.assert_allclose(distances, [111195.1, 111195.1 / 2], rtol=1e-4)
+
+    def test_point_and_polygon_campuses(self):
+        results = geofence.score_geolocations([
+            {'latitude': 41.5431, 'longitude': -8.4079},
+            {'latitude': 41.5531, 'longitude': -8.4079}, # 1112 m north of the centre
+            {'latitude': 0.5, 'longitude': 0.5},
+            {'latitude': 2, 'longitude': 1}, # one degree north of the square's corner
+            {'latitude': 'north', 'longitude': 1},
+            None,
+        ], [self.campus, self.square])
+
+        self.assertEqual(results[0], {'isFraudulent': False, 'fraudExplanation': "No issues detected.", 'distanceMeters': 0.0, 'campus': 'Campus'})
+        self.assertEqual((results[1]['isFraudulent'], results[1]['campus']), (True, 'Campus'))
+        self.assertAlmostEqual(results[1]['distanceMeters'], 1112.0 - 500, delta=1)
+        self.assertEqual((results[2]['isFraudulent'], results[2]['distanceMeters'], results[2]['campus']), (False, 0.0, 'Square'))
+        self.assertEqual((results[3]['isFraudulent'], results[3]['distanceMeters'], results[3]['campus']), (True, 111195.1, 'Square'))
+        self.assertEqual(results[4], {'isFraudulent': True, 'fraudExplanation': geofence.INCOMPLETE})
+        self.assertEqual(results[5], {'isFraudulent': True, 'fraudExplanation': geofence.MISSING})
+
+    def test_concave_polygons(self):
+        # An L shape: the notch at the top right is outside
+        shape = [[0, 0], [2, 0], [2, 1], [1, 1], [1, 2], [0, 2]]
+        inside = geofence.points_in_polygon(np.array([0.5, 1.5, 0.5, 1.5]), np.array([0.5, 0.5, 1.5, 1.5]), shape)
+        self.assertEqual(inside.tolist(), [True, True, True, False])
+
+    @override_settings(ATTENDANCE_CAMPUSES=[campus])
+    def test_bulk_scoring_saves_pending_records_only(self):
+        teacher = User.objects.create_user(username='geofence.teacher', password='x', role='teacher')
+        course = Course.objects.create(name='Geofence Course', code='GEO1')
+        course.teachers.add(teacher)
+        session = ClassSession.objects.create(course=course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        students = [User.objects.create_user(username=f'geofence{i}', password='x', role='student') for i in range(3)]
+        far = {'latitude': 41.6, 'longitude': -8.4079}
+        on_campus, away, validated = [
+            AttendanceRecord.objects.create(class_session=session, student=student, simulated_geolocation=geolocation, is_present=present)
+            for student, geolocation, present in zip(students, [self.campus, far, far], [False, False, True])
+        ]
+
+        self.client.force_login(teacher)
+        response = self.client.post(reverse('run_ai_validation_bulk'), {'date_from': '2030-01-07', 'date_to': '2030-01-07'})
+        self.assertEqual((response.json()['scored'], response.json()['flagged']), (2, 1))
+        self.assertEqual(AttendanceRecord.objects.get(id=away.id).ai_result['rules'], {'geofence': geofence.OUTSIDE})
+        self.assertEqual(AttendanceRecord.objects.get(id=on_campus.id).ai_result['isFraudulent'], False)
+        self.assertIsNone(AttendanceRecord.objects.get(id=validated.id).ai_result)
+
+        AttendanceRecord.objects.filter(id=away.id).update(simulated_geolocation=self.campus)
+        out = io.StringIO()
+        call_command('score_geofence', session=session.id, stdout=out)
+        self.assertIn('Scored 2 records', out.getvalue())
+        self.assertEqual(AttendanceRecord.objects.get(id=away.id).ai_result['isFraudulent'], False)
+
+
+class FraudRuleTests(TestCase):
+    campus = {'latitude': 41.5431, 'longitude': -8.4079}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(name='Fraud Course', code='FRAUD1')
+        cls.session = ClassSession.objects.create(course=cls.course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        cls.students = [User.objects.create_user(username=f'fraud{i}', password='x', role='student') for i in range(4)]
+
+    def record(self, student, ip='192.168.1.10', geolocation=campus, **fields):
+        return AttendanceRecord.objects.create(
+            class_session=self.session, student=student, simulated_ip=ip, simulated_geolocation=geolocation, **fields
+        )
+
+    def test_partial_pass_keeps_other_rules_findings(self):
+        flagged = {'isFraudulent': True, 'fraudExplanation': 'Shared.', 'rules': {'duplicate_ip': 'Shared.', 'geofence': 'Outside.'}}
+        record = self.record(self.students[0], ai_result=flagged)
+        results = fraud_rules.score_records(AttendanceRecord.objects.all(), [fraud_rules.GeofenceRule()])
+        # The geofence finding is gone (the record is on campus now), the duplicate IP one stays
+        self.assertEqual(results[record.id], {'isFraudulent': True, 'fraudExplanation': 'Shared.', 'rules': {'duplicate_ip': 'Shared.'}})
+        record.refresh_from_db()
+        self.assertEqual(record.ai_result, results[record.id])
+
+    def batch(self):
+        return fraud_rules.RecordBatch.from_queryset(AttendanceRecord.objects.order_by('student_id'))
+
+    def test_subnet(self):
+        for student, ip in zip(self.students, ['192.168.1.10', '10.0.0.1', '', 'not-an-ip']):
+            self.record(student, ip)
+        self.assertEqual(fraud_rules.SubnetRule().evaluate(self.batch()), [
+            None, "IP address is outside the classroom network.", "IP address missing.", "Invalid IP address.",
+        ])
+        self.assertEqual(fraud_rules.SubnetRule(['10.0.0.0/8']).evaluate(self.batch())[:2], [
+            "IP address is outside the classroom network.", None,
+        ])
+
+    def test_duplicate_ip(self):
+        for student, ip in zip(self.students, ['192.168.1.10', '192.168.1.10', '192.168.1.10', '192.168.1.11']):
+            self.record(student, ip)
+        shared = "IP address shared by 3 students in this class."
+        self.assertEqual(fraud_rules.DuplicateIPRule().evaluate(self.batch()), [shared, shared, shared, None])
+        self.assertEqual(fraud_rules.DuplicateIPRule(max_students=4).evaluate(self.batch()), [None] * 4)
+
+    def test_velocity(self):
+        start = timezone.make_aware(datetime(2030, 1, 7, 9))
+        far = {'latitude': 42.4431, 'longitude': -8.4079} # 100 km north of the campus
+
+        def row(record_id, student, minutes, geolocation):
+            return {
+                'id': record_id, 'student_id': student.id, 'class_session_id': self.session.id,
+                'timestamp': start + timedelta(minutes=minutes), 'simulated_ip': '', 'simulated_geolocation': geolocation,
+                'ai_result': None,
+            }
+
+        history = [
+            row(1, self.students[0], -10, far), # 600 km/h
+            row(2, self.students[1], -60, far), # 100 km/h
+            row(3, self.students[2], -13 * 60, far), # outside the 12 hour window
+        ]
+        rows = [row(record_id, student, 0, self.campus) for record_id, student in zip([4, 5, 6, 7], self.students)]
+        batch = fraud_rules.RecordBatch(rows, history=history)
+        self.assertEqual(fraud_rules.VelocityRule().evaluate(batch), [
+            "Moved at 600 km/h since the previous submission.", None, None, None,
+        ])
+        self.assertEqual(fraud_rules.VelocityRule(max_speed_kmh=50).evaluate(batch)[1], "Moved at 100 km/h since the previous submission.")
+
+    def test_full_pass_keeps_live_findings_only(self):
+        previous = {'isFraudulent': True, 'fraudExplanation': 'Outside. Shared phone.',
+                    'rules': {'geofence': 'Outside.', 'device_sharing': 'Shared phone.'}}
+        self.record(self.students[0], ai_result=previous)
+        result, = fraud_rules.FraudEngine([fraud_rules.SubnetRule()]).evaluate(self.batch())
+        self.assertEqual(result, {'isFraudulent': True, 'fraudExplanation': 'Shared phone.', 'rules': {'device_sharing': 'Shared phone.'}})
+
+    def test_results_are_cached_per_session_version(self):
+        cache.clear()
+        first = self.record(self.students[0], '192.168.1.10')
+        second = self.record(self.students[1], '192.168.1.10')
+        self.assertFalse(fraud_rules.record_result(first)['isFraudulent'])
+        # Served from the cache: only the session's feed version is read
+        with self.assertNumQueries(1):
+            self.assertFalse(fraud_rules.record_result(second)['isFraudulent'])
+
+        # A third student on the same IP changes the verdict of the earlier submissions
+        with self.captureOnCommitCallbacks(execute=True):
+            self.record(self.students[2], '192.168.1.10')
+        self.assertEqual(fraud_rules.record_result(first)['rules'], {
+            'duplicate_ip': "IP address shared by 3 students in this class.",
+        })
+
+
+class DeviceSharingTests(TestCase):
+    spot = {'latitude': 41.5431, 'longitude': -8.4079}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(name='Sharing Course', code='SHARE1')
+        cls.session = ClassSession.objects.create(course=cls.course, date=date(2030, 1, 7), start_time=dtime(9), end_time=dtime(11))
+        cls.students = [User.objects.create_user(username=f'sharing{i}', password='x', role='student') for i in range(5)]
+        cls.entry = {
+            'class_session_id': cls.session.id, 'course_id': cls.course.id, 'course_name': cls.course.name,
+            'date': cls.session.date,
+        }
+
+    def setUp(self):
+        device_sharing._indexes.clear()
+
+    def submit(self, student, ip='192.168.1.10', geolocation=spot):
+        """Like submit_attendance_code: insert, then observe, in one transaction."""
+        with self.captureOnCommitCallbacks(execute=True):
+            record_id, _ = submissions.insert_attendance_record(self.entry, student, ip, geolocation)
+            return record_id, device_sharing.observe(self.entry, record_id, student.id, ip, geolocation)
+
+    def test_third_student_on_one_device_flags_the_cluster(self):
+        with mock.patch('attendance.device_sharing.send_group_notification') as send:
+            first, _ = self.submit(self.students[0])
+            second, _ = self.submit(self.students[1])
+            # Same network, but a fix a few metres away: another phone
+            _, elsewhere = self.submit(self.students[2], geolocation={'latitude': 41.54312, 'longitude': -8.4079})
+            third, flagged = self.submit(self.students[3])
+            fourth, flagged_later = self.submit(self.students[4])
+
+        self.assertEqual(elsewhere, [])
+        self.assertEqual(sorted(flagged), [first, second, third])
+        self.assertEqual(flagged_later, [fourth])
+        self.assertEqual([call.kwargs['context']['students'] for call in send.call_args_list], [3, 4])
+        self.assertEqual(send.call_args.kwargs['group_name'], notifications.class_session_group(self.session.id))
+
+        explanation = "Same IP address and location used by 3 students in this class."
+        self.assertEqual(AttendanceRecord.objects.get(id=first).ai_result, {
+            'isFraudulent': True, 'fraudExplanation': explanation, 'rules': {'device_sharing': explanation},
+        })
+        self.assertEqual(AttendanceRecord.objects.filter(ai_result__isnull=False).count(), 4)
+        stat = DailyAttendanceStat.objects.get(course=self.course)
+        self.assertEqual((stat.submitted, stat.ai_validated, stat.ai_flagged), (5, 4, 4))
+
+    def test_index_is_loaded_once_per_session(self):
+        for student in self.students[:2]:
+            AttendanceRecord.objects.create(
+                class_session=self.session, student=student, simulated_ip='192.168.1.10', simulated_geolocation=self.spot
+            )
+        with mock.patch('attendance.device_sharing.send_group_notification'):
+            _, flagged = self.submit(self.students[2])
+        self.assertEqual(len(flagged), 3)
+
+        # Later submissions only touch the in-memory index
+        record_id, _ = submissions.insert_attendance_record(self.entry, self.students[3], '192.168.1.11')
+        with self.assertNumQueries(0):
+            self.assertEqual(device_sharing.observe(self.entry, record_id, self.students[3].id, '192.168.1.11', None), [])
+
+
+class ConsumerFrameTests(TestCase):
+    """Frames of merged (notification_batch) messages, plain and coalesced."""
+
+    events = [
+        {'type': 'student_submitted', 'id': 'event-1', 'message': 'Submitted', 'context': {'id': 1, 'name': 'Ana'}},
+        {'type': 'ai_result_updated_for_teacher', 'id': 'event-2', 'message': 'Validated', 'context': {'id': 1, 'is_present': True}},
+    ]
+
+    def test_group_messages_carry_no_serialized_copy(self):
+        with mock.patch.object(notifications.dispatcher, 'put') as put:
+            notifications.send_group_notification_nowait('group', 'student_submitted', 'Submitted', {'id': 1})
+        (_, event), _ = put.call_args
+        self.assertEqual(set(event), {'type', 'id', 'message', 'context'})
+
+    @override_settings(ATTENDANCE_SESSION_COALESCE_MS=50)
+    def test_batches_plain_and_coalesced(self):
+        async def receive():
+            application = URLRouter(websocket_urlpatterns)
+            plain = WebsocketCommunicator(application, '/ws/attendance/class_session_7/')
+            coalesced = WebsocketCommunicator(
+                application, '/ws/attendance/class_session_7/?coalesce=1', subprotocols=[frame_codecs.COMPACT]
+            )
+            for communicator in (plain, coalesced):
+                self.assertTrue((await communicator.connect())[0])
+            hello = await coalesced.receive_json_from()
+            await get_channel_layer().group_send(
+                notifications.class_session_group(7), {'type': notifications.BATCH_TYPE, 'events': self.events}
+            )
+            frames = [await plain.receive_json_from(), await plain.receive_json_from()], await coalesced.receive_json_from()
+            for communicator in (plain, coalesced):
+                self.assertTrue(await communicator.receive_nothing())
+                await communicator.disconnect()
+            return hello, frames
+
+        hello, (plain, coalesced) = async_to_sync(receive)()
+        self.assertEqual(hello[0], frame_codecs.HELLO_CODE)
+        self.assertEqual(plain, [
+            {'type': 'class_session_message', 'message': 'Submitted', 'context': {'type': 'student_submitted', 'id': 1, 'name': 'Ana'}},
+            {'type': 'class_session_message', 'message': 'Validated',
+             'context': {'type': 'ai_result_updated_for_teacher', 'id': 1, 'is_present': True}},
+        ])
+        # One frame for both events, each encoded from the message itself
+        self.assertEqual(coalesced, [frame_codecs.BATCH_CODE, [[2, 'Submitted', 1, 'Ana'], [3, 'Validated', 1, None, True]]])
+
+    def test_student_sockets_negotiate_frames(self):
+        student = mock.Mock(id=5, is_authenticated=True)
+        events = [
+            {'type': 'attendance_validated', 'id': 'event-3', 'message': 'Validated',
+             'context': {'class_name': 'Maths', 'status': 'present', 'record_id': '9', 'class_session_id': '7'}},
+            {'type': 'class_started', 'id': 'event-4', 'message': 'Started',
+             'context': {'id': 7, 'course_name': 'Maths', 'start_datetime': 'start', 'end_datetime': 'end'}},
+        ]
+
+        async def receive():
+            application = URLRouter(websocket_urlpatterns)
+            verbose = WebsocketCommunicator(application, '/ws/student/notifications/')
+            compact = WebsocketCommunicator(application, '/ws/student/notifications/', subprotocols=[frame_codecs.COMPACT])
+            for communicator in (verbose, compact):
+                communicator.scope['user'] = student
+                connected, subprotocol = await communicator.connect()
+                self.assertTrue(connected)
+            self.assertEqual(subprotocol, frame_codecs.COMPACT)
+            hello = await compact.receive_json_from()
+            await get_channel_layer().group_send(
+                notifications.user_group(5), {'type': notifications.BATCH_TYPE, 'events': events}
+            )
+            frames = [[await communicator.receive_json_from() for _ in events] for communicator in (verbose, compact)]
+            for communicator in (verbose, compact):
+                await communicator.disconnect()
+            return hello, frames
+
+        with mock.patch('attendance.consumers.ensure_schedule_events_started'):
+            hello, (verbose, compact) = async_to_sync(receive)()
+        self.assertIn(['class_started', ['id', 'course_name', 'start_datetime', 'end_datetime']], hello[2])
+        self.assertEqual([frame['type'] for frame in verbose], ['notification', 'notification'])
+        self.assertEqual(verbose[0]['context'], {'type': 'attendance_validated', **events[0]['context']})
+        # The class session id is not implied by a student socket
+        self.assertEqual(compact, [
+            [5, 'Validated', 'present', '9', None, 'Maths', {'class_session_id': '7'}],
+            [8, 'Started', 7, 'Maths', 'start', 'end'],
+        ])
+
+    @skipUnless(frame_codecs.msgpack, 'msgpack is not installed')
+    def test_binary_frames_from_clients_are_ignored(self):
+        async def exchange():
+            communicator = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), '/ws/attendance/class_session_7/', subprotocols=[frame_codecs.MSGPACK]
+            )
+            self.assertTrue((await communicator.connect())[0])
+            await communicator.receive_from() # hello
+            await communicator.send_to(bytes_data=b'\x81\xa7message\xa2hi')
+            await communicator.send_json_to({'message': 'Hello'})
+            relayed = await communicator.receive_from()
+            await communicator.disconnect()
+            return relayed
+
+        self.assertEqual(frame_codecs.msgpack.unpackb(async_to_sync(exchange)()), [1, 'Hello'])
+
+    def test_relayed_messages_keep_their_context(self):
+        event = {'type': 'class_session_message', 'message': 'Hello', 'context': {'type': 'note', 'class_session_id': '7'}}
+        verbose = json.loads(frame_codecs.negotiate([]).encode(event, 'class_session_message'))
+        compact = json.loads(frame_codecs.negotiate([frame_codecs.COMPACT]).encode(event, 'class_session_message'))
+        self.assertEqual(verbose['context'], event['context'])
+        self.assertEqual(compact, [1, 'Hello', event['context']])
+
+
+class RequestMetricsTests(TestCase):
+    """attendance.instrumentation: the middleware, its hooks and both outputs."""
+
+    def setUp(self):
+        instrumentation.reset()
+        self.addCleanup(instrumentation.reset)
+
+    def request(self, view, rate=1.0):
+        middleware = instrumentation.RequestMetricsMiddleware(view)
+        request = RequestFactory().get('/metrics-test/')
+        with override_settings(ATTENDANCE_METRICS_SAMPLE_RATE=rate):
+            return middleware(request)
+
+    def stats(self):
+        return instrumentation.snapshot()['views'][instrumentation.UNRESOLVED]
+
+    def test_sampled_requests_count_queries_and_duplicates(self):
+        def view(request):
+            User.objects.filter(username='a').exists()
+            User.objects.filter(username='b').exists() # Same statement, other literal
+            Course.objects.count()
+            return HttpResponse('ok')
+
+        self.request(view)
+        stats = self.stats()
+        self.assertEqual((stats['requests'], stats['sampled']), (1, 1))
+        self.assertEqual(stats['queries']['p50'], 3)
+        self.assertEqual(stats['response_bytes']['p50'], 2)
+        self.assertEqual(stats['duplicate_queries'], 1)
+        self.assertEqual([item['extra_executions'] for item in stats['top_duplicates']], [1])
+        self.assertIn('core_user', stats['top_duplicates'][0]['fingerprint'])
+
+    def test_unsampled_requests_only_record_timing(self):
+        def view(request):
+            Course.objects.count()
+            return HttpResponse('ok', status=503)
+
+        self.request(view, rate=0)
+        stats = self.stats()
+        self.assertEqual((stats['requests'], stats['sampled'], stats['server_errors']), (1, 0, 1))
+        self.assertIsNone(stats['queries']['p50'])
+        self.assertIsNotNone(stats['duration_ms']['p50'])
+
+    def test_nested_templates_are_timed_once(self):
+        inner = Template('{{ value }}')
+        outer = Template('[{% include inner %}]')
+
+        def view(request):
+            return HttpResponse(outer.render(Context({'inner': inner, 'value': 'x'})))
+
+        clock = iter(range(100))
+        with mock.patch.object(instrumentation.time, 'perf_counter', lambda: next(clock)):
+            response = self.request(view)
+        self.assertEqual(response.content, b'[x]')
+        # Middleware start (0), outer render start (1) and end (2), middleware end (3): the include adds nothing
+        self.assertEqual(self.stats()['template_ms']['p50'], 1000)
+        self.assertEqual(self.stats()['duration_ms']['p50'], 3000)
+
+    def test_percentile(self):
+        self.assertIsNone(instrumentation.percentile([], 0.5))
+        values = list(range(1, 11))
+        self.assertEqual([instrumentation.percentile(values, q) for q in (0.5, 0.95, 0.99)], [5, 10, 10])
+        self.assertEqual(instrumentation.percentile([7], 0.99), 7)
+
+    def test_prometheus_text(self):
+        instrumentation.registry.observe('a"view', 200, 0.5, 10)
+        instrumentation.registry.observe('a"view', 500, 1.5, None)
+        lines = instrumentation.prometheus_text().splitlines()
+        self.assertIn('# TYPE attendance_http_requests_total counter', lines)
+        self.assertIn('attendance_http_requests_total{view="a\\"view"} 2', lines)
+        self.assertIn('attendance_http_server_errors_total{view="a\\"view"} 1', lines)
+        self.assertIn('# TYPE attendance_http_request_duration_seconds summary', lines)
+        self.assertIn('attendance_http_request_duration_seconds{view="a\\"view",quantile="0.5"} 0.5', lines)
+        self.assertIn('attendance_http_request_duration_seconds_sum{view="a\\"view"} 2.0', lines)
+        self.assertIn('attendance_http_response_size_bytes_count{view="a\\"view"} 1', lines)
+        # Nothing sampled: quantiles are NaN
+        self.assertIn('attendance_http_request_queries{view="a\\"view",quantile="0.99"} NaN', lines)
+
+    def test_prometheus_endpoint_access(self):
+        url = reverse('request_metrics_prometheus')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer secret').status_code, 403) # No token set
+        with override_settings(ATTENDANCE_METRICS_TOKEN='secret'):
+            self.assertEqual(self.client.get(url).status_code, 403)
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+            response = self.client.get(url, HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.client.force_login(User.objects.create_user(username='metrics.staff', password='x', is_staff=True))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class SyntheticDataTests(TestCase):
+    as_of = timezone.make_aware(datetime(2030, 1, 16, 12))
+
+    def snapshot(self):
+        generate = lambda: synthetic_data.generate(students=20, courses=2, weeks=2, teachers=1, prefix='repro', as_of=self.as_of)
+        generate()
+        codes = dict(AttendanceCode.objects.filter(class_session__course__code__startswith='REPRO').values_list(
+            'code', 'class_session__date'
+        ))
+        records = sorted(AttendanceRecord.objects.filter(class_session__course__code__startswith='REPRO').values_list(
+            'student__username', 'class_session__course__code', 'class_session__date', 'class_session__start_time',
+            'is_present', 'simulated_ip', 'timestamp',
+        ))
+        synthetic_data.clear('repro')
+        return codes, records
+
+    def test_same_seed_and_date_give_the_same_data_set(self):
+        codes, records = self.snapshot()
+        self.assertTrue(codes and records)
+        # A code already in the database is redrawn without shifting anything else
+        clash = next(iter(codes))
+        course = Course.objects.create(name='Other Course', code='OTHER1')
+        session = ClassSession.objects.create(course=course, date=date(2030, 1, 1), start_time=dtime(9), end_time=dtime(10))
+        AttendanceCode.objects.create(class_session=session, code=clash, expires_at=self.as_of)
+
+        again, again_records = self.snapshot()
+        self.assertEqual(again_records, records)
+        self.assertNotIn(clash, again)
+        self.assertEqual(len(set(again) - set(codes)), 1)
+        self.assertEqual(sorted(again.values()), sorted(codes.values()))
+
+    def test_clear_only_removes_the_data_set(self):
+        synthetic_data.generate(students=5, courses=2, weeks=1, teachers=1, prefix='bench', as_of=self.as_of)
+        others = [
+            Course.objects.create(name='Benchmarking', code='BENCHMARKING101'),
+            Course.objects.create(name='Lowercase', code='bench-lower'),
+            Course.objects.create(name='Lowercase digits', code='bench00001'),
+        ]
+        outsider = User.objects.create_user(username='Bench.student0', password='x', role='student')
+        Enrollment.objects.create(student=outsider, course=others[0])
+
+        self.assertEqual(synthetic_data.clear('bench'), (6, 2))
+        self.assertEqual(Course.objects.filter(id__in=[course.id for course in others]).count(), 3)
+        self.assertTrue(Enrollment.objects.filter(student=outsider).exists())
+
+    def test_prefix_is_validated(self):
+        for prefix in ('', 'a.b', 'Bench', '1abc', 'p' * 16):
+            with self.assertRaises(ValueError):
+                synthetic_data.validate_prefix(prefix)
+        synthetic_data.validate_prefix('p' * 15)
+
+
+class ScheduleImportTests(TestCase):
+
+    data = {
+        'users': [
+            {'username': 'imp.teacher', 'role': 'teacher'},
+            {'username': 'imp.student0', 'first_name': 'Ana'},
+            {'username': 'imp.student1', 'first_name': 'Rui'},
+        ],
+        'courses': [{'code': 'IMP1', 'name': 'Imported Course'}],
+        'teachers': [{'course': 'IMP1', 'teacher': 'imp.teacher'}],
+        'enrollments': [
+            {'course': 'IMP1', 'student': 'imp.student0'},
+            {'course': 'IMP1', 'student': 'imp.student1'},
+        ],
+        'sessions': [{
+            'course': 'IMP1', 'weekdays': 'mon,wed', 'start_time': '09:00', 'end_time': '11:00',
+            'start_date': '2030-01-07', 'end_date': '2030-01-20', 'exclude': '2030-01-09',
+        }],
+    }
+
+    def test_validate_reports_every_invalid_row(self):
+        data = {
+            'users': [{'username': 'a', 'role': 'wizard'}, {'username': ''}, {'username': 'b'}, {'username': 'b'}],
+            'courses': [{'code': 'X'}],
+            'sessions': [{
+                'course': 'X', 'weekdays': 'mon', 'start_time': '11:00', 'end_time': '09:00',
+                'start_date': '2030-01-07', 'end_date': '2030-01-20',
+            }, {
+                'course': 'X', 'weekdays': 'someday', 'start_time': '09:00', 'end_time': '11:00',
+                'start_date': '2030-01-07', 'end_date': '2030-01-20',
+            }],
+        }
+        with self.assertRaises(schedule_import.ScheduleImportError) as raised:
+            schedule_import.import_schedule(data)
+        self.assertEqual(raised.exception.errors, [
+            ('users', 1, "Unknown role 'wizard'"),
+            ('users', 2, 'Missing username'),
+            ('users', 4, 'Duplicate row b'),
+            ('courses', 1, 'Missing name'),
+            ('sessions', 1, 'start_time must be before end_time'),
+            ('sessions', 2, "Unknown weekday 'som'"),
+        ])
+        self.assertFalse(User.objects.filter(username__in=['a', 'b']).exists())
+
+    def test_reimport_skips_existing_rows(self):
+        first = schedule_import.import_schedule(self.data)
+        self.assertEqual({table: counts['created'] for table, counts in first.tables.items()}, {
+            'users': 3, 'courses': 1, 'teachers': 1, 'enrollments': 2, 'sessions': 3,
+        })
+        second = schedule_import.import_schedule(self.data)
+        for table, counts in second.tables.items():
+            self.assertEqual(counts['created'], 0, table)
+            self.assertEqual(counts['existing'], first.tables[table]['created'], table)
+        self.assertEqual(ClassSession.objects.filter(course__code='IMP1').count(), 3)
+
+    def test_sessions_come_from_course_schedules(self):
+        Holiday.objects.create(date=date(2030, 1, 14), name='Holiday')
+        result = schedule_import.import_schedule(self.data)
+        self.assertEqual(result.schedules['created'], 2)
+        self.assertEqual(list(ClassSession.objects.filter(course__code='IMP1').values_list('date', flat=True)),
+                         [date(2030, 1, 7), date(2030, 1, 16)])
+        # Expanding the schedules afterwards keeps the imported sessions as they are
+        self.assertEqual(reconcile().changed, 0)
+
+    def test_each_course_is_reconciled_over_its_own_rules(self):
+        data = {
+            'courses': [{'code': 'IMP1', 'name': 'Imported Course'}, {'code': 'IMP2', 'name': 'Short Course'}],
+            'sessions': [{
+                'course': 'IMP1', 'weekdays': 'mon', 'start_time': '09:00', 'end_time': '11:00',
+                'start_date': '2030-01-07', 'end_date': '2030-06-30',
+            }, {
+                'course': 'IMP2', 'weekdays': 'tue', 'start_time': '09:00', 'end_time': '11:00',
+                'start_date': '2030-01-07', 'end_date': '2030-01-31',
+            }],
+        }
+        short = Course.objects.create(name='Short Course', code='IMP2')
+        makeup = ClassSession.objects.create(course=short, date=date(2030, 3, 5), start_time=dtime(14), end_time=dtime(15))
+        result = schedule_import.import_schedule(data)
+        self.assertEqual(result.reconciled.deleted, 0)
+        self.assertTrue(ClassSession.objects.filter(id=makeup.id).exists())
+        self.assertEqual(ClassSession.objects.filter(course=short).count(), 5) # 4 Tuesdays in January, plus the make-up
+
+    def test_caches_are_invalidated_after_commit(self):
+        with mock.patch.object(kpi_cache, 'invalidate_courses') as invalidate_courses:
+            with self.captureOnCommitCallbacks() as callbacks:
+                schedule_import.import_schedule(self.data)
+            invalidate_courses.assert_not_called()
+            for callback in callbacks:
+                callback()
+        invalidate_courses.assert_called_once()
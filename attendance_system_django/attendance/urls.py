@@ -24,9 +24,13 @@ urlpatterns = [
     
     # API Endpoints - Teacher
     path('api/generate-code/', views.generate_code_api_view, name='generate_code_api_view'),
+    path('api/generate-attendance-code/', views.generate_attendance_code, name='generate_attendance_code'),  # Legacy page's endpoint
     path('api/run-ai-validation/', views.run_ai_validation, name='run_ai_validation'),
+    path('api/run-ai-validation/bulk/', views.run_ai_validation_bulk, name='run_ai_validation_bulk'),
     path('api/validate-attendance/', views.validate_attendance, name='validate_attendance'),
+    path('api/validate-attendance/batch/', views.validate_attendance_batch, name='validate_attendance_batch'),
     path('api/get-session-submissions/', views.get_session_submissions, name='get_session_submissions'),
+    path('api/export/attendance/', views.export_attendance, name='export_attendance'),
     
     # API Endpoints - Student
     path('api/submit-attendance/', views.submit_attendance_code, name='submit_attendance_code'),
@@ -36,6 +40,10 @@ urlpatterns = [
     path('api/student/attendance-history/', views.api_student_attendance_history, name='api_student_attendance_history'),
     path('api/submit-justification/', views.submit_justification, name='submit_justification'),
 
+    # Request metrics (staff; the Prometheus endpoint also accepts ATTENDANCE_METRICS_TOKEN)
+    path('api/metrics/requests/', views.request_metrics, name='request_metrics'),
+    path('metrics/', views.request_metrics_prometheus, name='request_metrics_prometheus'),
+
     
     # Home page
     path('', views.home, name='home'),
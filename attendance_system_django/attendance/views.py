@@ -2,25 +2,36 @@
 import os
 import json
 import random
-import math
+import tempfile
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required, user_passes_test
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST, require_GET
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST, require_GET, conditional_page
+from django.views.decorators.cache import cache_control
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.utils import timezone
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
 from datetime import datetime, timedelta
 from django.urls import reverse
-from django.db.models import Count, Avg, Q, Case, When, IntegerField
+from django.db.models import Q, Exists, F, OuterRef
+from django.db import transaction
 from django.utils.timezone import localdate
+from django.utils.crypto import constant_time_compare
 import logging
 import string
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
 from core.models import User
 from courses.models import Course, ClassSession
-from attendance.models import AttendanceCode, AttendanceRecord, Enrollment, AbsenceJustification
+from attendance.models import AttendanceCode, AttendanceRecord, AbsenceJustification, DailyAttendanceStat
+from attendance import analytics
+from attendance.rollups import increment_daily_stats
+from attendance import code_cache, device_sharing, exports, fraud_rules, instrumentation, kpi_cache, submission_feed
+from attendance.submissions import insert_attendance_record
+from attendance.serializers import aattendance_records_json, asessions_json
+from attendance.notifications import class_session_group, course_group, send_group_notification, user_group
+from attendance.teacher_context import for_request as teacher_context_for
 
 
 # Import your models
@@ -30,19 +41,6 @@ from courses.models import Course, ClassSession
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
-# Helper function to send notification to a group
-def send_group_notification(group_name, message_type, message, context={}):
-    channel_layer = get_channel_layer()
-    if channel_layer:
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                'type': message_type,
-                'message': message,
-                'context': context,
-            }
-        )
-        
 # --- Role-based access decorators --- (Ensure these are in your views.py)
 def is_teacher(user):
     return user.is_authenticated and user.role == 'teacher'
@@ -113,78 +111,14 @@ def dashboard_view(request): # You might map this to your '/' or '/dashboard/' U
     context['known_valid_locations_json'] = json.dumps(known_valid_locations)
 
     if request.user.role == 'teacher':
-        today = localdate()
-        now_time = timezone.now().time()
-
-        teacher_class_sessions_today = ClassSession.objects.filter(
-            # Show ongoing/upcoming classes for today
-            Q(start_time__lte=now_time, end_time__gte=now_time) | Q(start_time__gt=now_time),
-            course__teachers=request.user,
-            date=today
-        ).order_by('start_time').select_related('course')
-
-        current_code_details = {'code_status': 'inactive', 'code': None, 'class_session_id': None, 'expires_at': None}
-        student_submissions_data = []
-        active_class_session_for_display = None
-
-        # Try to find an active code for today's sessions first
-        for session in teacher_class_sessions_today:
-            try:
-                code_obj = AttendanceCode.objects.get(class_session=session)
-                if code_obj.is_valid():
-                    active_class_session_for_display = session
-                    current_code_details = {
-                        'code': code_obj.code,
-                        'class_session_id': str(session.id),
-                        'expires_at': code_obj.expires_at.isoformat(),
-                        'code_status': 'active'
-                    }
-                    break # Found an active code, break loop
-            except AttendanceCode.DoesNotExist:
-                pass
-
-        # If no active code found, but there are sessions, default to the first
-        if not active_class_session_for_display and teacher_class_sessions_today.exists():
-            active_class_session_for_display = teacher_class_sessions_today.first()
-            try: # Check if there's an expired code for the default session
-                expired_code_obj = AttendanceCode.objects.get(class_session=active_class_session_for_display)
-                current_code_details = {
-                    'code': expired_code_obj.code,
-                    'class_session_id': str(expired_code_obj.class_session.id),
-                    'expires_at': expired_code_obj.expires_at.isoformat(),
-                    'code_status': 'expired'
-                }
-            except AttendanceCode.DoesNotExist:
-                # No code at all for the default session
-                current_code_details = {
-                    'code_status': 'inactive',
-                    'code': None,
-                    'class_session_id': str(active_class_session_for_display.id),
-                    'expires_at': None
-                }
-        
-        # Fetch initial submissions for the active session (if any)
-        if active_class_session_for_display:
-            submissions = AttendanceRecord.objects.filter(
-                class_session=active_class_session_for_display
-            ).select_related('student').order_by('timestamp')
-            
-            for sub in submissions:
-                ai_result_data = sub.ai_result # JSONField returns dict directly
-                student_submissions_data.append({
-                    'id': str(sub.id),
-                    'name': sub.student.get_full_name() or sub.student.username,
-                    'timestamp': sub.timestamp.isoformat(),
-                    'simulatedIp': sub.simulated_ip,
-                    'simulatedGeolocation': sub.simulated_geolocation,
-                    'aiResult': ai_result_data,
-                    'is_present': sub.is_present,
-                    'class_session_id': str(active_class_session_for_display.id), # Add this for JS reference
-                })
+        teacher_context = teacher_context_for(request)
+        # Show ongoing/upcoming classes for today
+        active_class_session_for_display, current_code_details = teacher_context.active_upcoming_session
+        student_submissions_data = teacher_context.submissions(active_class_session_for_display)
 
         context.update({
             'is_teacher_role': True, # Flag for template to show teacher content
-            'teacher_class_sessions_today': teacher_class_sessions_today,
+            'teacher_class_sessions_today': teacher_context.upcoming_sessions_today,
             'active_class_session_for_display': active_class_session_for_display,
             'initial_code_details_json': json.dumps(current_code_details), # Renamed for clarity
             'initial_student_submissions_json': json.dumps(student_submissions_data), # Renamed for clarity
@@ -234,23 +168,6 @@ def dashboard_view(request): # You might map this to your '/' or '/dashboard/' U
     return render(request, 'dashboard.html', context) 
 
 
-# Helper function to send notification to a group
-def send_group_notification(group_name, message_type, message, context={}):
-    """
-    Sends a message to a specific Channel Layer group.
-    The 'type' key in the message dict must match a method name in your consumer.
-    """
-    channel_layer = get_channel_layer()
-    if channel_layer:
-        async_to_sync(channel_layer.group_send)(
-            group_name,
-            {
-                'type': message_type, # This now dynamically sets the method name in consumer
-                'message': message,
-                'context': context,
-            }
-        )
-
 # --- Role-based access decorators ---
 def is_teacher(user):
     """Checks if the logged-in user is a teacher."""
@@ -264,6 +181,92 @@ def is_admin(user):
     """Checks if the logged-in user is an admin."""
     return user.is_authenticated and user.role == 'admin'
 
+async def ais_student(user):
+    """is_student for async views: avoids the thread-pool hop user_passes_test adds for sync checks."""
+    return user.is_authenticated and user.role == 'student'
+
+def is_staff(user):
+    """Checks if the logged-in user can use the admin site."""
+    return user.is_authenticated and user.is_staff
+
+
+# --- Request metrics (attendance/instrumentation.py) ---
+@login_required(login_url='/login/')
+@user_passes_test(is_staff, login_url='/login/')
+@require_GET
+def request_metrics(request):
+    """Per-view p50/p95/p99 of this process, plus the dashboard KPI cache counters."""
+    return JsonResponse({
+        **instrumentation.snapshot(),
+        'enabled': 'attendance.instrumentation.RequestMetricsMiddleware' in settings.MIDDLEWARE,
+        'kpi_cache': kpi_cache.stats(),
+    })
+
+
+@require_GET
+def request_metrics_prometheus(request):
+    """
+    The same metrics in the Prometheus text format. Scrapers authenticate with
+    'Authorization: Bearer <ATTENDANCE_METRICS_TOKEN>'; staff sessions work too.
+    """
+    token = getattr(settings, 'ATTENDANCE_METRICS_TOKEN', None)
+    scraper = token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}')
+    if not (scraper or is_staff(request.user)):
+        return HttpResponse('Forbidden\n', status=403, content_type='text/plain')
+    return HttpResponse(instrumentation.prometheus_text(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# --- Attendance Export ---
+@login_required(login_url='/login/')
+@require_GET
+def export_attendance(request):
+    """
+    Streams the student x session attendance matrix of one or more courses
+    ('course', repeated or comma-separated) between optional 'from' and 'to'
+    dates, as CSV (default) or XLSX ('format=xlsx').
+    Admins can export any course, teachers only the courses they teach.
+    """
+    user = request.user
+    if not (user.is_staff or user.role in ('admin', 'teacher')):
+        return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
+
+    course_ids = [value for param in request.GET.getlist('course') for value in param.split(',') if value]
+    try:
+        course_ids = [int(course_id) for course_id in course_ids]
+        date_from = datetime.strptime(request.GET['from'], '%Y-%m-%d').date() if request.GET.get('from') else None
+        date_to = datetime.strptime(request.GET['to'], '%Y-%m-%d').date() if request.GET.get('to') else None
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid course ID or date (YYYY-MM-DD).'}, status=400)
+    if not course_ids:
+        return JsonResponse({'status': 'error', 'message': 'At least one course is required.'}, status=400)
+
+    courses = Course.objects.filter(id__in=course_ids)
+    if user.role == 'teacher' and not user.is_staff:
+        courses = courses.filter(teachers=user)
+    if courses.count() != len(set(course_ids)):
+        return JsonResponse({'status': 'error', 'message': 'Course not found.'}, status=404)
+
+    export_format = request.GET.get('format', 'csv')
+    filename = f"attendance_{'_'.join(map(str, sorted(set(course_ids))))}"
+    rows = exports.attendance_matrix(course_ids, date_from, date_to)
+
+    if export_format == 'csv':
+        lines = exports.acsv_chunks(rows) if isinstance(request, ASGIRequest) else exports.csv_lines(rows)
+        response = StreamingHttpResponse(lines, content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.csv"'
+        return response
+    if export_format == 'xlsx':
+        # The workbook is assembled on disk, then streamed from the file
+        spool = tempfile.TemporaryFile()
+        exports.write_xlsx(rows, spool)
+        spool.seek(0)
+        return FileResponse(
+            spool, as_attachment=True, filename=f'{filename}.xlsx',
+            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        )
+    return JsonResponse({'status': 'error', 'message': 'Format must be csv or xlsx.'}, status=400)
+
+
 # --- Teacher Views / Analytics View ---
 @login_required(login_url='/login/')
 @user_passes_test(is_teacher, login_url='/login/')
@@ -278,20 +281,22 @@ def teacher_analytics(request):
     start_date = end_date - timedelta(days=period_days)
     
     # Get teacher's courses
-    teacher_courses = Course.objects.filter(teachers=request.user)
+    teacher_courses = list(Course.objects.filter(teachers=request.user).order_by('id'))
     
     # Get class sessions in the period
     class_sessions = ClassSession.objects.filter(
         course__in=teacher_courses,
         date__range=[start_date, end_date]
-    ).select_related('course')
+    )
     
     # Get attendance records
     attendance_records = AttendanceRecord.objects.filter(
         class_session__in=class_sessions
-    ).select_related('student', 'class_session__course')
+    )
     
     # === DATABASE CALCULATIONS ===
+    # Every breakdown below is one grouped query (see attendance/analytics.py),
+    # so the number of queries does not grow with weeks, courses or students.
     
     # Global statistics
     total_students = User.objects.filter(
@@ -302,147 +307,93 @@ def teacher_analytics(request):
     total_classes = class_sessions.count()
     total_codes = AttendanceCode.objects.filter(class_session__in=class_sessions).count()
     
+    # Per-course daily rollups for the period (see attendance/rollups.py)
+    daily_stats = DailyAttendanceStat.objects.filter(
+        course__in=teacher_courses,
+        date__range=[start_date, end_date]
+    )
+    summary = analytics.summarize_daily_stats(daily_stats)
+    totals = summary['totals']
+    
     # Calculate attendance rate
-    total_submissions = attendance_records.count()
-    present_submissions = attendance_records.filter(is_present=True).count()
-    global_attendance_rate = round((present_submissions / total_submissions * 100), 1) if total_submissions > 0 else 0
+    total_submissions = totals['total']
+    present_submissions = totals['present']
+    global_attendance_rate = analytics.attendance_rate(present_submissions, total_submissions)
     
     # === WEEKLY ATTENDANCE TREND ===
     weekly_trend = []
     weekly_labels = []
+    by_week = summary['by_week']
     
     for i in range(7, -1, -1):  # Last 8 weeks
         week_start = end_date - timedelta(days=end_date.weekday() + 7*i)
-        week_end = week_start + timedelta(days=6)
-        
-        week_sessions = class_sessions.filter(date__range=[week_start, week_end])
-        week_records = attendance_records.filter(class_session__in=week_sessions)
-        week_present = week_records.filter(is_present=True).count()
-        week_total = week_records.count()
-        
-        week_rate = round((week_present / week_total * 100), 1) if week_total > 0 else 0
-        weekly_trend.append(week_rate)
+        week_present, week_total = by_week.get(week_start, (0, 0))
+        weekly_trend.append(analytics.attendance_rate(week_present, week_total))
         weekly_labels.append(f'Sem {8-i}')
     
     # === COURSE PERFORMANCE  ===
     course_performance = []
     course_labels = []
+    by_course = summary['by_course']
     
     for course in teacher_courses:
-        course_sessions = class_sessions.filter(course=course)
-        course_records = attendance_records.filter(class_session__in=course_sessions)
-        course_present = course_records.filter(is_present=True).count()
-        course_total = course_records.count()
-        
-        course_rate = round((course_present / course_total * 100), 1) if course_total > 0 else 0
-        course_performance.append(course_rate)
+        course_present, course_total = by_course.get(course.id, (0, 0))
+        course_performance.append(analytics.attendance_rate(course_present, course_total))
         course_labels.append(course.name[:25])  # Truncate for display
     
     # === WEEKLY DISTRIBUTION BY DAY ===
     weekly_distribution = []
     weekly_dist_labels = ['Segunda', 'Terça', 'Quarta', 'Quinta', 'Sexta']
+    by_weekday = summary['by_weekday']
     
     # Django week_day: 1=Sunday, 2=Monday, ..., 6=Friday, 7=Saturday
     for day_num in range(2, 7):  # Monday=2 to Friday=6
-        day_sessions = class_sessions.filter(date__week_day=day_num)
-        day_records = attendance_records.filter(class_session__in=day_sessions)
-        day_present = day_records.filter(is_present=True).count()
-        day_total = day_records.count()
-        
-        day_rate = round((day_present / day_total * 100), 1) if day_total > 0 else 0
-        weekly_distribution.append(day_rate)
+        day_present, day_total = by_weekday.get(day_num, (0, 0))
+        weekly_distribution.append(analytics.attendance_rate(day_present, day_total))
     
     # === TIME DISTRIBUTION  ===
     # Count actual sessions by time periods
-    morning_sessions = class_sessions.filter(start_time__lt='12:00').count()
-    afternoon_sessions = class_sessions.filter(
-        start_time__gte='12:00', 
-        start_time__lt='18:00'
-    ).count()
-    evening_sessions = class_sessions.filter(start_time__gte='18:00').count()
-    
-    time_distribution = [morning_sessions, afternoon_sessions, evening_sessions]
+    slots = analytics.time_slot_distribution(class_sessions)
+    time_distribution = [slots['morning'], slots['afternoon'], slots['evening']]
     time_labels = ['Manhã (9h-12h)', 'Tarde (12h-18h)', 'Noite (18h+)']
     
     # === ATTENDANCE STATUS DISTRIBUTION ===
-    present_count = attendance_records.filter(is_present=True).count()
-    pending_count = attendance_records.filter(is_present=False).count()
+    present_count = present_submissions
+    pending_count = total_submissions - present_submissions
     
-    # Check if you have AbsenceJustification model for real justified absences
-    try:
-        from .models import AbsenceJustification
-        justified_count = AbsenceJustification.objects.filter(
-            class_session__in=class_sessions,
-            status='approved'
-        ).count()
-        
-        # Calculate late arrivals from justifications
-        late_count = AbsenceJustification.objects.filter(
-            class_session__in=class_sessions,
-            justification_type='late_arrival'
-        ).count()
-        
-        # Adjust pending count to exclude justified absences
-        unjustified_count = max(0, pending_count - justified_count - late_count)
-        
-        attendance_status = [present_count, justified_count, unjustified_count, late_count]
-        status_labels = ['Presente', 'Falta Justificada', 'Falta Injustificada', 'Chegada Tardia']
-    except (ImportError, AttributeError):
-        # Fallback if AbsenceJustification doesn't exist
-        attendance_status = [present_count, pending_count]
-        status_labels = ['Presente', 'Pendente/Ausente']
+    justified_count = totals['justified']
+    late_count = totals['late']
     
-    # === TOP PERFORMING STUDENTS ===
-    top_students = []
+    # Adjust pending count to exclude justified absences
+    unjustified_count = max(0, pending_count - justified_count - late_count)
     
-    # Get all students enrolled in teacher's courses
-    enrolled_students = User.objects.filter(
-        role='student',
-        student_enrollments__course__in=teacher_courses
-    ).distinct()
+    attendance_status = [present_count, justified_count, unjustified_count, late_count]
+    status_labels = ['Presente', 'Falta Justificada', 'Falta Injustificada', 'Chegada Tardia']
     
-    for student in enrolled_students:
-        student_records = attendance_records.filter(student=student)
-        student_present = student_records.filter(is_present=True).count()
-        student_total = student_records.count()
-        
-        if student_total > 0:  # Only include students with attendance records
-            student_rate = round((student_present / student_total * 100), 1)
-            top_students.append({
-                'name': student.get_full_name() or student.username,
-                'rate': student_rate,
-                'classes': student_total
-            })
+    # === TOP PERFORMING STUDENTS ===
+    # Only students with attendance records appear in the breakdown
+    top_students = [{
+        'name': student['name'],
+        'rate': analytics.attendance_rate(student['present'], student['total']),
+        'classes': student['total'],
+    } for student in analytics.student_breakdown(attendance_records)]
     
     # Sort by rate and get top 10 (or all if less than 10)
     top_students = sorted(top_students, key=lambda x: x['rate'], reverse=True)[:10]
     
     # === COURSE STATISTICS ===
     course_stats = []
+    students_by_course = analytics.students_per_course(teacher_courses)
+    sessions_by_course = analytics.sessions_per_course(class_sessions)
     
     for course in teacher_courses:
-        # Count students enrolled in this specific course
-        course_students = User.objects.filter(
-            role='student',
-            student_enrollments__course=course
-        ).distinct().count()
-        
-        # Count sessions for this course in the period
-        course_sessions_count = class_sessions.filter(course=course).count()
-        
-        # Get attendance records for this course
-        course_records = attendance_records.filter(class_session__course=course)
-        course_present = course_records.filter(is_present=True).count()
-        course_total = course_records.count()
-        
-        # Calculate average attendance rate
-        avg_rate = round((course_present / course_total * 100), 1) if course_total > 0 else 0
+        course_present, course_total = by_course.get(course.id, (0, 0))
         
         course_stats.append({
             'name': course.name,
-            'students': course_students,
-            'avg_rate': avg_rate,
-            'total_classes': course_sessions_count,
+            'students': students_by_course.get(course.id, 0),
+            'avg_rate': analytics.attendance_rate(course_present, course_total),
+            'total_classes': sessions_by_course.get(course.id, 0),
             'total_submissions': course_total,
             'present_submissions': course_present
         })
@@ -451,14 +402,11 @@ def teacher_analytics(request):
     prev_start_date = start_date - timedelta(days=period_days)
     prev_end_date = start_date
     
-    prev_sessions = ClassSession.objects.filter(
+    prev_totals = analytics.summarize_daily_stats(DailyAttendanceStat.objects.filter(
         course__in=teacher_courses,
         date__range=[prev_start_date, prev_end_date]
-    )
-    prev_records = AttendanceRecord.objects.filter(class_session__in=prev_sessions)
-    prev_present = prev_records.filter(is_present=True).count()
-    prev_total = prev_records.count()
-    prev_rate = round((prev_present / prev_total * 100), 1) if prev_total > 0 else 0
+    ))['totals']
+    prev_rate = analytics.attendance_rate(prev_totals['present'], prev_totals['total'])
     
     rate_change = round(global_attendance_rate - prev_rate, 1)
     
@@ -471,13 +419,11 @@ def teacher_analytics(request):
     avg_students_per_class = round((total_submissions / total_classes), 1) if total_classes > 0 else 0
     
     # AI validation statistics (if ai_result field is used)
-    ai_validated_records = attendance_records.exclude(ai_result__isnull=True).count()
-    ai_flagged_records = attendance_records.filter(
-        ai_result__icontains='"isFraudulent": true'
-    ).count()
+    ai_validated_records = totals['ai_validated']
+    ai_flagged_records = totals['ai_flagged']
     
     # Calculate AI suspicion rate in the view instead of template
-    ai_suspicion_rate = round((ai_flagged_records / ai_validated_records * 100), 1) if ai_validated_records > 0 else 0
+    ai_suspicion_rate = analytics.attendance_rate(ai_flagged_records, ai_validated_records)
     
     # === CONTEXT FOR TEMPLATE ===
     context = {
@@ -518,7 +464,7 @@ def teacher_analytics(request):
         'course_stats': course_stats,
         
         # Additional metrics 
-        'courses_count': teacher_courses.count(),
+        'courses_count': len(teacher_courses),
         'codes_per_session': codes_per_session,
         'avg_students_per_class': avg_students_per_class,
         'ai_validated_records': ai_validated_records,
@@ -608,94 +554,30 @@ def teacher_generate_code_page(request): # Renamed for clarity, original name ca
     It pre-loads any currently active or recently expired code for the teacher's
     classes today.
     """
-    today = timezone.localdate() # Use Django's timezone-aware localdate
-    current_code_details = {'code_status': 'inactive', 'code': None, 'class_session_id': None, 'expires_at': None}
-
-    # Ensure request.user is linked to a Teacher profile if your is_teacher decorator expects it
-    # For example, if User has a OneToOneField to Teacher:
-    # teacher_profile = request.user.teacher_profile # adjust as per your model setup
-
-    class_sessions_today = ClassSession.objects.filter(
-        course__teachers=request.user, # Assuming 'teachers' is a ManyToMany or ForeignKey on Course
-        date=today
-    ).order_by('start_time').select_related('course')
-
-    active_class_session_for_display = None # To set the initial selected option in dropdown
-
-    # Try to find an active code for today's sessions first
-    for session in class_sessions_today:
-        try:
-            # Check if there's an active code for this specific session
-            code_obj = AttendanceCode.objects.get(class_session=session)
-            if code_obj.is_valid(): # Assumes you have an is_valid method on AttendanceCode
-                current_code_details = {
-                    'code': code_obj.code,
-                    'class_session_id': str(session.id),
-                    'expires_at': code_obj.expires_at.isoformat(),
-                    'code_status': 'active'
-                }
-                active_class_session_for_display = session
-                break # Found an active code, no need to check others
-        except AttendanceCode.DoesNotExist:
-            pass # No code for this specific session
-
-    # If no active code was found, but there are sessions, default to the first session
-    if not active_class_session_for_display and class_sessions_today.exists():
-        active_class_session_for_display = class_sessions_today.first()
-        current_code_details['class_session_id'] = str(active_class_session_for_display.id)
-        # Note: current_code_details will still have code and expires_at as None unless set by an existing code
-
-    # Calculate dashboard metrics
-    total_students_enrolled = 0
-    total_courses_taught = 0
-    pending_validations = 0
-    active_codes_count = 0
-    
-    # Get courses taught by this teacher
-    teacher_courses = Course.objects.filter(teachers=request.user)
-    total_courses_taught = teacher_courses.count()
-    
-    # Get total students enrolled in teacher's courses
-    total_students_enrolled = User.objects.filter(
-        role='student',
-        student_enrollments__course__in=teacher_courses
-    ).distinct().count()
-    
-    # Count pending validations (attendance records not marked as present)
-    pending_validations = AttendanceRecord.objects.filter(
-        class_session__course__teachers=request.user,
-        is_present=False
-    ).count()
-    
-    # Count active codes
-    active_codes_count = AttendanceCode.objects.filter(
-        class_session__course__teachers=request.user,
-        expires_at__gt=timezone.now(),
-        is_active=True
-    ).count()
-
-    # (You might need to fetch initial student submissions for the active session here as well)
-    initial_student_submissions = [] # Populate this based on active_class_session_for_display if needed
+    teacher_context = teacher_context_for(request)
+    # To set the initial selected option in dropdown
+    active_class_session_for_display, current_code_details = teacher_context.active_session
+    initial_student_submissions = teacher_context.submissions(active_class_session_for_display)
 
     context = {
-        'teacher_class_sessions_today': class_sessions_today,
+        'teacher_class_sessions_today': teacher_context.sessions_today,
         'initial_code_details': json.dumps(current_code_details),
         'active_class_session_for_display': active_class_session_for_display,
         'active_class_session_id': str(active_class_session_for_display.id) if active_class_session_for_display else '',
-        'initial_student_submissions_parsed': initial_student_submissions, # Ensure this is properly formatted for JS
+        'initial_student_submissions_parsed': initial_student_submissions,
         # Dashboard metrics
-        'total_students_enrolled': total_students_enrolled,
-        'total_courses_taught': total_courses_taught,
-        'current_day_sessions': class_sessions_today.count(), # Count of today's sessions
-        'pending_validations': pending_validations,
-        'active_codes_count': active_codes_count,  # Add this
+        **teacher_context.metrics(),
         'total_present_attendance': 0, # Placeholder for chart
         'total_pending_attendance': 0, # Placeholder for chart
         'course_names_for_chart': json.dumps([]), # Placeholder for chart
         'submissions_per_course_for_chart': json.dumps([]), # Placeholder for chart
+        # For the template compatibility
+        'initial_code_details_json': json.dumps(current_code_details),
+        'initial_student_submissions_json': json.dumps(initial_student_submissions),
+        'active_class_session_id_initial': str(active_class_session_for_display.id) if active_class_session_for_display else "",
     }
 
-    return render(request, 'teacher_dashboard.html', context)
+    return render(request, 'teacher/teacher_dashboard.html', context)
 
 
 # --- Generate Code API ---
@@ -710,7 +592,7 @@ def generate_code_api_view(request):
         return JsonResponse({'status': 'error', 'message': 'ID da sessão de turma não fornecido.'}, status=400)
 
     try:
-        class_session = get_object_or_404(ClassSession, id=class_session_id, course__teachers=request.user)
+        class_session = get_object_or_404(ClassSession.objects.select_related('course'), id=class_session_id, course__teachers=request.user)
     except Exception:
         return JsonResponse({'status': 'error', 'message': 'Sessão de turma não encontrada ou não pertence ao professor.'}, status=404)
 
@@ -730,6 +612,18 @@ def generate_code_api_view(request):
             }
         )
 
+        # Let the course's students (those who opted in) know a code is open; the code itself is not sent
+        send_group_notification(
+            group_name=course_group(class_session.course_id),
+            message_type='attendance_code_opened',
+            message=f'Código de presença disponível para {class_session.course.name}.',
+            context={
+                'class_name': class_session.course.name,
+                'class_session_id': str(class_session.id),
+                'expires_at': attendance_code.expires_at.isoformat(),
+            }
+        )
+
         return JsonResponse({
             'status': 'success',
             'message': 'Código gerado com sucesso!',
@@ -774,6 +668,8 @@ def generate_attendance_code(request):
     # Invalidate any existing attendance code for this specific session
     # This ensures only one code is active per session at any time
     AttendanceCode.objects.filter(class_session=target_class_session, expires_at__gte=timezone.now()).update(expires_at=timezone.now() - timedelta(minutes=1))
+    # update() skips the AttendanceCode signals, so drop the cached entry here
+    code_cache.invalidate_session(target_class_session.id)
 
     # Generate a new random code (Example: 6 characters alphanumeric)
     import secrets
@@ -796,7 +692,7 @@ def generate_attendance_code(request):
     # Send a real-time notification to the class session group (for Teacher Dashboard)
     # The dashboard's WebSocket listens to this group for its real-time updates.
     send_group_notification(
-        group_name=f'class_session_{target_class_session.id}_notifications', # Target the class session group
+        group_name=class_session_group(target_class_session.id), # Target the class session group
         message_type='code_generated_for_teacher', # Specific message type for frontend
         message=f"New code '{new_code_obj.code}' generated for {target_class_session.course.name}!",
         context={
@@ -823,118 +719,17 @@ def teacher_dashboard(request):
     Fetches all ongoing/upcoming classes for the teacher today,
     and initial data for the most relevant class session.
     """
-    today = localdate()
-    now_time = timezone.now().time()
-
-    # Get all today's sessions for the teacher
-    teacher_class_sessions_today = ClassSession.objects.filter(
-        course__teachers=request.user,
-        date=today
-    ).order_by('start_time').select_related('course')
-
-    current_code_details = {'code_status': 'inactive', 'code': None, 'class_session_id': None, 'expires_at': None}
-    student_submissions_data = []
-    active_class_session_for_display = None
-
-    # Try to find an active code for today's sessions first
-    for session in teacher_class_sessions_today:
-        try:
-            code_obj = AttendanceCode.objects.get(class_session=session)
-            if code_obj.is_valid():
-                active_class_session_for_display = session
-                current_code_details = {
-                    'code': code_obj.code,
-                    'class_session_id': str(session.id),
-                    'expires_at': code_obj.expires_at.isoformat(),
-                    'code_status': 'active'
-                }
-                break
-        except AttendanceCode.DoesNotExist:
-            pass
-
-    # If no active code found, but there are sessions, default to the first
-    if not active_class_session_for_display and teacher_class_sessions_today.exists():
-        active_class_session_for_display = teacher_class_sessions_today.first()
-        try:
-            expired_code_obj = AttendanceCode.objects.get(class_session=active_class_session_for_display)
-            current_code_details = {
-                'code': expired_code_obj.code,
-                'class_session_id': str(expired_code_obj.class_session.id),
-                'expires_at': expired_code_obj.expires_at.isoformat(),
-                'code_status': 'expired'
-            }
-        except AttendanceCode.DoesNotExist:
-            current_code_details = {
-                'code_status': 'inactive',
-                'code': None,
-                'class_session_id': str(active_class_session_for_display.id),
-                'expires_at': None
-            }
-
-    # Get submissions for the active session
-    if active_class_session_for_display:
-        submissions = AttendanceRecord.objects.filter(
-            class_session=active_class_session_for_display
-        ).select_related('student').order_by('timestamp')
-        
-        for sub in submissions:
-            ai_result_data = sub.ai_result  # JSONField returns dict directly
-            
-            student_submissions_data.append({
-                'id': str(sub.id),
-                'name': sub.student.get_full_name() or sub.student.username,
-                'timestamp': sub.timestamp.isoformat(),
-                'simulatedIp': sub.simulated_ip,
-                'simulatedGeolocation': sub.simulated_geolocation,
-                'aiResult': ai_result_data,
-                'is_present': sub.is_present,
-                'class_session_id': str(active_class_session_for_display.id),
-            })
-
-    # FIXED: Calculate proper dashboard metrics
-    teacher_courses = Course.objects.filter(teachers=request.user)
-    
-    # Total students enrolled in teacher's courses
-    total_students_enrolled = User.objects.filter(
-        role='student',
-        student_enrollments__course__in=teacher_courses
-    ).distinct().count()
-    
-    # Total courses taught
-    total_courses_taught = teacher_courses.count()
-    
-    # Today's sessions count
-    current_day_sessions = teacher_class_sessions_today.count()
-    
-    # Pending validations (attendance records not marked as present)
-    pending_validations = AttendanceRecord.objects.filter(
-        class_session__course__teachers=request.user,
-        is_present=False
-    ).count()
-    
-    # Active codes count
-    active_codes_count = AttendanceCode.objects.filter(
-        class_session__course__teachers=request.user,
-        expires_at__gt=timezone.now(),
-        is_active=True
-    ).count()
-
-    # Known valid locations (hardcoded for now, can come from model/settings in production)
-    known_valid_locations = [
-        {"latitude": 41.5369, "longitude": -8.4239}, # Example coordinates for CESAE Digital (Braga)
-    ]
+    teacher_context = teacher_context_for(request)
+    active_class_session_for_display, current_code_details = teacher_context.active_session
+    student_submissions_data = teacher_context.submissions(active_class_session_for_display)
 
     context = {
-        'teacher_class_sessions_today': teacher_class_sessions_today,
+        'teacher_class_sessions_today': teacher_context.sessions_today,
         'active_class_session_for_display': active_class_session_for_display,
         'initial_code_details': json.dumps(current_code_details),
         'initial_student_submissions': json.dumps(student_submissions_data),
         'active_class_session_id': str(active_class_session_for_display.id) if active_class_session_for_display else None,
-        'total_students_enrolled': total_students_enrolled,
-        'total_courses_taught': total_courses_taught,
-        'current_day_sessions': current_day_sessions,
-        'pending_validations': pending_validations,
-        'active_codes_count': active_codes_count,
+        **teacher_context.metrics(),
         # For the template compatibility
         'initial_code_details_json': json.dumps(current_code_details),
         'initial_student_submissions_json': json.dumps(student_submissions_data),
@@ -948,7 +743,7 @@ def teacher_dashboard(request):
 @user_passes_test(is_teacher, login_url='/login/')
 @require_POST
 def run_ai_validation(request):
-    """API endpoint for teachers to trigger AI validation"""
+    """API endpoint for teachers to trigger AI validation (see attendance/fraud_rules.py)"""
     attendance_record_id = request.POST.get('attendance_record_id')
     class_session_id = request.POST.get('class_session_id')
 
@@ -962,51 +757,55 @@ def run_ai_validation(request):
     except AttendanceRecord.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Attendance record not found.'}, status=404)
 
-    # Simulate AI Logic
-    is_fraudulent = False
-    fraud_explanation = "No issues detected."
-
-    if random.random() < 0.2:  # 20% chance of fraud
-        is_fraudulent = True
-        fraud_explanation = random.choice([
-            "Unusual activity pattern detected.",
-            "Potential VPN usage identified.",
-            "High velocity movement detected."
-        ])
-
-    # Geolocation check
-    if record.simulated_geolocation:
-        sim_lat = record.simulated_geolocation.get('latitude')
-        sim_lon = record.simulated_geolocation.get('longitude')
-        
-        cesae_lat = 41.5431
-        cesae_lon = -8.4079
+    # The rules run over the whole session once; later clicks are served from the cache
+    ai_result_dict = fraud_rules.record_result(record)
 
-        if sim_lat is not None and sim_lon is not None:
-            lat_diff = abs(sim_lat - cesae_lat) * 111
-            lon_diff = abs(sim_lon - cesae_lon) * 111 * abs(math.cos(math.radians(cesae_lat)))
+    return JsonResponse({
+        'status': 'success',
+        'aiResult': ai_result_dict,
+        'attendance_record_id': str(record.id)
+    })
 
-            if lat_diff > 0.5 or lon_diff > 0.5:
-                is_fraudulent = True
-                fraud_explanation = "Geolocation is outside the expected classroom area."
-        else:
-            is_fraudulent = True
-            fraud_explanation = "Incomplete geolocation data provided."
+
+@login_required(login_url='/login/')
+@user_passes_test(is_teacher, login_url='/login/')
+@require_POST
+def run_ai_validation_bulk(request):
+    """
+    API endpoint for teachers to geofence-score every pending record of a
+    'class_session_id', or of their sessions between 'date_from' and 'date_to'
+    (YYYY-MM-DD, inclusive), in one pass.
+    """
+    class_session_id = request.POST.get('class_session_id')
+    date_from = request.POST.get('date_from')
+    date_to = request.POST.get('date_to')
+
+    records = AttendanceRecord.objects.filter(class_session__course__teachers=request.user)
+    if class_session_id:
+        try:
+            class_session_id = int(class_session_id)
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid class session ID.'}, status=400)
+        if not ClassSession.objects.filter(id=class_session_id, course__teachers=request.user).exists():
+            return JsonResponse({'status': 'error', 'message': 'Class session not found.'}, status=404)
+        records = records.filter(class_session_id=class_session_id)
+    elif date_from and date_to:
+        try:
+            date_from = datetime.strptime(date_from, '%Y-%m-%d').date()
+            date_to = datetime.strptime(date_to, '%Y-%m-%d').date()
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Dates must be in YYYY-MM-DD format.'}, status=400)
+        records = records.filter(class_session__date__range=(date_from, date_to))
     else:
-        is_fraudulent = True
-        fraud_explanation = "Geolocation data missing or could not be obtained."
+        return JsonResponse({'status': 'error', 'message': 'Class session ID or a date range is required.'}, status=400)
 
-    ai_result_dict = {
-        'isFraudulent': is_fraudulent,
-        'fraudExplanation': fraud_explanation
-    }
-    record.ai_result = ai_result_dict
-    record.save()
+    results = fraud_rules.score_records(records, [fraud_rules.GeofenceRule()])
 
     return JsonResponse({
         'status': 'success',
-        'aiResult': ai_result_dict,
-        'attendance_record_id': str(record.id)
+        'scored': len(results),
+        'flagged': sum(1 for result in results.values() if result['isFraudulent']),
+        'results': {str(record_id): result for record_id, result in results.items()},
     })
 
 
@@ -1021,7 +820,7 @@ def validate_attendance(request):
         return JsonResponse({'status': 'error', 'message': 'Attendance record ID is required.'}, status=400)
 
     try:
-        attendance_record = AttendanceRecord.objects.get(id=attendance_record_id)
+        attendance_record = AttendanceRecord.objects.select_related('class_session__course').get(id=attendance_record_id)
         if not attendance_record.class_session.course.teachers.filter(id=request.user.id).exists():
             return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
     except AttendanceRecord.DoesNotExist:
@@ -1030,24 +829,133 @@ def validate_attendance(request):
     attendance_record.is_present = True
     attendance_record.save()
 
-    return JsonResponse({'status': 'success', 'message': 'Attendance validated successfully.'})
-
     # Send Notification to the specific Student whose attendance was validated (personal group)
-    student_group_name = f'user_{attendance_record.student.id}_notifications'
+    class_session = attendance_record.class_session
     send_group_notification(
-        group_name=student_group_name,
+        group_name=user_group(attendance_record.student_id),
         message_type='attendance_validated',
-        message=f"Your attendance for {attendance_record.class_session.course.name} on {attendance_record.class_session.date.strftime('%Y-%m-%d')} has been validated!",
+        message=f"Your attendance for {class_session.course.name} on {class_session.date.strftime('%Y-%m-%d')} has been validated!",
         context={
-            'class_name': str(attendance_record.class_session.course.name), # Use course name
+            'class_name': str(class_session.course.name), # Use course name
             'status': 'present',
             'record_id': str(attendance_record.id),
-            'class_session_id': str(attendance_record.class_session.id),
+            'class_session_id': str(class_session.id),
         }
     )
 
     return JsonResponse({'status': 'success', 'message': 'Attendance validated successfully.'})
-    
+
+# --- Batch Validate Attendance API ---
+@login_required(login_url='/login/')
+@user_passes_test(is_teacher, login_url='/login/')
+@require_POST
+def validate_attendance_batch(request):
+    """
+    API endpoint for teachers to validate many attendance records at once.
+    Accepts either a list of 'attendance_record_ids' or a 'class_session_id'
+    (validates every pending record of that session).
+    Sends one grouped notification per class session; pass 'notify_students=1'
+    to also tell each student about their own record (one message per student).
+    """
+    record_ids = request.POST.getlist('attendance_record_ids')
+    if len(record_ids) == 1 and ',' in record_ids[0]:
+        record_ids = record_ids[0].split(',')
+    class_session_id = request.POST.get('class_session_id')
+    notify_students = request.POST.get('notify_students', '') not in ('', '0', 'false')
+
+    if record_ids:
+        try:
+            record_ids = [int(record_id) for record_id in record_ids]
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid attendance record ID.'}, status=400)
+        records = AttendanceRecord.objects.filter(id__in=record_ids)
+    elif class_session_id:
+        try:
+            class_session_id = int(class_session_id)
+        except ValueError:
+            return JsonResponse({'status': 'error', 'message': 'Invalid class session ID.'}, status=400)
+        # Checked up front: a session without records would otherwise pass unchecked
+        if not ClassSession.objects.filter(id=class_session_id, course__teachers=request.user).exists():
+            return JsonResponse({'status': 'error', 'message': 'Class session not found.'}, status=404)
+        records = AttendanceRecord.objects.filter(class_session_id=class_session_id)
+    else:
+        return JsonResponse({'status': 'error', 'message': 'Attendance record IDs or class session ID are required.'}, status=400)
+
+    with transaction.atomic():
+        # One query loads and locks the target rows together with the teacher permission check.
+        # Concurrent validations of the same records wait here and then see them as present,
+        # so a record is never counted twice in the daily rollups.
+        rows = list(records.select_for_update(of=('self',)).annotate(
+            is_teacher_course=Exists(Course.teachers.through.objects.filter(
+                course_id=OuterRef('class_session__course_id'),
+                user_id=request.user.id,
+            ))
+        ).values(
+            'id', 'is_present', 'is_teacher_course', 'student_id', 'class_session_id',
+            course_id=F('class_session__course_id'),
+            date=F('class_session__date'),
+            course_name=F('class_session__course__name'),
+        ))
+
+        if record_ids and len(rows) != len(set(record_ids)):
+            return JsonResponse({'status': 'error', 'message': 'Attendance record not found.'}, status=404)
+        if any(not row['is_teacher_course'] for row in rows):
+            return JsonResponse({'status': 'error', 'message': 'Permission denied.'}, status=403)
+
+        pending = [row for row in rows if not row['is_present']]
+        pending_ids = [row['id'] for row in pending]
+
+        validated_by_session = {}
+        for row in pending:
+            validated_by_session.setdefault(row['class_session_id'], []).append(row['id'])
+
+        if pending_ids:
+            AttendanceRecord.objects.filter(id__in=pending_ids, is_present=False).update(is_present=True)
+        # update() skips post_save, so apply the deltas to the daily rollups directly
+        deltas = {}
+        for row in pending:
+            key = (row['course_id'], row['date'])
+            deltas[key] = deltas.get(key, 0) + 1
+        increment_daily_stats(deltas)
+        # ...and move the submissions feeds of the touched sessions forward
+        for session_id, session_record_ids in validated_by_session.items():
+            submission_feed.touch_records(session_id, session_record_ids)
+
+    # One grouped notification per class session instead of one per record
+    for session_id, session_record_ids in validated_by_session.items():
+        session_record_ids = [str(record_id) for record_id in session_record_ids]
+        send_group_notification(
+            group_name=class_session_group(session_id),
+            message_type='attendance_validated',
+            message=f"{len(session_record_ids)} attendance records validated.",
+            context={
+                'status': 'present',
+                'record_ids': session_record_ids,
+                'class_session_id': str(session_id),
+            }
+        )
+
+    # Each student only hears about their own record (opt-in: one group send per student)
+    for row in pending if notify_students else ():
+        send_group_notification(
+            group_name=user_group(row['student_id']),
+            message_type='attendance_validated',
+            message=f"Your attendance for {row['course_name']} on {row['date'].strftime('%Y-%m-%d')} has been validated!",
+            context={
+                'class_name': row['course_name'],
+                'status': 'present',
+                'record_id': str(row['id']),
+                'class_session_id': str(row['class_session_id']),
+            }
+        )
+
+    return JsonResponse({
+        'status': 'success',
+        'message': f'{len(pending_ids)} attendance records validated successfully.',
+        'validated_ids': [str(record_id) for record_id in pending_ids],
+        'already_validated': len(rows) - len(pending_ids),
+    })
+
 # --- Get Session Submissions API ---
 @login_required(login_url='/login/')
 @user_passes_test(is_teacher, login_url='/login/')
@@ -1065,10 +973,28 @@ def get_session_submissions(request):
     except ClassSession.DoesNotExist:
         return JsonResponse({'status': 'error', 'message': 'Class session not found.'}, status=404)
 
+    # The feed version doubles as a strong ETag: unchanged feeds never touch the records table
+    version, reset_version = submission_feed.current_version(class_session.id)
+    etag = f'"{class_session.id}-{version}"'
+    not_modified = get_conditional_response(request, etag=etag)
+    if not_modified is not None:
+        not_modified['ETag'] = etag
+        patch_cache_control(not_modified, private=True, no_cache=True)
+        return not_modified
+
     submissions = AttendanceRecord.objects.filter(
         class_session=class_session
     ).select_related('student').order_by('timestamp')
 
+    # ?since=<version>: only rows changed after the version the client has, unless rows were deleted since
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return JsonResponse({'status': 'error', 'message': 'Invalid since version.'}, status=400)
+    full = since <= 0 or since < reset_version or since > version
+    if not full:
+        submissions = submissions.filter(version__gt=since)
+
     student_submissions_data = []
     for sub in submissions:
         student_submissions_data.append({
@@ -1082,7 +1008,15 @@ def get_session_submissions(request):
             'class_session_id': str(class_session.id),
         })
 
-    return JsonResponse({'status': 'success', 'submissions': student_submissions_data})
+    response = JsonResponse({
+        'status': 'success',
+        'submissions': student_submissions_data,
+        'version': version,
+        'full': full,
+    })
+    response['ETag'] = etag
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
 
 # --- Student / Justify Absence ---
 @login_required(login_url='/login/')
@@ -1232,29 +1166,23 @@ def student_justify_absence(request):
 # --- Student Views ---
 
 @login_required(login_url='/login/')
-@user_passes_test(is_student, login_url='/login/')
+@user_passes_test(ais_student, login_url='/login/')
 @require_GET
-def api_student_attendance_history(request):
+@cache_control(private=True, no_cache=True)
+@conditional_page
+async def api_student_attendance_history(request):
     """API endpoint to get student's attendance history"""
     try:
         limit = int(request.GET.get('limit', 10))
-        
+        user = await request.auser()
+
         attendance_history = AttendanceRecord.objects.filter(
-            student=request.user
+            student=user
         ).select_related('class_session__course').order_by('-timestamp')[:limit]
-        
-        history_data = [{
-            'id': str(record.id),
-            'course_name': record.class_session.course.name,
-            'timestamp': record.timestamp.isoformat(),
-            'is_present': record.is_present,
-            'status': 'Present' if record.is_present else 'Pending',
-            'session_date': record.class_session.date.isoformat()
-        } for record in attendance_history]
-        
+
         return JsonResponse({
             'status': 'success',
-            'attendance_history': history_data
+            'attendance_history': await aattendance_records_json(attendance_history)
         })
     except Exception as e:
         return JsonResponse({
@@ -1375,34 +1303,26 @@ def student_dashboard_unified(request):
 
 # API endpoints for student dashboard
 @login_required(login_url='/login/')
-@user_passes_test(is_student, login_url='/login/')
+@user_passes_test(ais_student, login_url='/login/')
 @require_GET
-def api_student_current_classes(request):
+@cache_control(private=True, no_cache=True)
+@conditional_page
+async def api_student_current_classes(request):
     """API endpoint to get currently running classes for the student"""
     try:
         now = timezone.now()
         current_time = now.time()
+        user = await request.auser()
         current_sessions = ClassSession.objects.filter(
-            course__course_enrollments__student=request.user,
+            course__course_enrollments__student=user,
             date=now.date(),
             start_time__lte=current_time,
             end_time__gte=current_time
         ).select_related('course')
-        
-        current_classes = [{
-            'id': session.id,
-            'course_name': session.course.name,
-            'start_datetime': timezone.make_aware(
-                datetime.combine(session.date, session.start_time)
-            ).isoformat(),
-            'end_datetime': timezone.make_aware(
-                datetime.combine(session.date, session.end_time)
-            ).isoformat(),
-        } for session in current_sessions]
-        
+
         return JsonResponse({
             'status': 'success',
-            'current_classes': current_classes
+            'current_classes': await asessions_json(current_sessions)
         })
     except Exception as e:
         return JsonResponse({
@@ -1411,31 +1331,23 @@ def api_student_current_classes(request):
         }, status=500)
 
 @login_required(login_url='/login/')
-@user_passes_test(is_student, login_url='/login/')
+@user_passes_test(ais_student, login_url='/login/')
 @require_GET
-def api_student_today_classes(request):
+@cache_control(private=True, no_cache=True)
+@conditional_page
+async def api_student_today_classes(request):
     """API endpoint to get today's classes for the student"""
     try:
         today = timezone.now().date()
+        user = await request.auser()
         today_sessions = ClassSession.objects.filter(
-            course__course_enrollments__student=request.user,
+            course__course_enrollments__student=user,
             date=today
         ).select_related('course').order_by('start_time')
-        
-        today_classes = [{
-            'id': session.id,
-            'course_name': session.course.name,
-            'start_datetime': timezone.make_aware(
-                datetime.combine(session.date, session.start_time)
-            ).isoformat(),
-            'end_datetime': timezone.make_aware(
-                datetime.combine(session.date, session.end_time)
-            ).isoformat(),
-        } for session in today_sessions]
-        
+
         return JsonResponse({
             'status': 'success',
-            'today_classes': today_classes
+            'today_classes': await asessions_json(today_sessions)
         })
     except Exception as e:
         return JsonResponse({
@@ -1444,34 +1356,26 @@ def api_student_today_classes(request):
         }, status=500)
 
 @login_required(login_url='/login/')
-@user_passes_test(is_student, login_url='/login/')
+@user_passes_test(ais_student, login_url='/login/')
 @require_GET
-def api_student_weekly_classes(request):
+@cache_control(private=True, no_cache=True)
+@conditional_page
+async def api_student_weekly_classes(request):
     """API endpoint to get this week's classes for the student"""
     try:
         today = timezone.now().date()
         week_start = today - timedelta(days=today.weekday())
         week_end = week_start + timedelta(days=6)
-        
+        user = await request.auser()
+
         weekly_sessions = ClassSession.objects.filter(
-            course__course_enrollments__student=request.user,
+            course__course_enrollments__student=user,
             date__range=[week_start, week_end]
         ).select_related('course').order_by('date', 'start_time')
-        
-        weekly_classes = [{
-            'id': session.id,
-            'course_name': session.course.name,
-            'start_datetime': timezone.make_aware(
-                datetime.combine(session.date, session.start_time)
-            ).isoformat(),
-            'end_datetime': timezone.make_aware(
-                datetime.combine(session.date, session.end_time)
-            ).isoformat(),
-        } for session in weekly_sessions]
-        
+
         return JsonResponse({
             'status': 'success',
-            'weekly_classes': weekly_classes
+            'weekly_classes': await asessions_json(weekly_sessions)
         })
     except Exception as e:
         return JsonResponse({
@@ -1593,23 +1497,18 @@ def submit_attendance_code(request):
     if not code:
         return JsonResponse({'status': 'error', 'message': 'Attendance code is required.'}, status=400)
 
-    try:
-        attendance_code_obj = AttendanceCode.objects.select_related('class_session__course').get(code=code)
-        class_session = attendance_code_obj.class_session
-    except AttendanceCode.DoesNotExist:
+    # Code -> session/course/enrolled students comes from the cache while the code is active
+    code_entry = code_cache.lookup(code)
+    if code_entry is None:
         return JsonResponse({'status': 'error', 'message': 'Código de presença inválido.'}, status=400)
 
-    if not attendance_code_obj.is_valid():
+    if not code_cache.is_valid(code_entry):
         return JsonResponse({'status': 'error', 'message': 'Código de presença expirado.'}, status=400)
 
     # Check if student is enrolled
-    if not class_session.course.course_enrollments.filter(student=request.user).exists():
+    if not code_cache.is_enrolled(code_entry, request.user):
         return JsonResponse({'status': 'error', 'message': 'Não está inscrito neste curso.'}, status=403)
 
-    # Prevent duplicate submissions
-    if AttendanceRecord.objects.filter(class_session=class_session, student=request.user).exists():
-        return JsonResponse({'status': 'info', 'message': 'Já enviou a presença para esta aula.'}, status=200)
-
     # Get simulated data
     simulated_ip = request.POST.get('simulated_ip')
     simulated_lat_str = request.POST.get('simulated_latitude')
@@ -1625,34 +1524,39 @@ def submit_attendance_code(request):
         except ValueError:
             logger.warning(f"Invalid geolocation data: lat={simulated_lat_str}, lon={simulated_lon_str}")
 
-    # Create attendance record
-    attendance_record = AttendanceRecord.objects.create(
-        class_session=class_session,
-        student=request.user,
-        is_present=False,  # Initially False, teacher validates
-        simulated_ip=simulated_ip,
+    # Create attendance record; a single INSERT ... ON CONFLICT DO NOTHING also prevents duplicates
+    inserted = insert_attendance_record(
+        code_entry,
+        request.user,
+        simulated_ip=simulated_ip or None,
         simulated_geolocation=simulated_geolocation,
     )
+    if inserted is None:
+        return JsonResponse({'status': 'info', 'message': 'Já enviou a presença para esta aula.'}, status=200)
+    record_id, timestamp = inserted
 
-    # Send real-time notification to teachers
-    teacher_group_name = f'class_session_{class_session.id}_notifications'
+    # Send real-time notification to teachers without waiting for the channel layer
+    class_session_id = code_entry['class_session_id']
     send_group_notification(
-        group_name=teacher_group_name,
+        group_name=class_session_group(class_session_id),
         message_type='student_submitted',
-        message=f"Student {request.user.username} has submitted attendance for {class_session.course.name}.",
+        message=f"Student {request.user.username} has submitted attendance for {code_entry['course_name']}.",
         context={
             'type': 'student_submitted',
-            'id': str(attendance_record.id),
+            'id': str(record_id),
             'name': request.user.get_full_name() or request.user.username,
-            'timestamp': attendance_record.timestamp.isoformat(),
+            'timestamp': timestamp.isoformat(),
             'simulatedIp': simulated_ip,
             'simulatedGeolocation': simulated_geolocation,
             'aiResult': None,
-            'is_present': attendance_record.is_present,
-            'class_session_id': str(class_session.id),
+            'is_present': False,
+            'class_session_id': str(class_session_id),
         }
     )
 
+    # Shared-device check against the session's in-memory IP/location buckets
+    device_sharing.observe(code_entry, record_id, request.user.id, simulated_ip, simulated_geolocation)
+
     return JsonResponse({'status': 'success', 'message': 'Código de presença enviado com sucesso. Aguarda validação do professor.'})
 
 # Home page view
@@ -17,6 +17,12 @@ if 'RAILWAY_ENVIRONMENT' in os.environ or 'DATABASE_URL' in os.environ:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            'OPTIONS': {
+                # Take the write lock up front and queue concurrent writers (code submission bursts)
+                'transaction_mode': 'IMMEDIATE',
+                'timeout': 20,
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
         }
     }
     
@@ -39,6 +45,13 @@ if 'RAILWAY_ENVIRONMENT' in os.environ or 'DATABASE_URL' in os.environ:
         'django.middleware.clickjacking.XFrameOptionsMiddleware',
     ]
     
+    # Per-request timing and SQL metrics (attendance/instrumentation.py), off unless ATTENDANCE_METRICS is set.
+    # Aggregates are served at /api/metrics/requests/ (staff) and /metrics/ (Prometheus text).
+    if os.environ.get('ATTENDANCE_METRICS'):
+        MIDDLEWARE.append('attendance.instrumentation.RequestMetricsMiddleware')
+    ATTENDANCE_METRICS_SAMPLE_RATE = float(os.environ.get('ATTENDANCE_METRICS_SAMPLE_RATE', '0.1'))
+    ATTENDANCE_METRICS_TOKEN = os.environ.get('ATTENDANCE_METRICS_TOKEN')
+    
     # Static files configuration
     STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
     STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
@@ -55,6 +55,13 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request timing and SQL metrics (attendance/instrumentation.py), off unless ATTENDANCE_METRICS is set.
+# Aggregates are served at /api/metrics/requests/ (staff) and /metrics/ (Prometheus text).
+if os.environ.get('ATTENDANCE_METRICS'):
+    MIDDLEWARE.append('attendance.instrumentation.RequestMetricsMiddleware')
+ATTENDANCE_METRICS_SAMPLE_RATE = float(os.environ.get('ATTENDANCE_METRICS_SAMPLE_RATE', '0.1'))
+ATTENDANCE_METRICS_TOKEN = os.environ.get('ATTENDANCE_METRICS_TOKEN')
+
 # CUSTOM USER MODEL 
 AUTH_USER_MODEL = 'core.User'
 
@@ -130,6 +137,12 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Take the write lock up front and queue concurrent writers (code submission bursts)
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+            'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+        },
     }
 }
 
@@ -1,7 +1,13 @@
 # courses/admin.py
 
 from django.contrib import admin
-from .models import Course, ClassSession
+from .models import Course, ClassSession, CourseSchedule, Holiday
+from .scheduling import reconcile
+
+
+class CourseScheduleInline(admin.TabularInline):
+    model = CourseSchedule
+    extra = 0
 
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
@@ -15,6 +21,16 @@ class CourseAdmin(admin.ModelAdmin):
     list_filter = ('teachers',)
     # Use a horizontal filter for ManyToMany relationships for better UX
     filter_horizontal = ('teachers',)
+    inlines = [CourseScheduleInline]
+    actions = ['generate_sessions']
+
+    @admin.action(description='Generate class sessions from the schedules of the selected courses')
+    def generate_sessions(self, request, queryset):
+        result = reconcile(course_ids=list(queryset.values_list('id', flat=True)))
+        message = f'{result.created} sessions created, {result.updated} updated, {result.deleted} deleted.'
+        if result.kept:
+            message += f' {len(result.kept)} unscheduled sessions kept because they already have attendance.'
+        self.message_user(request, message, level='success')
 
 @admin.register(ClassSession)
 class ClassSessionAdmin(admin.ModelAdmin):
@@ -27,3 +43,18 @@ class ClassSessionAdmin(admin.ModelAdmin):
     search_fields = ('course__name', 'date') # Allow searching by course name
     # Add a date hierarchy for easy navigation by date
     date_hierarchy = 'date'
+
+@admin.register(CourseSchedule)
+class CourseScheduleAdmin(admin.ModelAdmin):
+    """
+    Admin interface for the weekly time slots of the courses.
+    Sessions are generated with the Course action or the expand_schedules command.
+    """
+    list_display = ('course', 'weekday', 'start_time', 'end_time', 'term_start', 'term_end')
+    list_filter = ('weekday', 'course')
+    search_fields = ('course__name', 'course__code')
+
+@admin.register(Holiday)
+class HolidayAdmin(admin.ModelAdmin):
+    list_display = ('date', 'name')
+    date_hierarchy = 'date'
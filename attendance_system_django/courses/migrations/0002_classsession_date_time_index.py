@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 07:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='classsession',
+            index=models.Index(fields=['date', 'start_time', 'end_time'], name='classsession_date_time_idx'),
+        ),
+    ]
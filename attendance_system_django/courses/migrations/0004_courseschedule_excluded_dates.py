@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('courses', '0003_course_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courseschedule',
+            name='excluded_dates',
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
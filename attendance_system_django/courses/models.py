@@ -1,4 +1,5 @@
 # courses/models.py
+from django.core.exceptions import ValidationError
 from django.db import models
 from core.models import User # Import your custom User model
 
@@ -22,4 +23,58 @@ class ClassSession(models.Model):
 
     class Meta:
         unique_together = ('course', 'date', 'start_time') # Ensure no duplicate sessions
-        ordering = ['date', 'start_time']
\ No newline at end of file
+        ordering = ['date', 'start_time']
+        indexes = [
+            # "Today/current" lookups across courses; course-scoped lookups use the unique index above
+            models.Index(fields=['date', 'start_time', 'end_time'], name='classsession_date_time_idx'),
+        ]
+
+class Holiday(models.Model):
+    """A day without classes; schedule expansion skips it for every course."""
+    date = models.DateField(unique=True)
+    name = models.CharField(max_length=100, blank=True)
+
+    def __str__(self):
+        return f"{self.date} {self.name}".strip()
+
+    class Meta:
+        ordering = ['date']
+
+
+class CourseSchedule(models.Model):
+    """
+    A weekly time slot of a course during a term. courses.scheduling expands
+    the schedules into ClassSession rows, skipping the Holiday dates and the
+    schedule's own excluded_dates.
+    """
+    WEEKDAY_CHOICES = [
+        (0, 'Monday'),
+        (1, 'Tuesday'),
+        (2, 'Wednesday'),
+        (3, 'Thursday'),
+        (4, 'Friday'),
+        (5, 'Saturday'),
+        (6, 'Sunday'),
+    ]
+
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='schedules')
+    weekday = models.PositiveSmallIntegerField(choices=WEEKDAY_CHOICES)
+    start_time = models.TimeField()
+    end_time = models.TimeField()
+    term_start = models.DateField()
+    term_end = models.DateField()
+    excluded_dates = models.JSONField(default=list, blank=True) # YYYY-MM-DD dates without this class, besides the holidays
+
+    def __str__(self):
+        return (f"{self.course.name} - {self.get_weekday_display()} {self.start_time:%H:%M}-{self.end_time:%H:%M} "
+                f"({self.term_start} to {self.term_end})")
+
+    def clean(self):
+        if self.start_time and self.end_time and self.start_time >= self.end_time:
+            raise ValidationError('The start time must be before the end time.')
+        if self.term_start and self.term_end and self.term_start > self.term_end:
+            raise ValidationError('The term must start before it ends.')
+
+    class Meta:
+        unique_together = ('course', 'weekday', 'start_time', 'term_start')
+        ordering = ['course', 'term_start', 'weekday', 'start_time']
@@ -0,0 +1,141 @@
+# courses/scheduling.py
+"""
+Expansion of CourseSchedule rows into ClassSession rows.
+
+reconcile() computes, in memory, every session the schedules of some
+courses describe over a date window, reads the sessions already in that
+window with one query, and writes only the difference:
+
+- missing (course, date, start_time) keys are bulk inserted,
+- sessions whose end time changed are bulk updated,
+- sessions no schedule describes any more are deleted, unless they already
+  have an attendance code, attendance records or justifications (those are
+  kept and reported, never silently dropped).
+
+Each course is reconciled over its own window: the one asked for, or else
+the span of its own schedules' terms. Courses without schedules are never
+touched, so ad-hoc sessions of unscheduled courses are left alone, and a
+course's sessions outside its terms (a make-up class after the term, say)
+are not deleted because another course's term covers their date.
+"""
+from datetime import date, timedelta
+
+from django.db import transaction
+from django.db.models import Q
+
+from .models import ClassSession, CourseSchedule, Holiday
+
+
+BATCH_SIZE = 1000
+
+
+class ReconcileResult:
+    """What reconcile() did (or would do, on a dry run)."""
+
+    def __init__(self):
+        self.expected = 0
+        self.created = 0
+        self.updated = 0
+        self.deleted = 0
+        self.kept = [] # ids of stale sessions left in place because they have activity
+
+    @property
+    def changed(self):
+        return self.created + self.updated + self.deleted
+
+
+def session_dates(weekday, term_start, term_end, excluded=()):
+    """Every `weekday` (0 = Monday) from term_start to term_end, skipping the excluded dates."""
+    day = term_start + timedelta(days=(weekday - term_start.weekday()) % 7)
+    while day <= term_end:
+        if day not in excluded:
+            yield day
+        day += timedelta(days=7)
+
+
+def expected_sessions(schedules, date_from=None, date_to=None, holidays=()):
+    """{(course id, date, start time): end time} of the sessions the schedules describe within the window."""
+    sessions = {}
+    for schedule in schedules:
+        term_start = max(schedule.term_start, date_from) if date_from else schedule.term_start
+        term_end = min(schedule.term_end, date_to) if date_to else schedule.term_end
+        excluded = set(holidays)
+        excluded.update(date.fromisoformat(value) for value in schedule.excluded_dates or ())
+        for day in session_dates(schedule.weekday, term_start, term_end, excluded):
+            sessions.setdefault((schedule.course_id, day, schedule.start_time), schedule.end_time)
+    return sessions
+
+
+def course_windows(schedules, date_from=None, date_to=None):
+    """{course id: (first, last day)}: the given window, or else the span of each course's own terms."""
+    windows = {}
+    for schedule in schedules:
+        first, last = windows.get(schedule.course_id, (schedule.term_start, schedule.term_end))
+        windows[schedule.course_id] = (min(first, schedule.term_start), max(last, schedule.term_end))
+    return {
+        course_id: (date_from or first, date_to or last) for course_id, (first, last) in windows.items()
+    }
+
+
+def reconcile(course_ids=None, date_from=None, date_to=None, dry_run=False, batch_size=BATCH_SIZE):
+    """
+    Brings the ClassSession rows of the scheduled courses (all, or `course_ids`)
+    in line with their schedules between date_from and date_to (default, per
+    course: the span of its own terms). Returns a ReconcileResult.
+    """
+    result = ReconcileResult()
+    schedules = CourseSchedule.objects.all()
+    if course_ids is not None:
+        schedules = schedules.filter(course_id__in=course_ids)
+    if date_from:
+        schedules = schedules.filter(term_end__gte=date_from)
+    if date_to:
+        schedules = schedules.filter(term_start__lte=date_to)
+    schedules = list(schedules)
+    if not schedules:
+        return result
+
+    windows = course_windows(schedules, date_from, date_to)
+    date_from = min(first for first, _ in windows.values())
+    date_to = max(last for _, last in windows.values())
+    holidays = set(Holiday.objects.filter(date__range=(date_from, date_to)).values_list('date', flat=True))
+    expected = expected_sessions(schedules, date_from, date_to, holidays)
+    result.expected = len(expected)
+
+    # One query over the overall window; each course then only keeps its own
+    existing = {
+        (course_id, day, start_time): (session_id, end_time)
+        for session_id, course_id, day, start_time, end_time in ClassSession.objects.filter(
+            course_id__in=windows, date__range=(date_from, date_to)
+        ).values_list('id', 'course_id', 'date', 'start_time', 'end_time')
+        if windows[course_id][0] <= day <= windows[course_id][1]
+    }
+
+    to_create = [
+        ClassSession(course_id=course_id, date=day, start_time=start_time, end_time=end_time)
+        for (course_id, day, start_time), end_time in expected.items() if (course_id, day, start_time) not in existing
+    ]
+    to_update = [
+        ClassSession(id=session_id, end_time=expected[key])
+        for key, (session_id, end_time) in existing.items() if key in expected and expected[key] != end_time
+    ]
+    stale = [session_id for key, (session_id, _) in existing.items() if key not in expected]
+    if stale:
+        # Sessions that already saw activity stay, whatever the schedule says now
+        result.kept = sorted(set(ClassSession.objects.filter(id__in=stale).filter(
+            Q(attendance_code__isnull=False) | Q(attendance_records__isnull=False) | Q(justifications__isnull=False)
+        ).values_list('id', flat=True)))
+    to_delete = sorted(set(stale) - set(result.kept))
+
+    result.created = len(to_create)
+    result.updated = len(to_update)
+    result.deleted = len(to_delete)
+    if dry_run:
+        return result
+
+    with transaction.atomic():
+        ClassSession.objects.bulk_create(to_create, batch_size=batch_size, ignore_conflicts=True)
+        ClassSession.objects.bulk_update(to_update, ['end_time'], batch_size=batch_size)
+        for start in range(0, len(to_delete), batch_size):
+            ClassSession.objects.filter(id__in=to_delete[start:start + batch_size]).delete()
+    return result
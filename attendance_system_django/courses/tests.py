@@ -1,3 +1,92 @@
+from datetime import date, time, timedelta
+
 from django.test import TestCase
+from django.utils import timezone
+
+from core.models import User
+from attendance.models import AttendanceCode
+from .models import ClassSession, Course, CourseSchedule, Holiday
+from .scheduling import reconcile
+
+
+class ReconcileTests(TestCase):
+    """reconcile() over one course with a Monday 09:00-11:00 slot for three weeks."""
+
+    term_start = date(2030, 1, 7) # A Monday
+    term_end = date(2030, 1, 27)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(name='Scheduled Course', code='SCHED1')
+        cls.other = Course.objects.create(name='Unscheduled Course', code='ADHOC1')
+        cls.schedule = CourseSchedule.objects.create(
+            course=cls.course, weekday=0, start_time=time(9), end_time=time(11),
+            term_start=cls.term_start, term_end=cls.term_end,
+        )
+
+    def sessions(self, course=None):
+        return list(ClassSession.objects.filter(course=course or self.course).order_by('date').values_list(
+            'date', 'start_time', 'end_time'
+        ))
+
+    def test_creates_missing_sessions(self):
+        result = reconcile()
+        self.assertEqual((result.expected, result.created, result.updated, result.deleted), (3, 3, 0, 0))
+        self.assertEqual(self.sessions(), [
+            (self.term_start + timedelta(weeks=week), time(9), time(11)) for week in range(3)
+        ])
+        self.assertEqual(reconcile().changed, 0)
+
+    def test_skips_holidays_and_excluded_dates(self):
+        Holiday.objects.create(date=self.term_start, name='Holiday')
+        self.schedule.excluded_dates = [(self.term_start + timedelta(weeks=2)).isoformat()]
+        self.schedule.save()
+        reconcile()
+        self.assertEqual([day for day, _, _ in self.sessions()], [self.term_start + timedelta(weeks=1)])
+
+    def test_updates_changed_end_times(self):
+        reconcile()
+        self.schedule.end_time = time(12)
+        self.schedule.save()
+        result = reconcile()
+        self.assertEqual((result.created, result.updated, result.deleted), (0, 3, 0))
+        self.assertEqual({end_time for _, _, end_time in self.sessions()}, {time(12)})
+
+    def test_deletes_unscheduled_sessions(self):
+        reconcile()
+        extra = ClassSession.objects.create(course=self.course, date=date(2030, 1, 9), start_time=time(14), end_time=time(15))
+        adhoc = ClassSession.objects.create(course=self.other, date=date(2030, 1, 9), start_time=time(14), end_time=time(15))
+        result = reconcile()
+        self.assertEqual((result.created, result.deleted, result.kept), (0, 1, []))
+        self.assertFalse(ClassSession.objects.filter(id=extra.id).exists())
+        # Courses without schedules are never touched
+        self.assertTrue(ClassSession.objects.filter(id=adhoc.id).exists())
+
+    def test_keeps_unscheduled_sessions_with_activity(self):
+        reconcile()
+        session = ClassSession.objects.get(course=self.course, date=self.term_start)
+        teacher = User.objects.create_user(username='sched.teacher', password='x', role='teacher')
+        AttendanceCode.objects.create(class_session=session, generated_by=teacher, expires_at=timezone.now())
+        self.schedule.term_start = self.term_start + timedelta(weeks=1)
+        self.schedule.save()
+
+        result = reconcile(date_from=self.term_start)
+        self.assertEqual((result.deleted, result.kept), (0, [session.id]))
+        self.assertEqual(len(self.sessions()), 3)
+
+    def test_other_courses_terms_do_not_widen_the_window(self):
+        CourseSchedule.objects.create(
+            course=self.other, weekday=2, start_time=time(14), end_time=time(16),
+            term_start=date(2030, 1, 2), term_end=date(2030, 6, 26),
+        )
+        reconcile()
+        # A make-up class of the first course after its term, inside the other course's term
+        makeup = ClassSession.objects.create(course=self.course, date=date(2030, 3, 4), start_time=time(9), end_time=time(11))
+        result = reconcile()
+        self.assertEqual((result.created, result.deleted), (0, 0))
+        self.assertTrue(ClassSession.objects.filter(id=makeup.id).exists())
 
-# Create your tests here.
+    def test_dry_run_writes_nothing(self):
+        result = reconcile(dry_run=True)
+        self.assertEqual(result.created, 3)
+        self.assertEqual(self.sessions(), [])